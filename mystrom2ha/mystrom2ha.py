@@ -14,38 +14,161 @@
 import os
 import threading
 import logging
+import logging.handlers
+import atexit
+import html
 import sys
 import json
 import locale
 import time
 import datetime
+import argparse
+import concurrent.futures
+import io
+import hashlib
+import queue
+import re
+import ipaddress
+import bisect
+import gzip
+import zlib
+import collections
+import marshal
 from http.server import BaseHTTPRequestHandler, HTTPStatus, HTTPServer
 import socket
 from socket import getaddrinfo, AF_INET, gethostname
 import urllib
-import urllib.request
 import urllib.parse
-from urllib.parse import urlparse
 
-import paho.mqtt.client as mqtt_client
-import paho.mqtt.publish as mqtt_publish
-import paho.mqtt.subscribe as mqtt_subscribe
+# imported on first use, so the http server is up before them:
+# paho-mqtt (import_mqtt), urllib.request (programming and probing the devices), asyncio (only with --asyncio)
+mqtt_client = None
 
 #global variables
+startup_import_cpu = time.process_time()
+startup_phases = []
+startup_profile = False
+log_ring = None
+log_listener = None
+log_file_max_bytes = 1048576
+log_file_backups = 3
+log_ring_size = 2000
+log_levels = ("DEBUG", "INFO", "WARNING", "ERROR")
 my_local_ip = ""
 button_request_port = 32570
 end_ha2mqtt = False
+worker_count = 1
+worker_index = 0
+worker_restart_delay = 1
+report_route_local = threading.local()
+report_route_timeout = 2
+config_mtime = 0
+search_state_max_age = 90
+profile_capture = None
+profile_top_count = 30
+profile_sort_keys = ("cumulative", "tottime")
+profile_sample_interval = 0.005
+recorder = None
+recorder_lock = threading.Lock()
+recorder_max_bytes = 10485760
+beacon_listener = None
+beacon_listener_lock = threading.Lock()
+beacon_port = 7979
+beacon_device_types = (103, 104, 110, 118)
+presence_max_age = 300
+presence_seen = {}
+presence_written = 0
+presence_write_interval = 5
 my_lang = "DE"
 my_config = dict()
 lang = dict()
+lang_tables = {}
+lang_tables_lock = threading.Lock()
+page_fragments = {}
+static_types = {".css": "text/css", ".htm": "text/html", ".html": "text/html", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png"}
+static_assets = {}
+static_assets_lock = threading.Lock()
+static_sendfile_size = 65536
+static_max_age = 3600
+keepalive_idle_timeout = 5
+keepalive_max_requests = 100
+keepalive_max_connections = 10
+keepalive_connections = 0
+keepalive_lock = threading.Lock()
 access_password = ""
 button_search_running = False
 button_ips = []
-the_found_button_type = {}
-the_found_button_mac = {}
 given_password = ""
-the_percentage = ""
+button_search = None
+button_search_lock = threading.Lock()
+button_search_counter = 0
 timeout_start = time.time() - 600
+mqtt_publisher = None
+mqtt_publisher_lock = threading.Lock()
+mqtt_publisher_connected = threading.Event()
+discovery_cache = {}
+discovery_cache_lock = threading.Lock()
+report_publisher_count = 4
+report_queue_size = 1000
+report_queues = []
+report_stats = {"queued": 0, "published": 0, "dropped": 0, "invalid": 0, "duplicates": 0, "max_depth": 0, "lag_sum": 0.0, "lag_max": 0.0}
+report_stats_lock = threading.Lock()
+registry = None
+metrics_buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+metrics_lock = threading.Lock()
+metrics_histograms = {}
+metrics_counters = {}
+metrics_gauges = {}
+metrics_help = {
+    "mystrom2ha_button_reports_total": ("counter", "button reports received, by device type and action code"),
+    "mystrom2ha_report_parse_seconds": ("histogram", "time to parse the query string of a button report"),
+    "mystrom2ha_broker_connect_seconds": ("histogram", "time spent waiting for the MQTT publisher connection"),
+    "mystrom2ha_publish_seconds": ("histogram", "time to publish one button report to MQTT"),
+    "mystrom2ha_report_lag_seconds": ("histogram", "time from receiving a button report to the end of its publish"),
+    "mystrom2ha_request_seconds": ("histogram", "total http handler time, by route"),
+    "mystrom2ha_mqtt_errors_total": ("counter", "button reports that could not be published, by device type"),
+    "mystrom2ha_active_workers": ("gauge", "http requests currently being handled"),
+    "mystrom2ha_report_queue_depth": ("gauge", "button reports waiting for a publisher thread"),
+    "mystrom2ha_mqtt_connected": ("gauge", "1 if the shared MQTT publisher is connected"),
+    "mystrom2ha_dedup_total": ("counter", "duplicate check of button reports, hit = retry of a report that was dropped"),
+    "mystrom2ha_telemetry_total": ("counter", "battery, temp, rh, light and name values, published or suppressed as unchanged"),
+    "mystrom2ha_journal_events_total": ("counter", "button reports of the store-and-forward journal, by result"),
+    "mystrom2ha_journal_pending": ("gauge", "button reports in the journal waiting for replay"),
+    "mystrom2ha_journal_replay_rate": ("gauge", "button reports per second of the last journal replay"),
+    "mystrom2ha_battery_poll_total": ("counter", "battery and health polls of known devices, by result"),
+    "mystrom2ha_beacons_total": ("counter", "UDP 7979 beacons of the passive discovery listener, by result"),
+    "mystrom2ha_devices_present": ("gauge", "devices seen in the last 300 s (beacon, report, poll or search)"),
+    "mystrom2ha_report_route_errors_total": ("counter", "with --workers: button reports the owner worker did not take, queued by the receiving worker"),
+}
+dedup_entries = collections.OrderedDict()
+dedup_lock = threading.Lock()
+dedup_max_entries = 1024
+telemetry_cache = {}
+telemetry_cache_lock = threading.Lock()
+telemetry_deadbands = {"battery": "telemetry_deadband_battery", "temp": "telemetry_deadband_temp", "rh": "telemetry_deadband_rh", "light": "telemetry_deadband_light"}
+wheel_pending = {}
+wheel_pending_lock = threading.Lock()
+bulk_program_workers = 8
+registry_seen_interval = 300
+registry_compact_factor = 4
+scan_probe_workers = 64
+scan_probe_timeout = 0.8
+journal = None
+journal_max_bytes = 1048576
+journal_compact_every = 50
+battery_poll_workers = 4
+battery_poll_timeout = 2
+battery_poll_start_delay = 30
+battery_poll_max_interval = 86400
+battery_poll_schedule = {}
+battery_poll_wakeup = threading.Event()
+# device type -> api endpoint asked by the battery poller, the PIR has no battery and is only checked for reachability
+battery_poll_endpoints = {"103": "/api/v1/device", "104": "/api/v1/device", "118": "/api/v1/sensors", "110": "/api/v1/info"}
+# settings added after the first release, filled into existing config.json files
+config_defaults = {"wheel_rate": "4", "scan_mode": "broadcast", "scan_subnets": "", "scan_expected": "0", "journal_max_age": "60", "journal_replay_rate": "20", "dedup_window": "0",
+                   "telemetry_heartbeat": "900", "telemetry_deadband_battery": "5", "telemetry_deadband_temp": "0.2", "telemetry_deadband_rh": "2", "telemetry_deadband_light": "10",
+                   "battery_poll_interval": "3600", "battery_poll_low": "20", "report_record": "0",
+                   "passive_discovery": "0"}
 
 
 def get_local_ip():
@@ -91,23 +214,464 @@ def get_script_directory():
     else:
         return os.path.dirname(path)
 
+class profile_capture_run:
+    # one capture of /webif?action=profile. cProfile can not do this: on python 3.12 it hooks sys.monitoring for the whole
+    # process, a second enable() fails and every profile records the frames of all threads.
+    # So one sampler thread reads sys._current_frames() every profile_sample_interval and keeps the stacks of the threads
+    # that are inside a GET handler at that moment, mqtt, journal and poller threads are not in it.
+    # The times are wall clock (waiting on a socket counts), ncalls is the number of samples, not of calls.
+    def __init__(self, the_requests, the_seconds):
+        self.lock = threading.Lock()
+        self.max_requests = the_requests
+        self.started = time.time()
+        self.end = self.started + the_seconds
+        self.requests = 0
+        self.samples = 0
+        self.stopped = False
+        self.threads = set()
+        self.own = collections.Counter()
+        self.calls = collections.Counter()
+        self.callers = collections.defaultdict(collections.Counter)
+        self.stats = {}
+        threading.Thread(target=self.sample_loop, daemon=True).start()
+
+    def is_running(self):
+        return not self.stopped and self.requests < self.max_requests and time.time() < self.end
+
+    def stop(self):
+        self.stopped = True
+
+    def enter(self):
+        with self.lock:
+            self.threads.add(threading.get_ident())
+
+    def leave(self):
+        with self.lock:
+            self.threads.discard(threading.get_ident())
+            self.requests += 1
+
+    def sample_loop(self):
+        while self.is_running():
+            time.sleep(profile_sample_interval)
+            the_frames = sys._current_frames()
+            with self.lock:
+                for the_ident in self.threads:
+                    the_frame = the_frames.get(the_ident)
+                    the_stack = []
+                    while the_frame is not None:
+                        the_code = the_frame.f_code
+                        the_stack.append((the_code.co_filename, the_code.co_firstlineno, the_code.co_name))
+                        if the_code.co_name == "do_GET":
+                            break
+                        the_frame = the_frame.f_back
+                    if not the_stack:
+                        continue
+                    self.samples += 1
+                    self.own[the_stack[0]] += 1
+                    for the_key in set(the_stack):
+                        self.calls[the_key] += 1
+                    for i in range(len(the_stack) - 1):
+                        self.callers[the_stack[i]][the_stack[i + 1]] += 1
+            del the_frames
+
+    def create_stats(self):
+        # the dict of pstats, {(file, line, name): (cc, nc, tt, ct, callers)}, called with self.lock held
+        self.stats = {}
+        for the_key, the_count in self.calls.items():
+            self.stats[the_key] = (the_count, the_count, self.own[the_key] * profile_sample_interval, the_count * profile_sample_interval, dict(self.callers[the_key]))
+
+    def get_top(self, the_sort, the_count):
+        import pstats
+        the_text = io.StringIO()
+        with self.lock:
+            if self.samples == 0:
+                return ""
+            the_stats = pstats.Stats(self, stream=the_text)
+        the_stats.sort_stats(the_sort).print_stats(the_count)
+        return the_text.getvalue()
+
+    def get_dump(self):
+        # the format of pstats.Stats.dump_stats, for python -m pstats or snakeviz
+        with self.lock:
+            self.create_stats()
+            return marshal.dumps(self.stats)
+
+class report_recorder:
+    # with report_record = 1 every /button_report query goes to reports.rec as "<time.monotonic()> <query>" lines,
+    # replayed by mystrom2ha_bench.py replay. The monotonic clock is the same in all workers, so they share the file.
+    def __init__(self, the_path):
+        self.lock = threading.Lock()
+        self.file = open(the_path, 'ab', buffering=0)
+        self.size = os.path.getsize(the_path)
+
+    def record(self, the_query):
+        the_line = b"%.3f %s\n" % (time.monotonic(), the_query.encode("utf-8", "replace"))
+        with self.lock:
+            if self.size + len(the_line) > recorder_max_bytes:
+                return
+            # one write per line, O_APPEND keeps the lines of the workers apart
+            self.file.write(the_line)
+            self.size += len(the_line)
+            if self.size + len(the_line) > recorder_max_bytes:
+                logging.error("error report recorder - reports.rec reached " + str(recorder_max_bytes) + " bytes, recording stopped")
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+def update_report_recorder():
+    # opens or closes reports.rec after the config changed
+    global recorder
+    with recorder_lock:
+        if my_config.get("report_record", "0") == "1" and recorder is None:
+            try:
+                recorder = report_recorder(get_script_directory() + '/reports.rec')
+            except Exception as ex:
+                logging.error("error report recorder - "+str(ex))
+        elif my_config.get("report_record", "0") != "1" and recorder is not None:
+            recorder.close()
+            recorder = None
+
+class log_ring_handler(logging.Handler):
+    # the last log_ring_size records for the log page of the web interface
+    def __init__(self, the_size):
+        logging.Handler.__init__(self)
+        self.records = collections.deque(maxlen=the_size)
+
+    def emit(self, the_record):
+        try:
+            the_entry = (the_record.created, the_record.levelname, self.format(the_record))
+            with self.lock:
+                self.records.append(the_entry)
+        except Exception:
+            self.handleError(the_record)
+
+    def get_records(self, the_level, the_filter, the_limit):
+        # newest first
+        the_level_number = logging.getLevelName(the_level)
+        with self.lock:
+            the_records = list(self.records)
+        the_result = []
+        for the_created, the_level_name, the_message in reversed(the_records):
+            if logging.getLevelName(the_level_name) < the_level_number:
+                continue
+            if the_filter and the_filter.lower() not in the_message.lower():
+                continue
+            the_result.append((the_created, the_level_name, the_message))
+            if len(the_result) >= the_limit:
+                break
+        return the_result
+
+def setup_logging(the_level):
+    # request handlers only put records into a queue, one listener thread writes the rotating file and the ring buffer.
+    # The file keeps the ERROR level of older versions, the ring buffer gets the_level.
+    # With --workers every worker rotates its own file, worker 0 keeps mystrom2ha.log.
+    global log_ring
+    global log_listener
+    the_format = logging.Formatter("%(asctime)s - MyStrom2HA: %(message)s", datefmt="%H:%M:%S")
+    the_log_path = get_script_directory() + ('/mystrom2ha.log' if worker_index == 0 else '/mystrom2ha.' + str(worker_index) + '.log')
+    the_file_handler = logging.handlers.RotatingFileHandler(the_log_path, maxBytes=log_file_max_bytes, backupCount=log_file_backups)
+    the_file_handler.setFormatter(the_format)
+    the_file_handler.setLevel(logging.ERROR)
+    log_ring = log_ring_handler(log_ring_size)
+    log_ring.setFormatter(logging.Formatter("%(message)s"))
+    the_queue = queue.SimpleQueue()
+    the_root_logger = logging.getLogger()
+    the_root_logger.setLevel(the_level)
+    the_root_logger.addHandler(logging.handlers.QueueHandler(the_queue))
+    log_listener = logging.handlers.QueueListener(the_queue, the_file_handler, log_ring, respect_handler_level=True)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+
+class metrics_histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(metrics_buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, the_value):
+        self.counts[bisect.bisect_left(metrics_buckets, the_value)] += 1
+        self.sum += the_value
+        self.count += 1
+
+    def render(self, the_name, the_labels):
+        the_lines = []
+        the_cumulative = 0
+        for the_bucket, the_count in zip(metrics_buckets + (float("inf"),), self.counts):
+            the_cumulative += the_count
+            the_le = "+Inf" if the_bucket == float("inf") else repr(the_bucket)
+            the_lines.append(the_name + "_bucket{" + the_labels + ("," if the_labels else "") + "le=\"" + the_le + "\"} " + str(the_cumulative))
+        the_suffix = "{" + the_labels + "}" if the_labels else ""
+        the_lines.append(the_name + "_sum" + the_suffix + " " + repr(self.sum))
+        the_lines.append(the_name + "_count" + the_suffix + " " + str(self.count))
+        return the_lines
+
+def metrics_observe(the_name, the_labels, the_value):
+    with metrics_lock:
+        the_histogram = metrics_histograms.get((the_name, the_labels))
+        if the_histogram is None:
+            the_histogram = metrics_histogram()
+            metrics_histograms[(the_name, the_labels)] = the_histogram
+        the_histogram.observe(the_value)
+
+def metrics_count(the_name, the_labels, the_value=1):
+    with metrics_lock:
+        metrics_counters[(the_name, the_labels)] = metrics_counters.get((the_name, the_labels), 0) + the_value
+
+def metrics_gauge(the_name, the_value):
+    with metrics_lock:
+        metrics_gauges[the_name] = metrics_gauges.get(the_name, 0) + the_value
+
+def get_metrics_route(the_path):
+    if the_path.startswith('/button_report'):
+        return "button_report"
+    if the_path.startswith('/webif'):
+        return "webif"
+    if the_path.endswith(('.css', '.htm', '.html', '.jpg', '.jpeg', '.png')):
+        return "static"
+    return "other"
+
+def join_metrics_labels(the_labels, the_more):
+    return the_labels + ("," if the_labels and the_more else "") + the_more
+
+def render_metrics():
+    # Prometheus text format 0.0.4
+    # with --workers a scrape reaches one of the workers, its series carry worker="<index>", sum them up by that label
+    the_worker = "worker=\"" + str(worker_index) + "\"" if worker_count > 1 else ""
+    metrics_gauges_now = {"mystrom2ha_report_queue_depth": sum(the_report_queue.qsize() for the_report_queue in report_queues),
+                          "mystrom2ha_mqtt_connected": 1 if mqtt_publisher_connected.is_set() else 0,
+                          "mystrom2ha_journal_pending": journal.pending() if journal is not None else 0,
+                          "mystrom2ha_journal_replay_rate": round(journal.stats["replay_rate"], 2) if journal is not None else 0,
+                          "mystrom2ha_devices_present": len(get_present_devices()) if registry is not None else 0}
+    the_lines = []
+    with metrics_lock:
+        metrics_gauges_now.update(metrics_gauges)
+        for the_name in sorted(metrics_help.keys()):
+            the_type, the_help = metrics_help[the_name]
+            the_lines.append("# HELP " + the_name + " " + the_help)
+            the_lines.append("# TYPE " + the_name + " " + the_type)
+            if the_type == "histogram":
+                for (the_key, the_labels), the_histogram in sorted(metrics_histograms.items()):
+                    if the_key == the_name:
+                        the_lines.extend(the_histogram.render(the_name, join_metrics_labels(the_labels, the_worker)))
+            elif the_type == "counter":
+                for (the_key, the_labels), the_value in sorted(metrics_counters.items()):
+                    if the_key == the_name:
+                        the_labels = join_metrics_labels(the_labels, the_worker)
+                        the_lines.append(the_name + ("{" + the_labels + "}" if the_labels else "") + " " + str(the_value))
+            elif the_name in metrics_gauges_now:
+                the_lines.append(the_name + ("{" + the_worker + "}" if the_worker else "") + " " + str(metrics_gauges_now[the_name]))
+    return "\n".join(the_lines) + "\n"
+
+def select_text_snippets(the_lang):
+    # the snippets are static, build them once per language in a table of their own,
+    # the global only ever points to a complete table, request threads read it without the lock
+    global lang
+    the_key = "DE" if the_lang == "DE" else "EN"
+    with lang_tables_lock:
+        if the_key not in lang_tables:
+            the_table = dict()
+            if the_key == "DE":
+                declare_text_snippets_de(the_table)
+            else:
+                declare_text_snippets_en(the_table)
+            lang_tables[the_key] = the_table
+        lang = lang_tables[the_key]
+
+class page_buffer:
+    # wfile for button_server_handler, collects the page to send it with Content-Length in one write
+    # flush() switches to streaming for pages that report progress
+    def __init__(self, the_handler):
+        self.handler = the_handler
+        self.wfile = the_handler.wfile
+        self.content_type = "text/html"
+        self.extra_headers = []
+        self.parts = []
+        self.streaming = False
+
+    def write(self, the_data):
+        if self.streaming:
+            self.wfile.write(the_data)
+        else:
+            self.parts.append(the_data)
+        return len(the_data)
+
+    def send_page(self, the_length):
+        # the headers are written into the buffer too, so head and body leave in one write
+        the_body = b"".join(self.parts)
+        self.parts = []
+        self.handler.send_response(200)
+        self.handler.send_header("Content-type", self.content_type)
+        for the_name, the_value in self.extra_headers:
+            self.handler.send_header(the_name, the_value)
+        if the_length:
+            self.handler.send_header("Content-Length", str(len(the_body)))
+        else:
+            # a stream ends with the connection
+            self.handler.send_header("Connection", "close")
+        self.handler.end_headers()
+        self.parts.append(the_body)
+        self.wfile.write(b"".join(self.parts))
+        self.parts = []
+
+    def flush(self):
+        if not self.streaming:
+            self.send_page(False)
+            self.streaming = True
+        self.wfile.flush()
+
+    def finish(self):
+        if not self.streaming:
+            self.send_page(True)
+
+class static_asset:
+    # a file of the script directory, small ones are kept in memory (text also gzipped), large ones go out with sendfile
+    __slots__ = ("path", "content_type", "size", "etag", "gzip_etag", "data", "gzip_data")
+
+    def __init__(self, the_path, the_content_type):
+        self.path = the_path
+        self.content_type = the_content_type
+        self.size = os.path.getsize(the_path)
+        self.data = None
+        self.gzip_data = None
+        self.gzip_etag = None
+        the_hash = hashlib.sha1()
+        with open(the_path, 'rb') as f:
+            if self.size <= static_sendfile_size or the_content_type.startswith("text/"):
+                self.data = f.read()
+                the_hash.update(self.data)
+            else:
+                for the_chunk in iter(lambda: f.read(65536), b""):
+                    the_hash.update(the_chunk)
+        self.etag = "\"" + the_hash.hexdigest()[:16] + "\""
+        if self.data is not None and the_content_type.startswith("text/"):
+            the_gzip_data = gzip.compress(self.data, 9)
+            if len(the_gzip_data) < len(self.data):
+                self.gzip_data = the_gzip_data
+                # each representation gets its own strong etag
+                self.gzip_etag = self.etag[:-1] + "-gz\""
+
+def accepts_gzip(the_header):
+    # Accept-Encoding is a comma separated list with q-values, gzip;q=0 refuses gzip, * stands for the codings not named
+    if the_header is None:
+        return False
+    the_any = False
+    for the_entry in the_header.split(","):
+        the_coding, the_separator, the_parameters = the_entry.partition(";")
+        the_coding = the_coding.strip().lower()
+        the_quality = 1.0
+        for the_parameter in the_parameters.split(";"):
+            the_name, the_separator, the_value = the_parameter.partition("=")
+            if the_name.strip().lower() == "q":
+                try:
+                    the_quality = float(the_value)
+                except ValueError:
+                    the_quality = 0.0
+        if the_coding == "gzip" or the_coding == "x-gzip":
+            return the_quality > 0
+        if the_coding == "*":
+            the_any = the_quality > 0
+    return the_any
+
+def etag_matches(the_header, the_etag):
+    # If-None-Match is a comma separated list, weak comparison, "*" matches any
+    if the_header is None:
+        return False
+    for the_tag in the_header.split(","):
+        the_tag = the_tag.strip()
+        if the_tag.startswith("W/"):
+            the_tag = the_tag[2:]
+        if the_tag == "*" or the_tag == the_etag:
+            return True
+    return False
+
+def get_static_asset(the_path):
+    the_name = the_path.lstrip("/")
+    with static_assets_lock:
+        the_asset = static_assets.get(the_name)
+    if the_asset is None and "/" not in the_name and os.path.isfile(get_script_directory() + "/" + the_name):
+        # a file that appeared after the start
+        try:
+            the_asset = static_asset(get_script_directory() + "/" + the_name, static_types[os.path.splitext(the_name)[1]])
+            with static_assets_lock:
+                static_assets[the_name] = the_asset
+        except Exception as ex:
+            logging.error("error static asset - "+str(ex))
+    return the_asset
+
+def load_static_assets():
+    the_assets = {}
+    for the_name in os.listdir(get_script_directory()):
+        the_extension = os.path.splitext(the_name)[1]
+        if the_extension in static_types and os.path.isfile(get_script_directory() + "/" + the_name):
+            try:
+                the_assets[the_name] = static_asset(get_script_directory() + "/" + the_name, static_types[the_extension])
+            except Exception as ex:
+                logging.error("error static asset - "+str(ex))
+    with static_assets_lock:
+        static_assets.clear()
+        static_assets.update(the_assets)
+
+def get_page_fragments():
+    # parts of every page that only depend on the language (and the year in the footer)
+    the_key = lang['lang'] + str(datetime.date.today().year)
+    the_fragments = page_fragments.get(the_key)
+    if the_fragments is None:
+        the_fragments = dict()
+        the_fragments["head"] = bytes("<html><head><title>" + lang['headline'] + "</title>"
+                                      + "<meta charset=\"UTF-8\">"
+                                      + "<link rel=\"stylesheet\" href=\"/mystrom2ha.css\">"
+                                      + "<link href=\"https://fonts.googleapis.com/icon?family=Material+Icons\" rel=\"stylesheet\">"
+                                      + "<script src=\"https://ajax.googleapis.com/ajax/libs/jquery/3.7.1/jquery.min.js\"></script>"
+                                      + "</head><body>", "utf-8")
+        the_fragments["footer"] = bytes("<div id =\"rsFooter\" class =\"footer\" style=\"height:22;\">"
+                                        + "<p class=\"footertext\">(c) <a href = \"https://www.computeq.co/\" class=\"footerlink\">MyStrom2HA by Computeq</a> 2024-" + str(datetime.date.today().year) + "</p>"
+                                        + "</div></body></html>", "utf-8")
+        page_fragments[the_key] = the_fragments
+    return the_fragments
+
 def write_sub_head_line (the_instance, the_title):
     the_instance.wfile.write(bytes("<br><p style=\"margin-left: 15px; font-size:22px;\">" + the_title + "</p>", "utf-8"))
 
 def write_input_text (the_instance, the_id, the_name, the_label, the_value, the_required):
-    the_instance.wfile.write(bytes("<div class=\"rs-input-group\">", "utf-8"))
-    the_instance.wfile.write(bytes("<input type=\"text\" id=\"" + the_id + "\" name=\"" + the_name + "\" class=\"rs-input\" value=\"" + the_value + "\"", "utf-8"))
-    if the_required:
-        the_instance.wfile.write(bytes(" required=\"\"", "utf-8"))
-    the_instance.wfile.write(bytes(">", "utf-8"))
-    the_instance.wfile.write(bytes("<span class=\"rs-highlight\"></span><span class=\"rs-bar\"></span>", "utf-8"))
-    the_instance.wfile.write(bytes("<label for=\"" + the_id + "\" class=\"rs-input-label\">" + the_label + "</label>", "utf-8"))
-    the_instance.wfile.write(bytes("</div>", "utf-8"))
+    the_instance.wfile.write(bytes("<div class=\"rs-input-group\">"
+                                   + "<input type=\"text\" id=\"" + the_id + "\" name=\"" + the_name + "\" class=\"rs-input\" value=\"" + the_value + "\""
+                                   + (" required=\"\"" if the_required else "") + ">"
+                                   + "<span class=\"rs-highlight\"></span><span class=\"rs-bar\"></span>"
+                                   + "<label for=\"" + the_id + "\" class=\"rs-input-label\">" + the_label + "</label>"
+                                   + "</div>", "utf-8"))
+
+def import_mqtt():
+    global mqtt_client
+    if mqtt_client is None:
+        import paho.mqtt.client as the_mqtt_module
+        mqtt_client = the_mqtt_module
+    return mqtt_client
+
+def startup_phase(the_name):
+    startup_phases.append((the_name, time.perf_counter()))
+
+def print_startup_profile():
+    # time of every startup phase, from the end of the previous one
+    print("startup  interpreter and imports: %.1f ms cpu" % (startup_import_cpu * 1000))
+    for i in range(1, len(startup_phases)):
+        print("startup  %s: %.1f ms" % (startup_phases[i][0], (startup_phases[i][1] - startup_phases[i - 1][1]) * 1000))
+    print("startup  total: %.1f ms" % ((startup_phases[-1][1] - startup_phases[0][1]) * 1000), flush=True)
+
+def start_mqtt_publisher_background():
+    # paho import and client setup run next to the startup, reports that come earlier go to the journal
+    the_start = time.perf_counter()
+    start_mqtt_publisher()
+    if startup_profile:
+        print("startup  mqtt publisher (background): %.1f ms" % ((time.perf_counter() - the_start) * 1000), flush=True)
 
 def test_mqtt():
     global my_config
     the_return = False
     try:
+        import_mqtt()
         the_toplevel_topic = my_config["mqtt_base_topic"]
         the_topic = the_toplevel_topic +"/"
         try:
@@ -129,6 +693,79 @@ def test_mqtt():
 
     return the_return
 
+def on_mqtt_publisher_connect(the_client, the_userdata, *the_args):
+    if the_client is mqtt_publisher and the_client.is_connected():
+        the_userdata["connects"] += 1
+        if the_userdata["connects"] > 1:
+            # a reconnect may mean a restarted broker without its retained discovery configs
+            clear_discovery_cache()
+            clear_telemetry_cache()
+        the_client.subscribe(get_ha_topic()+"/status")
+        mqtt_publisher_connected.set()
+        if journal is not None:
+            journal.wakeup.set()
+
+def on_mqtt_publisher_message(the_client, the_userdata, the_message):
+    # Homeassistant announces a restart with "online" on <discovery topic>/status
+    if the_message.topic == get_ha_topic()+"/status" and the_message.payload == b"online":
+        clear_discovery_cache()
+        clear_telemetry_cache()
+
+def on_mqtt_publisher_disconnect(the_client, the_userdata, *the_args):
+    if the_client is mqtt_publisher:
+        mqtt_publisher_connected.clear()
+
+def start_mqtt_publisher():
+    # one long-lived client shared by all button_threads, rebuilt whenever the config changes
+    global my_config
+    global mqtt_publisher
+    with mqtt_publisher_lock:
+        the_old_publisher = mqtt_publisher
+        mqtt_publisher = None
+        mqtt_publisher_connected.clear()
+        if the_old_publisher is not None:
+            try:
+                the_old_publisher.disconnect()
+                the_old_publisher.loop_stop()
+            except Exception as ex:
+                logging.error("error stopping mqtt publisher - "+str(ex))
+        try:
+            import_mqtt()
+            the_client_id = "mystrom2ha_publisher_"+my_config["mystrom2ha_ip"]
+            if worker_count > 1:
+                # the broker drops a client whose id connects a second time
+                the_client_id += "_" + str(os.getpid())
+            try:
+                the_mqtt_client = mqtt_client.Client(mqtt_client.CallbackAPIVersion.VERSION2,the_client_id)
+            except:
+                the_mqtt_client = mqtt_client.Client(the_client_id)
+            if my_config["mqtt_user"] != "":
+                the_mqtt_client.username_pw_set(my_config["mqtt_user"], my_config["mqtt_password"])
+            the_mqtt_client.on_connect = on_mqtt_publisher_connect
+            the_mqtt_client.on_disconnect = on_mqtt_publisher_disconnect
+            the_mqtt_client.on_message = on_mqtt_publisher_message
+            the_mqtt_client.user_data_set({"connects": 0})
+            the_mqtt_client.reconnect_delay_set(min_delay=1, max_delay=30)
+            mqtt_publisher = the_mqtt_client
+            # connect_async + loop_start: the network thread connects and reconnects on its own
+            the_mqtt_client.connect_async(my_config["mqtt_ip"], port=int(my_config["mqtt_port"]), keepalive=60)
+            the_mqtt_client.loop_start()
+        except Exception as ex:
+            mqtt_publisher = None
+            logging.error("error start_mqtt_publisher - "+str(ex))
+
+def get_mqtt_publisher(the_timeout=2):
+    # waits a short moment in case the publisher is just (re)connecting
+    the_start = time.perf_counter()
+    the_connected = mqtt_publisher_connected.wait(the_timeout)
+    metrics_observe("mystrom2ha_broker_connect_seconds", "", time.perf_counter() - the_start)
+    if not the_connected:
+        raise ConnectionError("mqtt publisher not connected to "+my_config["mqtt_ip"]+":"+str(my_config["mqtt_port"]))
+    the_mqtt_client = mqtt_publisher
+    if the_mqtt_client is None:
+        raise ConnectionError("mqtt publisher not started")
+    return the_mqtt_client
+
 def read_config():
     global my_config
     if os.path.isfile(get_script_directory() + '/config.json'):
@@ -148,147 +785,532 @@ def read_config():
         my_config["mqtt_base_topic"] = "mystrom2ha"
         my_config["mqtt_user"] = ""
         my_config["mqtt_password"] = ""
+    for the_key in config_defaults.keys():
+        my_config.setdefault(the_key, config_defaults[the_key])
+
+def get_config_float(the_key, the_default):
+    try:
+        return float(my_config[the_key])
+    except (KeyError, ValueError):
+        return the_default
 
 def write_config ():
     global my_config
     global my_lang
+    global config_mtime
     with open(get_script_directory() +'/config.json', 'w') as f:
         my_config["lang"] = my_lang
-        json.dump(my_config, f)    
+        json.dump(my_config, f)
+    config_mtime = get_config_mtime()
 
-def declare_text_snippets_de():
-    global lang
+def get_config_mtime():
+    try:
+        return os.stat(get_script_directory() +'/config.json').st_mtime_ns
+    except OSError:
+        return 0
+
+class config_watch_thread(threading.Thread):
+    # with --workers the config page is saved by one worker, the others read config.json again when it changes
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.start()
+    def run(self):
+        global config_mtime
+        config_mtime = get_config_mtime()
+        while not end_ha2mqtt:
+            time.sleep(2)
+            the_mtime = get_config_mtime()
+            if the_mtime == config_mtime:
+                continue
+            config_mtime = the_mtime
+            try:
+                read_config()
+                update_report_recorder()
+                update_beacon_listener()
+                # the broker may be a new one, our devices send their retained configs again like after a save on this worker
+                clear_discovery_cache()
+                clear_telemetry_cache()
+                battery_poll_wakeup.set()
+                start_mqtt_publisher()
+                logging.info("config.json changed, reloaded")
+            except Exception as ex:
+                logging.error("error config reload - "+str(ex))
+
+def read_shared_state(the_name):
+    # small json state files of the workers, e.g. search.json of the running button search
+    try:
+        with open(get_script_directory() + '/' + the_name + '.json', 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def lock_shared_state(the_name):
+    # with --workers: an exclusive flock, released by closing the returned file; None with a single process
+    if worker_count == 1:
+        return None
+    import fcntl
+    the_lock_file = open(get_script_directory() + '/' + the_name + '.lock', 'w')
+    fcntl.flock(the_lock_file, fcntl.LOCK_EX)
+    return the_lock_file
+
+def write_shared_state(the_name, the_state):
+    the_tmp_path = get_script_directory() + '/' + the_name + '.json.' + str(os.getpid()) + '.tmp'
+    try:
+        with open(the_tmp_path, 'w') as f:
+            json.dump(the_state, f)
+        os.replace(the_tmp_path, get_script_directory() + '/' + the_name + '.json')
+    except Exception as ex:
+        logging.error("error write_shared_state " + the_name + " - "+str(ex))
+
+def get_ha_topic():
+    the_homeassistant_topic = my_config["mqtt_ha_topic"]
+    if (the_homeassistant_topic.endswith("/")):
+        the_homeassistant_topic = the_homeassistant_topic[:-1]
+    return the_homeassistant_topic
+
+def read_discovery_cache():
+    global discovery_cache
+    try:
+        if os.path.isfile(get_script_directory() + '/discovery.json'):
+            with open(get_script_directory() + '/discovery.json', 'r') as f:
+                discovery_cache = json.load(f)
+    except Exception as ex:
+        discovery_cache = {}
+        logging.error("error read_discovery_cache - "+str(ex))
+
+def write_discovery_cache():
+    # called with discovery_cache_lock held
+    # with --workers each worker writes the macs it owns and keeps those of the others from the file
+    the_lock_file = None
+    try:
+        the_cache = discovery_cache
+        if worker_count > 1:
+            the_lock_file = lock_shared_state("discovery")
+            the_cache = {}
+            if os.path.isfile(get_script_directory() + '/discovery.json'):
+                with open(get_script_directory() + '/discovery.json', 'r') as f:
+                    the_cache = {the_mac: the_entry for the_mac, the_entry in json.load(f).items() if get_report_owner(the_mac) != worker_index}
+            the_cache.update({the_mac: the_entry for the_mac, the_entry in discovery_cache.items() if get_report_owner(the_mac) == worker_index})
+        the_tmp_path = get_script_directory() + '/discovery.json.' + str(os.getpid()) + '.tmp'
+        with open(the_tmp_path, 'w') as f:
+            json.dump(the_cache, f)
+        os.replace(the_tmp_path, get_script_directory() + '/discovery.json')
+    except Exception as ex:
+        logging.error("error write_discovery_cache - "+str(ex))
+    finally:
+        if the_lock_file is not None:
+            the_lock_file.close()
+
+def clear_discovery_cache():
+    # the next report of every device publishes its discovery configs again
+    with discovery_cache_lock:
+        discovery_cache.clear()
+        write_discovery_cache()
+
+def clear_telemetry_cache():
+    # the next report of every device publishes all its values again
+    with telemetry_cache_lock:
+        telemetry_cache.clear()
+
+def publish_telemetry(the_mqtt_client, the_topic, the_mac, the_name, the_value):
+    # slow-moving values only go out when they leave the deadband around the last published value
+    # or when telemetry_heartbeat seconds have passed since then
+    the_key = (the_mac, the_name)
+    the_now = time.monotonic()
+    with telemetry_cache_lock:
+        the_last = telemetry_cache.get(the_key)
+    if the_last is not None and the_now - the_last[1] < get_config_float("telemetry_heartbeat", 900):
+        the_unchanged = the_value == the_last[0]
+        if not the_unchanged and the_name in telemetry_deadbands:
+            try:
+                the_unchanged = abs(float(the_value) - float(the_last[0])) < get_config_float(telemetry_deadbands[the_name], 0)
+            except ValueError:
+                pass
+        if the_unchanged:
+            metrics_count("mystrom2ha_telemetry_total", "result=\"suppressed\"")
+            return
+    check_mqtt_publish(the_mqtt_client.publish(the_topic+the_mac+"/"+the_name, the_value))
+    with telemetry_cache_lock:
+        telemetry_cache[the_key] = (the_value, the_now)
+    metrics_count("mystrom2ha_telemetry_total", "result=\"published\"")
+
+def publish_discovery(the_mqtt_client, the_mac, the_device_type, the_name, the_configs):
+    # the_configs: list of (topic, payload); only sent (retained) if the device is new or its configs changed
+    the_hash = hashlib.sha1(json.dumps(the_configs).encode("utf-8")).hexdigest()
+    the_entry = {"type": the_device_type, "name": the_name, "hash": the_hash}
+    with discovery_cache_lock:
+        if discovery_cache.get(the_mac) == the_entry:
+            return
+    for the_config_topic, the_config_payload in the_configs:
+        the_result = the_mqtt_client.publish(the_config_topic, the_config_payload, retain=True)
+        if the_result.rc != mqtt_client.MQTT_ERR_SUCCESS:
+            raise ConnectionError("discovery publish failed for "+the_mac+" - rc "+str(the_result.rc))
+    with discovery_cache_lock:
+        discovery_cache[the_mac] = the_entry
+        write_discovery_cache()
+
+class device_record:
+    __slots__ = ("mac", "type", "name", "ip", "battery", "last_seen", "firmware")
+
+    def __init__(self, the_mac):
+        self.mac = the_mac
+        self.type = ""
+        self.name = ""
+        self.ip = ""
+        self.battery = ""
+        self.last_seen = 0.0
+        self.firmware = ""
+
+    def to_dict(self):
+        return {the_field: getattr(self, the_field) for the_field in self.__slots__}
+
+class device_registry:
+    # all known myStrom devices, looked up by mac or ip, kept in an append-only devices.jsonl:
+    # every line holds the mac and the fields that changed, the file is compacted on load and once it has
+    # registry_compact_factor lines per device
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.by_mac = {}
+        self.by_ip = {}
+        self.path = ""
+        self.seen_written = {}
+        self.offset = 0
+        self.inode = 0
+        self.lines = 0
+
+    def load(self, the_path, the_compact=True):
+        with self.lock:
+            self.path = the_path
+            the_lines = 0
+            if os.path.isfile(the_path):
+                with open(the_path, 'rb') as f:
+                    the_data = f.read()
+                # a line another worker is just writing is read by refresh
+                self.offset = the_data.rfind(b"\n") + 1
+                self.inode = os.stat(the_path).st_ino
+                for the_line in the_data[:self.offset].splitlines():
+                    the_lines += 1
+                    try:
+                        the_fields = json.loads(the_line)
+                        self.apply(the_fields.pop("mac"), the_fields)
+                    except Exception as ex:
+                        logging.error("error device registry line "+str(the_lines)+" - "+str(ex))
+            self.lines = the_lines
+            if the_compact and self.needs_compact():
+                self.compact()
+
+    def needs_compact(self):
+        return self.lines > registry_compact_factor * len(self.by_mac) + 100
+
+    def refresh(self):
+        # with --workers every worker appends to the same file, apply the lines of the others (and our own again)
+        if worker_count == 1 or self.path == "":
+            return
+        try:
+            the_stat = os.stat(self.path)
+            if the_stat.st_ino != self.inode:
+                # compacted by another worker, the new file holds the whole state
+                self.inode = the_stat.st_ino
+                self.offset = 0
+                self.lines = 0
+            the_size = the_stat.st_size
+            if the_size <= self.offset:
+                return
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                the_data = f.read(the_size - self.offset)
+        except OSError:
+            return
+        the_end = the_data.rfind(b"\n") + 1
+        self.offset += the_end
+        for the_line in the_data[:the_end].splitlines():
+            self.lines += 1
+            try:
+                the_fields = json.loads(the_line)
+                self.apply(the_fields.pop("mac"), the_fields)
+            except Exception as ex:
+                logging.error("error device registry refresh - "+str(ex))
+
+    def compact(self):
+        try:
+            with open(self.path + '.tmp', 'w') as f:
+                for the_record in self.by_mac.values():
+                    f.write(json.dumps(the_record.to_dict()) + "\n")
+            os.replace(self.path + '.tmp', self.path)
+            the_stat = os.stat(self.path)
+            self.inode = the_stat.st_ino
+            self.offset = the_stat.st_size
+            self.lines = len(self.by_mac)
+        except Exception as ex:
+            logging.error("error device registry compact - "+str(ex))
+
+    def apply(self, the_mac, the_fields):
+        # returns the names of the fields that really changed
+        the_record = self.by_mac.get(the_mac)
+        if the_record is None:
+            the_record = device_record(the_mac)
+            self.by_mac[the_mac] = the_record
+        the_changed = []
+        for the_field, the_value in the_fields.items():
+            if the_field in device_record.__slots__ and the_field != "mac" and getattr(the_record, the_field) != the_value:
+                if the_field == "ip":
+                    if self.by_ip.get(the_record.ip) is the_record:
+                        del self.by_ip[the_record.ip]
+                    # the ip now belongs to this device (DHCP)
+                    the_previous = self.by_ip.get(the_value)
+                    if the_previous is not None and the_previous is not the_record:
+                        the_previous.ip = ""
+                setattr(the_record, the_field, the_value)
+                the_changed.append(the_field)
+        if the_record.ip != "":
+            self.by_ip[the_record.ip] = the_record
+        return the_changed
+
+    def update(self, the_mac, **the_fields):
+        if the_mac == "":
+            return
+        with self.lock:
+            # with --workers the lines of the others are applied first, under the lock nobody appends or compacts meanwhile
+            the_lock_file = lock_shared_state("devices")
+            try:
+                self.refresh()
+                the_changed = self.apply(the_mac, the_fields)
+                # last_seen alone is only written every registry_seen_interval seconds
+                if the_changed == ["last_seen"] and the_fields["last_seen"] - self.seen_written.get(the_mac, 0) < registry_seen_interval:
+                    return
+                if len(the_changed) == 0 or self.path == "":
+                    return
+                if "last_seen" in the_changed:
+                    self.seen_written[the_mac] = the_fields["last_seen"]
+                the_line = {"mac": the_mac}
+                for the_field in the_changed:
+                    the_line[the_field] = the_fields[the_field]
+                the_data = (json.dumps(the_line) + "\n").encode("utf-8")
+                try:
+                    with open(self.path, 'ab') as f:
+                        f.write(the_data)
+                    self.offset += len(the_data)
+                    self.lines += 1
+                except Exception as ex:
+                    logging.error("error device registry write - "+str(ex))
+                if self.needs_compact():
+                    self.compact()
+            finally:
+                if the_lock_file is not None:
+                    the_lock_file.close()
+
+    def get_by_mac(self, the_mac):
+        with self.lock:
+            self.refresh()
+            return self.by_mac.get(the_mac)
+
+    def get_by_ip(self, the_ip):
+        with self.lock:
+            self.refresh()
+            return self.by_ip.get(the_ip)
+
+    def devices(self):
+        with self.lock:
+            self.refresh()
+            return list(self.by_mac.values())
+
+def declare_text_snippets_de(the_lang):
     global my_local_ip
     global button_request_port
-    lang['lang'] = "DE"
-    lang['hello'] = "Hallo"
-    lang['back'] = "Zurück"
-    lang['cancel'] = "Abbrechen"
-    lang['close'] = "Schließen"
-    lang["retry"] = "Erneut versuchen"
-    lang['or'] = "oder"
-    lang['continue'] = "weiter"
-    lang['login_language_change'] = "<a href=\"/webif?lang=EN\">To the login in English</a>"
-    lang['service_connection'] = "Service Einstellungen"
-    lang['messages'] = "Nachricht(en)"
-    lang['button_config'] = "myStrom Button Konfiguration"
-    lang['search_buttons'] = "myStrom Buttons suchen"
-    lang['add_button'] = "myStrom Button hinzufügen"
-    lang["search_finished"] = "Die Suche ist erfolgreich abgeschlossen."
-    lang['button_ip'] = "IP des myStrom Buttons"
-    lang['program_button'] = "Button programmieren"
-    lang['button_manual_ip'] = "Manuelle Eingabe der IP Adresse"
-    lang["programm_button_hint_1"] = "<UL><li>Zuerst sollte der myStrom Button in den Werkszustand gesetzt werden. Bei einem myStrom Button Gen1 erfolgt dies mittels langem Druck auf den Button und wenn die Farbe des Buttons sich ändert dan den Button erneut drücken.</li><li>Danach Verbindet man den Button mit Hilfe des 'myStrom Button Trouble Shooting Tool (verfügbar für Windows und macOS) mit dem WLAN Netzwerk. Dann sollte der Button nach einer kurzen Zeit im Konfigurationsmodus und bereit für die Programmierung sein.</li><li>myStrom Button+: Beim myStrom Button+ öffnet man die Rückseite durch Drehen des Deckels im Uhrzeigersinn, dann entfernt man kurz die Batterien und setzt sie wieder ein. Der Button sollte jetzt für eine gewisse Zeit im Konfigurationsmodus und bereit für die Programmierung sein.</li><li>Nun betätigen wir den Button'"+lang['search_buttons']+"' um die Suche nach dem Button zu starten. Achtung: Die Suche kann etwas dauern!</li><li>Falls MyStrom2HA sich nicht im lokalen Netz befindet (Network nicht im 'Host' Modus) kann man den Button auch gleich durch Angabe der IP Adresse und einen Klick auf Button '"+lang['program_button']+"' anbinden.</li></ul>"
-    lang["no_button_found"] = "Kein Button gefunden. Anscheinend war der Button nicht mit Deinem Netzwerk verbunden bzw. nicht im Programmiermodus. Bitte prüfe nochmals die kleine Anleitung und versuche es erneut."  
-    lang["search_running"] = "Da ist etwas schief gelaufen - es läuft noch eine Suche. Bitte klicke auf den folgenden Button, sobald die Suche 100% erreicht hat."
-    lang['select_button'] = "Wähle den Button"
-    lang["button_programming_ok"] = "Buttonprogrammierung - OK. Der Button konnte erfolgreich programmiert werden:"
-    lang["button_programming_nok"] = "Buttonprogrammierung nicht OK. Anscheinend war der Button nicht mit Deinem Netzwerk verbunden bzw. nicht im Programmiermodus. Bitte prüfe nochmals die kleine Anleitung und versuche es erneut."
-    lang["button_search_title"] = "Buttonsuche"
-    lang["button_search"] = "Suche Buttons ..."
-    lang["button_found_1"] = "Button "
-    lang["button_found_2"] = " gefunden."
-    lang['headline'] = "MyStrom2HA"
-    lang['info_1'] = "MyStrom2HA wurde erfolgreich installiert."
-    lang['info_2'] = "Bitte vervollständigen sie die unteren Parameter um die Einrichtung abzuschließen."
-    lang['login'] = "Anmeldung"
-    lang['login_text'] = "Bitte geben Sie das Passwort ein..."
-    lang['do_login'] = "Anmelden"
-    lang['password'] = "Passwort"
-    lang['login_failed'] = "<font color=\"red\">Falsches Passwort!</font>"
-    lang['config_mystron2ha'] = "MyStrom2HA Konfigurieren"
-    lang['update'] = "Aktualisieren"
-    lang["mqtt_ip"] = "MQTT Server IP"
-    lang["mqtt_port"] = "MQTT Server Port"
-    lang["mqtt_base_topic"] = "Top-Level MQTT Topic"
-    lang["mqtt_ha_topic"] = "Homeassistant Discovery Topic"
-    lang["mqtt_user"] = "MQTT User"
-    lang["mqtt_password"] = "MQTT Passwort"
-    lang["mystrom2ha_ip"] = "MyStrom2HA IP"
-    lang["button_ip"] = "Button IP"
-    lang["mqtt_connection_ok"] = "OK - die Verbindung zum MQTT Server konnte hergestellt werden."
-    lang["mqtt_connection_nok"] = "Error - die Verbindung zum MQTT Server konnte noch nicht hergestellt werden. Überprüfen sie die Daten und versuchen sie es erneut."
-
-def declare_text_snippets_en():
-    global lang
+    the_lang['lang'] = "DE"
+    the_lang['hello'] = "Hallo"
+    the_lang['back'] = "Zurück"
+    the_lang['cancel'] = "Abbrechen"
+    the_lang['close'] = "Schließen"
+    the_lang["retry"] = "Erneut versuchen"
+    the_lang['or'] = "oder"
+    the_lang['continue'] = "weiter"
+    the_lang['login_language_change'] = "<a href=\"/webif?lang=EN\">To the login in English</a>"
+    the_lang['service_connection'] = "Service Einstellungen"
+    the_lang['messages'] = "Nachricht(en)"
+    the_lang['button_config'] = "myStrom Button Konfiguration"
+    the_lang['search_buttons'] = "myStrom Buttons suchen"
+    the_lang['add_button'] = "myStrom Button hinzufügen"
+    the_lang['log'] = "Protokoll"
+    the_lang['log_filter'] = "Filter"
+    the_lang['log_level'] = "Mindestens"
+    the_lang['profile'] = "Profiling"
+    the_lang['profile_none'] = "Noch keine Messung"
+    the_lang['profile_running'] = "Messung läuft"
+    the_lang['profile_done'] = "Messung beendet"
+    the_lang['profile_requests'] = "Anfragen"
+    the_lang['profile_seconds'] = "Höchstens Sekunden"
+    the_lang['profile_samples'] = "Stichproben"
+    the_lang['profile_start'] = "Messung starten"
+    the_lang['profile_stop'] = "Stoppen"
+    the_lang['profile_download'] = "Profil herunterladen"
+    the_lang["search_finished"] = "Die Suche ist erfolgreich abgeschlossen."
+    the_lang['button_ip'] = "IP des myStrom Buttons"
+    the_lang['program_button'] = "Button programmieren"
+    the_lang['button_manual_ip'] = "Manuelle Eingabe der IP Adresse"
+    the_lang['program_all_buttons'] = "Alle Buttons programmieren"
+    the_lang['button_ip_list'] = "IP Adressen mehrerer Buttons (getrennt durch Komma oder Zeilenumbruch)"
+    the_lang['attempts'] = "Versuch(e)"
+    the_lang['bulk_programming_done'] = "Erfolgreich programmierte Buttons:"
+    the_lang["programm_button_hint_1"] = "<UL><li>Zuerst sollte der myStrom Button in den Werkszustand gesetzt werden. Bei einem myStrom Button Gen1 erfolgt dies mittels langem Druck auf den Button und wenn die Farbe des Buttons sich ändert dan den Button erneut drücken.</li><li>Danach Verbindet man den Button mit Hilfe des 'myStrom Button Trouble Shooting Tool (verfügbar für Windows und macOS) mit dem WLAN Netzwerk. Dann sollte der Button nach einer kurzen Zeit im Konfigurationsmodus und bereit für die Programmierung sein.</li><li>myStrom Button+: Beim myStrom Button+ öffnet man die Rückseite durch Drehen des Deckels im Uhrzeigersinn, dann entfernt man kurz die Batterien und setzt sie wieder ein. Der Button sollte jetzt für eine gewisse Zeit im Konfigurationsmodus und bereit für die Programmierung sein.</li><li>Nun betätigen wir den Button'"+the_lang['search_buttons']+"' um die Suche nach dem Button zu starten. Achtung: Die Suche kann etwas dauern!</li><li>Falls MyStrom2HA sich nicht im lokalen Netz befindet (Network nicht im 'Host' Modus) kann man den Button auch gleich durch Angabe der IP Adresse und einen Klick auf Button '"+the_lang['program_button']+"' anbinden.</li></ul>"
+    the_lang["no_button_found"] = "Kein Button gefunden. Anscheinend war der Button nicht mit Deinem Netzwerk verbunden bzw. nicht im Programmiermodus. Bitte prüfe nochmals die kleine Anleitung und versuche es erneut."  
+    the_lang["search_running"] = "Da ist etwas schief gelaufen - es läuft noch eine Suche. Bitte klicke auf den folgenden Button, sobald die Suche 100% erreicht hat."
+    the_lang['select_button'] = "Wähle den Button"
+    the_lang["button_programming_ok"] = "Buttonprogrammierung - OK. Der Button konnte erfolgreich programmiert werden:"
+    the_lang["button_programming_nok"] = "Buttonprogrammierung nicht OK. Anscheinend war der Button nicht mit Deinem Netzwerk verbunden bzw. nicht im Programmiermodus. Bitte prüfe nochmals die kleine Anleitung und versuche es erneut."
+    the_lang["button_search_title"] = "Buttonsuche"
+    the_lang["button_search"] = "Suche Buttons ..."
+    the_lang["button_found_1"] = "Button "
+    the_lang["button_found_2"] = " gefunden."
+    the_lang['headline'] = "MyStrom2HA"
+    the_lang['info_1'] = "MyStrom2HA wurde erfolgreich installiert."
+    the_lang['info_2'] = "Bitte vervollständigen sie die unteren Parameter um die Einrichtung abzuschließen."
+    the_lang['login'] = "Anmeldung"
+    the_lang['login_text'] = "Bitte geben Sie das Passwort ein..."
+    the_lang['do_login'] = "Anmelden"
+    the_lang['password'] = "Passwort"
+    the_lang['login_failed'] = "<font color=\"red\">Falsches Passwort!</font>"
+    the_lang['config_mystron2ha'] = "MyStrom2HA Konfigurieren"
+    the_lang['update'] = "Aktualisieren"
+    the_lang["mqtt_ip"] = "MQTT Server IP"
+    the_lang["mqtt_port"] = "MQTT Server Port"
+    the_lang["mqtt_base_topic"] = "Top-Level MQTT Topic"
+    the_lang["mqtt_ha_topic"] = "Homeassistant Discovery Topic"
+    the_lang["mqtt_user"] = "MQTT User"
+    the_lang["mqtt_password"] = "MQTT Passwort"
+    the_lang["wheel_rate"] = "Drehrad Updates pro Sekunde (0 = jeder Schritt)"
+    the_lang["scan_mode"] = "Suchmodus (broadcast, active oder both)"
+    the_lang["scan_subnets"] = "Zusätzliche Subnetze für die Suche (z.B. 192.168.2.0/24)"
+    the_lang["scan_expected"] = "Erwartete Anzahl Buttons (0 = unbekannt)"
+    the_lang["journal_max_age"] = "Ereignisse nach MQTT Ausfall höchstens so alt nachsenden (Sekunden)"
+    the_lang["journal_replay_rate"] = "Nachgesendete Ereignisse pro Sekunde"
+    the_lang["dedup_window"] = "Wiederholte Button Meldungen innerhalb von Sekunden ignorieren (0 = aus)"
+    the_lang["report_record"] = "Button Meldungen in reports.rec aufzeichnen (1 = an, 0 = aus)"
+    the_lang["passive_discovery"] = "Geräte ständig an ihren Broadcasts (UDP 7979) erkennen, die Suche antwortet sofort (1 = an, 0 = aus)"
+    the_lang["telemetry_heartbeat"] = "Batterie, Temperatur, Feuchte und Licht spätestens nach Sekunden erneut senden"
+    the_lang["telemetry_deadband_battery"] = "Batterie nur bei Änderung um mindestens (%)"
+    the_lang["telemetry_deadband_temp"] = "Temperatur nur bei Änderung um mindestens (°C)"
+    the_lang["telemetry_deadband_rh"] = "Feuchte nur bei Änderung um mindestens (%)"
+    the_lang["telemetry_deadband_light"] = "Licht nur bei Änderung um mindestens"
+    the_lang["battery_poll_interval"] = "Batterie von nicht gemeldeten Geräten abfragen alle Sekunden (0 = aus)"
+    the_lang["battery_poll_low"] = "Unter dieser Batterie (%) viermal so oft abfragen"
+    the_lang["mystrom2ha_ip"] = "MyStrom2HA IP"
+    the_lang["button_ip"] = "Button IP"
+    the_lang["mqtt_connection_ok"] = "OK - die Verbindung zum MQTT Server konnte hergestellt werden."
+    the_lang["mqtt_connection_nok"] = "Error - die Verbindung zum MQTT Server konnte noch nicht hergestellt werden. Überprüfen sie die Daten und versuchen sie es erneut."
+
+def declare_text_snippets_en(the_lang):
     global my_local_ip
     global button_request_port
-    lang['lang'] = "EN"
-    lang['hello'] = "Hello"
-    lang['back'] = "Back"
-    lang['cancel'] = "Cancel"
-    lang['close'] = "Close"
-    lang["retry"] = "Retry"
-    lang['or'] = "or"
-    lang['continue'] = "continue"
-    lang['login_language_change'] = "<a href=\"/webif?lang=DE\">Zum Login in Deutsch</a>"
-    lang['service_connection'] = "Service setup"
-    lang['messages'] = "Message(s)"
-    lang['button_config'] = "myStrom button configuration"
-    lang['search_buttons'] = "search myStrom Buttons"
-    lang['add_button'] = "add myStrom Button"
-    lang["search_finished"] = "The search was successfull."
-    lang['button_ip'] = "IP of myStrom button"
-    lang['program_button'] = "Program the button"
-    lang['button_manual_ip'] = "Manual input of the IP address"
-    lang["programm_button_hint_1"] = "<ul><li>myStrom button: First the myStrom button should be set to factory defaults and then be connected to the Wifi network using the myStrom trouble shooting tool. The myStrom trouble shooting tool is available for Windows and macOS.</li><li>myStrom Button+: Open the myStrom Button+ by rotating the cover on the back clockwise, then remove the batteries and enter them again. Then the button should enter the configuration mode for some time.</li><li>Now we click on the button '"+lang['search_buttons']+"' to find the button. Remark: The search can take up to 1 minute time!</li><li>If MyStrom2HA is not directly connected to the local network (Network mode is not 'Host'), you can enter the button ip directly in the field below and programm the button directly by clicking on '"+lang['program_button']+"'.</li></ul>"
-    lang["no_button_found"] = "No buttons found. Unfortunately it seems the button was either not connected to the local network or it was set to the programming mode yet. Please check the short setup manual and try again."  
-    lang["search_running"] = "Something went wrong, there is still a search running - please click on the following button once the counter has reached 100%."
-    lang['select_button'] = "Select the button"
-    lang["button_programming_ok"] = "Programming of the button - OK :"
-    lang["button_programming_nok"] = "Programming of the button not OK. Unfortunately it seems the button was either not connected to the local network or it was set to the programming mode yet. Please check the short setup manual and try again."
-    lang["button_search_title"] = "Button search"
-    lang["button_search"] = "searching buttons ..."
-    lang["button_found_1"] = "button "
-    lang["button_found_2"] = " found."
-    lang['headline'] = "MyStrom2HA"
-    lang['info_1'] = "MyStrom2HA has been installed successfully."
-    lang['info_2'] = "Please fill out the configuration below if necessary."
-    lang['login'] = "Login"
-    lang['login_text'] = "Please enter the password..."
-    lang['do_login'] = "login"
-    lang['password'] = "Password"
-    lang['login_failed'] = "<font color=\"red\">Wrong Password!</font>"
-    lang['config_mystron2ha'] = "Configure MyStrom2HA"
-    lang['update'] = "Update"
-    lang["mqtt_ip"] = "MQTT Server IP"
-    lang["mqtt_port"] = "MQTT Server Port"
-    lang["mqtt_base_topic"] = "Top-Level MQTT Topic"
-    lang["mqtt_ha_topic"] = "Homeassistant Discovery Topic"
-    lang["mqtt_user"] = "MQTT User"
-    lang["mqtt_password"] = "MQTT Password"
-    lang["mystrom2ha_ip"] = "MyStrom2HA IP"
-    lang["button_ip"] = "Button IP"
-    lang["mqtt_connection_ok"] = "OK - the connection to the MQTT Server could be established."
-    lang["mqtt_connection_nok"] = "Error - the connection to the MQTT Server could not be established. Please check the values and try again."
+    the_lang['lang'] = "EN"
+    the_lang['hello'] = "Hello"
+    the_lang['back'] = "Back"
+    the_lang['cancel'] = "Cancel"
+    the_lang['close'] = "Close"
+    the_lang["retry"] = "Retry"
+    the_lang['or'] = "or"
+    the_lang['continue'] = "continue"
+    the_lang['login_language_change'] = "<a href=\"/webif?lang=DE\">Zum Login in Deutsch</a>"
+    the_lang['service_connection'] = "Service setup"
+    the_lang['messages'] = "Message(s)"
+    the_lang['button_config'] = "myStrom button configuration"
+    the_lang['search_buttons'] = "search myStrom Buttons"
+    the_lang['add_button'] = "add myStrom Button"
+    the_lang['log'] = "Log"
+    the_lang['log_filter'] = "Filter"
+    the_lang['log_level'] = "At least"
+    the_lang['profile'] = "Profiling"
+    the_lang['profile_none'] = "No capture yet"
+    the_lang['profile_running'] = "Capture running"
+    the_lang['profile_done'] = "Capture finished"
+    the_lang['profile_requests'] = "requests"
+    the_lang['profile_seconds'] = "At most seconds"
+    the_lang['profile_samples'] = "samples"
+    the_lang['profile_start'] = "Start capture"
+    the_lang['profile_stop'] = "Stop"
+    the_lang['profile_download'] = "Download profile"
+    the_lang["search_finished"] = "The search was successfull."
+    the_lang['button_ip'] = "IP of myStrom button"
+    the_lang['program_button'] = "Program the button"
+    the_lang['button_manual_ip'] = "Manual input of the IP address"
+    the_lang['program_all_buttons'] = "Program all buttons"
+    the_lang['button_ip_list'] = "IP addresses of several buttons (separated by comma or new line)"
+    the_lang['attempts'] = "attempt(s)"
+    the_lang['bulk_programming_done'] = "Successfully programmed buttons:"
+    the_lang["programm_button_hint_1"] = "<ul><li>myStrom button: First the myStrom button should be set to factory defaults and then be connected to the Wifi network using the myStrom trouble shooting tool. The myStrom trouble shooting tool is available for Windows and macOS.</li><li>myStrom Button+: Open the myStrom Button+ by rotating the cover on the back clockwise, then remove the batteries and enter them again. Then the button should enter the configuration mode for some time.</li><li>Now we click on the button '"+the_lang['search_buttons']+"' to find the button. Remark: The search can take up to 1 minute time!</li><li>If MyStrom2HA is not directly connected to the local network (Network mode is not 'Host'), you can enter the button ip directly in the field below and programm the button directly by clicking on '"+the_lang['program_button']+"'.</li></ul>"
+    the_lang["no_button_found"] = "No buttons found. Unfortunately it seems the button was either not connected to the local network or it was set to the programming mode yet. Please check the short setup manual and try again."  
+    the_lang["search_running"] = "Something went wrong, there is still a search running - please click on the following button once the counter has reached 100%."
+    the_lang['select_button'] = "Select the button"
+    the_lang["button_programming_ok"] = "Programming of the button - OK :"
+    the_lang["button_programming_nok"] = "Programming of the button not OK. Unfortunately it seems the button was either not connected to the local network or it was set to the programming mode yet. Please check the short setup manual and try again."
+    the_lang["button_search_title"] = "Button search"
+    the_lang["button_search"] = "searching buttons ..."
+    the_lang["button_found_1"] = "button "
+    the_lang["button_found_2"] = " found."
+    the_lang['headline'] = "MyStrom2HA"
+    the_lang['info_1'] = "MyStrom2HA has been installed successfully."
+    the_lang['info_2'] = "Please fill out the configuration below if necessary."
+    the_lang['login'] = "Login"
+    the_lang['login_text'] = "Please enter the password..."
+    the_lang['do_login'] = "login"
+    the_lang['password'] = "Password"
+    the_lang['login_failed'] = "<font color=\"red\">Wrong Password!</font>"
+    the_lang['config_mystron2ha'] = "Configure MyStrom2HA"
+    the_lang['update'] = "Update"
+    the_lang["mqtt_ip"] = "MQTT Server IP"
+    the_lang["mqtt_port"] = "MQTT Server Port"
+    the_lang["mqtt_base_topic"] = "Top-Level MQTT Topic"
+    the_lang["mqtt_ha_topic"] = "Homeassistant Discovery Topic"
+    the_lang["mqtt_user"] = "MQTT User"
+    the_lang["mqtt_password"] = "MQTT Password"
+    the_lang["wheel_rate"] = "Wheel updates per second (0 = every step)"
+    the_lang["scan_mode"] = "Search mode (broadcast, active or both)"
+    the_lang["scan_subnets"] = "Additional subnets to search (e.g. 192.168.2.0/24)"
+    the_lang["scan_expected"] = "Expected number of buttons (0 = unknown)"
+    the_lang["journal_max_age"] = "Resend events after a MQTT outage up to this age (seconds)"
+    the_lang["journal_replay_rate"] = "Resent events per second"
+    the_lang["dedup_window"] = "Ignore repeated button reports within seconds (0 = off)"
+    the_lang["report_record"] = "Record button reports to reports.rec (1 = on, 0 = off)"
+    the_lang["passive_discovery"] = "Keep detecting devices by their broadcasts (UDP 7979), the search answers at once (1 = on, 0 = off)"
+    the_lang["telemetry_heartbeat"] = "Resend battery, temperature, humidity and light at the latest after seconds"
+    the_lang["telemetry_deadband_battery"] = "Battery only on a change of at least (%)"
+    the_lang["telemetry_deadband_temp"] = "Temperature only on a change of at least (°C)"
+    the_lang["telemetry_deadband_rh"] = "Humidity only on a change of at least (%)"
+    the_lang["telemetry_deadband_light"] = "Light only on a change of at least"
+    the_lang["battery_poll_interval"] = "Ask devices that did not report for their battery every seconds (0 = off)"
+    the_lang["battery_poll_low"] = "Ask four times as often below this battery (%)"
+    the_lang["mystrom2ha_ip"] = "MyStrom2HA IP"
+    the_lang["button_ip"] = "Button IP"
+    the_lang["mqtt_connection_ok"] = "OK - the connection to the MQTT Server could be established."
+    the_lang["mqtt_connection_nok"] = "Error - the connection to the MQTT Server could not be established. Please check the values and try again."
 
 def programm_mystrom_button (button_selected_ip):
     global my_config
     global button_request_port
+    import urllib.request
     the_target_ip = my_config["mystrom2ha_ip"]
     the_target_port = button_request_port
     the_result = "nok"
     button_success = False
     try:
-        #get mac and type
-        url = "http://"+ button_selected_ip + "/api/v1/info"
-        print("url:"+url)
-        request = urllib.request.Request(url)
-        response = urllib.request.urlopen(request, timeout=2)
-        the_response_json = response.read().decode("utf8")
-        the_response = json.loads(the_response_json)
-        the_type_number = the_response['type']
-        if the_type_number == 103:
-            the_button_type = "myStrom Button Plus Gen1"
-        elif the_type_number == 104:
-            the_button_type = "myStrom Button"
-        elif the_type_number == 110:
-            the_button_type = "myStrom Motion Sensor"
-        elif the_type_number == 118:
-            the_button_type = "myStrom Button Plus Gen2"
+        the_record = registry.get_by_ip(button_selected_ip)
+        if the_record is not None and the_record.type != "" and time.time() - the_record.last_seen < 600:
+            # found by a search a moment ago, no need to ask the button again
+            the_type_number = int(the_record.type)
+            the_mac_id = the_record.mac
+            the_firmware = the_record.firmware
         else:
-            the_button_type = "unknown"
-        the_mac_id = the_response['mac']
+            #get mac and type
+            url = "http://"+ button_selected_ip + "/api/v1/info"
+            logging.debug("url: %s", url)
+            request = urllib.request.Request(url)
+            response = urllib.request.urlopen(request, timeout=2)
+            the_response_json = response.read().decode("utf8")
+            the_response = json.loads(the_response_json)
+            the_type_number = the_response['type']
+            the_mac_id = the_response['mac']
+            the_firmware = the_response.get('version', "")
         # get Battery Level
         if the_type_number == 103 or the_type_number == 104:
             url = "http://"+ button_selected_ip + "/api/v1/device"
@@ -317,20 +1339,21 @@ def programm_mystrom_button (button_selected_ip):
             url = "http://"+ button_selected_ip + "/api/v1/action/generic"
             data = "get://"+the_target_ip+":"+str(the_target_port)+"/button_report"
             response = urllib.request.urlopen(url, data = data.encode('ascii'), timeout=5)
-            print ("program_response:"+response.read().decode("utf8") )
+            logging.debug("program_response: %s", response.read().decode("utf8"))
         elif the_type_number == 118:
             url = "http://"+ button_selected_ip + "/api/v1/action/generic/generic"
             data = "get://"+the_target_ip+":"+str(the_target_port)+"/button_report"
             response = urllib.request.urlopen(url, data = data.encode('ascii'), timeout=5)
-            print ("program_response:"+response.read().decode("utf8") )
+            logging.debug("program_response: %s", response.read().decode("utf8"))
         elif the_type_number == 110:
             #allow motion sensors to be programmed
             url = "http://"+ button_selected_ip + "/api/v1/action/pir/generic"
             data = "get://"+the_target_ip+":"+str(the_target_port)+"/button_report"
             response = urllib.request.urlopen(url, data = data.encode('ascii'), timeout=5)
-            print ("program_response:"+response.read().decode("utf8") )
+            logging.debug("program_response: %s", response.read().decode("utf8"))
         
         button_success = True
+        registry.update(the_mac_id, type=str(the_type_number), ip=button_selected_ip, battery=the_battery, firmware=the_firmware, last_seen=time.time())
 
     except Exception as ex:
         logging.error("error programming button:"+ str(ex))
@@ -343,80 +1366,390 @@ def programm_mystrom_button (button_selected_ip):
 
     return the_result
 
+def programm_mystrom_button_retry (the_ip, the_attempts=3):
+    for the_attempt in range(1, the_attempts + 1):
+        if programm_mystrom_button (the_ip) == "ok":
+            return "ok", the_attempt
+        if the_attempt < the_attempts:
+            time.sleep(the_attempt)
+    return "nok", the_attempts
+
+def programm_mystrom_buttons (the_ips):
+    # programs the buttons in parallel and yields (ip, result, attempts) as soon as one is done
+    with concurrent.futures.ThreadPoolExecutor(max_workers=bulk_program_workers, thread_name_prefix="mystrom2ha_program") as the_executor:
+        the_futures = {the_executor.submit(programm_mystrom_button_retry, the_ip): the_ip for the_ip in the_ips}
+        for the_future in concurrent.futures.as_completed(the_futures):
+            the_result, the_attempts = the_future.result()
+            yield the_futures[the_future], the_result, the_attempts
+
+def parse_ip_list (the_text):
+    the_ips = []
+    for the_entry in re.split(r"[\s,;]+", the_text):
+        try:
+            the_ip = str(ipaddress.ip_address(the_entry))
+        except ValueError:
+            continue
+        if the_ip not in the_ips:
+            the_ips.append(the_ip)
+    return the_ips
+
 
-def set_button_ips(the_instance):
-    global the_percentage
+def probe_mystrom_device(the_ip, the_timeout):
+    import urllib.request
+    try:
+        response = urllib.request.urlopen("http://" + the_ip + "/api/v1/info", timeout=the_timeout)
+        the_response = json.loads(response.read().decode("utf8"))
+        return the_ip, int(the_response['type']), the_response['mac'], the_response.get('version', "")
+    except Exception:
+        return None
+
+def get_scan_hosts():
+    # the /24 of my_local_ip plus the configured scan_subnets
+    the_networks = [ipaddress.ip_network(my_local_ip + "/24", strict=False)]
+    for the_subnet in re.split(r"[\s,;]+", my_config["scan_subnets"]):
+        if the_subnet == "":
+            continue
+        try:
+            the_network = ipaddress.ip_network(the_subnet, strict=False)
+        except ValueError:
+            logging.error("error scan_subnets - invalid subnet "+the_subnet)
+            continue
+        if the_network.num_addresses > 1024:
+            logging.error("error scan_subnets - "+the_subnet+" is larger than /22, skipped")
+            continue
+        the_networks.append(the_network)
+    the_hosts = []
+    the_seen = {my_local_ip}
+    for the_network in the_networks:
+        for the_host in the_network.hosts():
+            if str(the_host) not in the_seen:
+                the_seen.add(str(the_host))
+                the_hosts.append(str(the_host))
+    return the_hosts
+
+def probe_subnets(the_job, the_expected, the_done):
+    # asks /api/v1/info of every host with short timeouts, stops early once the_expected devices are known
+    try:
+        the_hosts = get_scan_hosts()
+        the_executor = concurrent.futures.ThreadPoolExecutor(max_workers=scan_probe_workers, thread_name_prefix="mystrom2ha_probe")
+        try:
+            the_futures = [the_executor.submit(probe_mystrom_device, the_host, scan_probe_timeout) for the_host in the_hosts]
+            the_count = 0
+            for the_future in concurrent.futures.as_completed(the_futures):
+                the_count += 1
+                the_job.set_progress(10 + 80 * the_count // len(the_futures))
+                the_result = the_future.result()
+                if the_result is not None:
+                    the_ip, the_type, the_mac, the_firmware = the_result
+                    if the_type in (103, 104, 110, 118) and the_job.add_found(the_ip, str(the_type), the_mac):
+                        registry.update(the_mac, firmware=the_firmware)
+                if the_expected > 0 and the_job.found_count() >= the_expected:
+                    break
+        finally:
+            the_executor.shutdown(wait=False, cancel_futures=True)
+    except Exception as ex:
+        logging.error("error probe_subnets - "+str(ex))
+    the_done.set()
+
+class button_search_job:
+    # one run of the button search, every request asking for a search while it runs joins it
+    def __init__(self, the_id):
+        self.id = the_id
+        self.started = time.time()
+        self.progress = 0
+        self.found = []
+        self.found_ips = set()
+        self.done = False
+        self.changed = threading.Condition()
+        # with --workers: a search of another worker, known from search.json
+        self.remote = False
+
+    def save(self):
+        # called with self.changed held, lets the other workers follow the search
+        if worker_count > 1 and not self.remote:
+            write_shared_state("search", {"id": self.id, "pid": os.getpid(), "updated": time.time(), "progress": self.progress, "found": self.found, "done": self.done})
+
+    def load(self, the_state):
+        with self.changed:
+            if the_state is None or the_state["id"] != self.id or time.time() - the_state["updated"] > search_state_max_age:
+                # the worker of the search is gone
+                self.done = True
+                self.progress = 100
+                return
+            self.progress = the_state["progress"]
+            self.found = [tuple(the_entry) for the_entry in the_state["found"]]
+            self.found_ips = set(the_entry[0] for the_entry in self.found)
+            self.done = the_state["done"]
+
+    def wait_remote(self, the_condition, the_timeout):
+        the_end = time.time() + the_timeout
+        while True:
+            self.load(read_shared_state("search"))
+            if the_condition() or time.time() >= the_end:
+                return the_condition()
+            time.sleep(0.25)
+
+    def set_progress(self, the_progress):
+        with self.changed:
+            if the_progress > self.progress:
+                self.progress = the_progress
+                self.save()
+                self.changed.notify_all()
+
+    def add_found(self, the_ip, the_type, the_mac):
+        with self.changed:
+            if the_ip in self.found_ips:
+                return False
+            self.found_ips.add(the_ip)
+            self.found.append((the_ip, the_type, the_mac))
+            self.save()
+            self.changed.notify_all()
+            return True
+
+    def found_count(self):
+        with self.changed:
+            return len(self.found)
+
+    def finish(self):
+        with self.changed:
+            self.progress = 100
+            self.done = True
+            self.save()
+            self.changed.notify_all()
+
+    def wait_change(self, the_found_count, the_progress, the_timeout):
+        # returns progress, the devices found after the first the_found_count and done, as soon as one of them is newer
+        the_condition = lambda: self.done or len(self.found) > the_found_count or self.progress != the_progress
+        if self.remote:
+            self.wait_remote(the_condition, the_timeout)
+            return self.progress, self.found[the_found_count:], self.done
+        with self.changed:
+            self.changed.wait_for(the_condition, the_timeout)
+            return self.progress, self.found[the_found_count:], self.done
+
+    def wait_done(self, the_timeout):
+        if self.remote:
+            return self.wait_remote(lambda: self.done, the_timeout)
+        with self.changed:
+            return self.changed.wait_for(lambda: self.done, the_timeout)
+
+def start_button_search(the_id=None):
+    # joins the running search (or the one asked for by id), otherwise starts a new one in the background
+    global button_search
+    global button_search_counter
+    with button_search_lock:
+        the_lock_file = lock_shared_state("search")
+        try:
+            if worker_count > 1:
+                the_job = join_shared_button_search(the_id)
+                if the_job is not None:
+                    return the_job
+            if button_search is not None and (not button_search.done or button_search.id == the_id):
+                return button_search
+            button_search_counter += 1
+            button_search = button_search_job(str(button_search_counter) if worker_count == 1 else str(os.getpid()) + "-" + str(button_search_counter))
+            with button_search.changed:
+                button_search.save()
+            threading.Thread(target=run_button_search, args=(button_search,), daemon=True).start()
+            return button_search
+        finally:
+            if the_lock_file is not None:
+                the_lock_file.close()
+
+def join_shared_button_search(the_id):
+    # the running search of another worker (or the one asked for by id), None if this worker has to start or owns it
+    the_state = read_shared_state("search")
+    if the_state is None or the_state["pid"] == os.getpid():
+        return None
+    if (not the_state["done"] and time.time() - the_state["updated"] < search_state_max_age) or the_state["id"] == the_id:
+        the_job = button_search_job(the_state["id"])
+        the_job.remote = True
+        the_job.load(the_state)
+        return the_job
+    return None
+
+def run_button_search(the_job):
+    global button_search_running
+    button_search_running = True
+    try:
+        search_buttons(the_job)
+    except Exception as ex:
+        logging.error("error button search - "+str(ex))
+    finally:
+        button_search_running = False
+        the_job.finish()
+
+def get_present_devices():
+    # the presence table: registry records of myStrom devices with an ip, seen in the last presence_max_age seconds
+    the_now = time.time()
+    # with --workers the beacons reach worker 0 only, the others take the times of its presence.json
+    the_seen = {}
+    if worker_count > 1 and worker_index != 0:
+        the_seen = read_shared_state("presence") or {}
+    return [the_record for the_record in registry.devices() if the_record.ip != "" and the_record.type in ("103", "104", "110", "118")
+            and the_now - max(the_record.last_seen, the_seen.get(the_record.mac, 0)) < presence_max_age]
+
+def handle_beacon(the_data, the_ip):
+    # 6 bytes mac, 1 byte type, 1 byte flags
+    global presence_written
+    if len(the_data) < 7 or the_data[6] not in beacon_device_types:
+        metrics_count("mystrom2ha_beacons_total", "result=\"ignored\"")
+        return
+    the_mac = "".join("%02X" % the_byte for the_byte in the_data[:6])
+    the_record = registry.get_by_mac(the_mac)
+    if the_record is not None and the_record.ip != "" and the_record.ip != the_ip:
+        logging.info("device %s moved from %s to %s", the_mac, the_record.ip, the_ip)
+    # last_seen alone is written to devices.jsonl only every registry_seen_interval seconds
+    the_now = time.time()
+    registry.update(the_mac, type=str(the_data[6]), ip=the_ip, last_seen=the_now)
+    metrics_count("mystrom2ha_beacons_total", "result=\"device\"")
+    if worker_count > 1:
+        # devices.jsonl gets last_seen too rarely for the presence of the other workers
+        presence_seen[the_mac] = the_now
+        if the_now - presence_written >= presence_write_interval:
+            presence_written = the_now
+            for the_old_mac in [the_key for the_key, the_time in presence_seen.items() if the_now - the_time >= presence_max_age]:
+                del presence_seen[the_old_mac]
+            write_shared_state("presence", presence_seen)
+
+class beacon_listener_thread(threading.Thread):
+    # with passive_discovery = 1 the beacons the devices broadcast on UDP 7979 keep the registry up to date,
+    # one blocking socket, so it costs nothing between beacons
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.stopped = False
+        self.start()
+    def run(self):
+        try:
+            the_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+            # search_buttons may bind the port next to us
+            the_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            the_socket.bind(("", beacon_port))
+            # only to notice stop()
+            the_socket.settimeout(5)
+        except OSError as ex:
+            logging.error("error beacon listener - "+str(ex))
+            return
+        while not self.stopped and not end_ha2mqtt:
+            try:
+                the_data, the_address = the_socket.recvfrom(64)
+                handle_beacon(the_data, the_address[0])
+            except socket.timeout:
+                pass
+            except Exception as ex:
+                logging.error("error beacon listener - "+str(ex))
+        the_socket.close()
+    def stop(self):
+        self.stopped = True
+
+def update_beacon_listener():
+    # starts or stops the passive listener after the config changed, with --workers only worker 0 listens
+    global beacon_listener
+    with beacon_listener_lock:
+        if my_config.get("passive_discovery", "0") == "1" and worker_index == 0 and beacon_listener is None:
+            beacon_listener = beacon_listener_thread()
+        elif my_config.get("passive_discovery", "0") != "1" and beacon_listener is not None:
+            beacon_listener.stop()
+            beacon_listener = None
+
+def get_button_ips():
+    # the devices of the last search, with --workers it may have run in another worker
+    if worker_count > 1:
+        the_state = read_shared_state("search")
+        if the_state is not None and the_state["done"]:
+            return [the_entry[0] for the_entry in the_state["found"]]
+    return list(button_ips)
+
+def get_button_type_name(the_type):
+    # 102	Bulb
+    # 103	Button plus 1st generation
+    # 104	Button small/simple
+    # 105	LED Strip
+    # 106	Switch CH
+    # 107	Switch EU
+    # 110	Motion Sensor
+    # 112	Gateway
+    # 113	STECCO/CUBO
+    # 118	Button Plus 2nd generation
+    # 120	Switch Zero
+    if the_type == "103":
+        return "myStrom Button Plus Gen1"
+    elif the_type == "104":
+        return "myStrom Button"
+    elif the_type == "118":
+        return "myStrom Button Plus Gen2"
+    elif the_type == "110":
+        return "myStrom Motion Sensor"
+    return "unknown"
+
+def get_button_found_text(the_ip, the_type, the_mac):
+    return lang["button_found_1"]+" "+get_button_type_name(the_type)+" "+the_mac[-6:]+lang["button_found_2"]+" ("+the_ip+")"
+
+def search_buttons(the_job):
     global button_ips
-    global my_local_ip
-    global the_found_button_type
-    global the_found_button_mac
-    button_ips = []
-    test_ok = False
-    tmp = my_local_ip.split(".")
-    the_ip_range = my_local_ip[:len(my_local_ip)-len(tmp[-1])]
-    the_percentage = "10%";
-
-    #print("Erwarte Broadcast ...")
-    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) # UDP
-    client.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
-    # Enable broadcasting mode
-    client.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-    client.bind(("", 7979))
-    client.settimeout(4)
-    the_found_button_type = {}
-    the_found_button_mac = {}
-    t_end = time.time() + 9
+    the_job.set_progress(10)
+    the_scan_mode = my_config["scan_mode"]
+    try:
+        the_expected = int(my_config["scan_expected"])
+    except ValueError:
+        the_expected = 0
+
+    # active scan of the subnets, runs next to the broadcast listener
+    the_probe_done = threading.Event()
+    if the_scan_mode in ("active", "both"):
+        threading.Thread(target=probe_subnets, args=(the_job, the_expected, the_probe_done), daemon=True).start()
+
+    # the passive listener has the beacons already, they replace the 9 seconds of listening
+    # with --workers it runs in worker 0, the others see its beacons through get_present_devices
+    the_passive = beacon_listener is not None or (worker_count > 1 and my_config.get("passive_discovery", "0") == "1")
+    if the_passive:
+        for the_record in get_present_devices():
+            the_job.add_found(the_record.ip, the_record.type, the_record.mac)
+
+    if the_scan_mode in ("broadcast", "both") and not the_passive:
+        #print("Erwarte Broadcast ...")
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) # UDP
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        # Enable broadcasting mode
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        client.bind(("", 7979))
+        client.settimeout(0.5)
+        t_start = time.time()
+        t_end = t_start + 9
+    else:
+        client = None
+        if the_scan_mode in ("active", "both") and not (the_expected > 0 and the_job.found_count() >= the_expected):
+            the_probe_done.wait(60)
+        t_end = 0
     while time.time() < t_end:
-        the_percentage = "50%"
+        if the_probe_done.is_set() or (the_expected > 0 and the_job.found_count() >= the_expected):
+            break
+        # the broadcast listener runs for a fixed time, the probe may be faster
+        the_job.set_progress(10 + int(80 * (time.time() - t_start) / 9))
         try:
             data, addr = client.recvfrom(8)
             ip = addr[0]
             the_type = data[6]
-            the_mac = hex(data[0])[2:]+hex(data[1])[2:]+hex(data[2])[2:]+hex(data[3])[2:]+hex(data[4])[2:]+hex(data[5])[2:]
-            # 102	Bulb
-            # 103	Button plus 1st generation
-            # 104	Button small/simple
-            # 105	LED Strip
-            # 106	Switch CH
-            # 107	Switch EU
-            # 110	Motion Sensor
-            # 112	Gateway
-            # 113	STECCO/CUBO
-            # 118	Button Plus 2nd generation
-            # 120	Switch Zero
+            # same format as /api/v1/info and the button reports
+            the_mac = "".join("%02X" % the_byte for the_byte in data[:6])
             if ( (the_type == 103) or (the_type == 104) or (the_type == 118) or (the_type == 110) ):
-                the_found_button_type[ip] = str(the_type)
-                the_found_button_mac[ip] = the_mac
-            else:
-                pass
+                the_job.add_found(ip, str(the_type), the_mac)
         except:
             pass
-    the_percentage = "90%";
-    for the_test_ip in list(the_found_button_type.keys()):
-        button_ips.append(the_test_ip)
-        the_mac_id = the_found_button_mac[the_test_ip]
-        if the_found_button_type[the_test_ip] == "103" :
-            the_button_type = "myStrom Button Plus Gen1"
-        if the_found_button_type[the_test_ip] == "104" :
-            the_button_type = "myStrom Button"
-        elif the_found_button_type[the_test_ip] == "118" :
-            the_button_type = "myStrom Button Plus Gen2"
-        else:
-            the_button_type = "unknown"
-
-        the_instance.wfile.write(bytes("</p><p style=\"margin-left: 15px; font-size:22px;\">"+lang["button_found_1"]+" "+the_button_type+" "+the_mac_id[-6:]+lang["button_found_2"]+" ("+the_test_ip+")</p><p style=\"margin-left: 15px; font-size:22px;\">", "utf-8"))
-    the_percentage = "100%";
+    if client is not None:
+        client.close()
+    the_job.set_progress(90)
+    the_ips = []
+    for the_ip, the_type, the_mac in list(the_job.found):
+        the_ips.append(the_ip)
+        registry.update(the_mac, type=the_type, ip=the_ip, last_seen=time.time())
+    button_ips = the_ips
 
 def write_web_top_page (the_instance, the_url):
     global my_lang
     global given_password
-    the_instance.wfile.write(bytes("<html><head><title>" + lang['headline'] + "</title>", "utf-8"))
-    the_instance.wfile.write(bytes("<meta charset=\"UTF-8\">", "utf-8"))
-    the_instance.wfile.write(bytes("<link rel=\"stylesheet\" href=\"/mystrom2ha.css\">", "utf-8"))
-    the_instance.wfile.write(bytes("<link href=\"https://fonts.googleapis.com/icon?family=Material+Icons\" rel=\"stylesheet\">", "utf-8"))
-    the_instance.wfile.write(bytes("<script src=\"https://ajax.googleapis.com/ajax/libs/jquery/3.7.1/jquery.min.js\"></script>", "utf-8"))
-    the_instance.wfile.write(bytes("</head>", "utf-8"))
-    the_instance.wfile.write(bytes("<body>", "utf-8"))
+    the_instance.wfile.write(get_page_fragments()["head"])
     the_instance.wfile.write(bytes("<div id=\"top_bar\" class=\"navbar navbar-default\"><table width=\"100%\" border=\"0\"> <tbody><tr><td align=\"left\" valign=\"bottom\" style=\"padding: 15px 14px 0px 15px;\"><a href='/webif?password="+urllib.parse.quote(given_password)+"' style=\"color:white; font-size:28px; text-decoration: none; \"><i class=\"material-icons\">home</i> " + lang['headline'] + "</a><p></p></td><td align=\"right\" width=\"80pt\" style=\"padding-left:5px; padding-top:10px;\">", "utf-8"))
     if my_lang == "DE":
         the_instance.wfile.write(bytes("<a href=\""+ the_url+ "&lang=EN\" class=\"navbar-nav-icon\"><i class=\"material-icons\">language</i></a>", "utf-8"))
@@ -427,10 +1760,7 @@ def write_web_top_page (the_instance, the_url):
 
 
 def write_web_footer_page (the_instance):
-    the_instance.wfile.write(bytes("<div id =\"rsFooter\" class =\"footer\" style=\"height:22;\">", "utf-8"))
-    the_instance.wfile.write(bytes("<p class=\"footertext\">(c) <a href = \"https://www.computeq.co/\" class=\"footerlink\">MyStrom2HA by Computeq</a> 2024-" + str(datetime.date.today().year) + "</p>", "utf-8"))
-    the_instance.wfile.write(bytes("</div>", "utf-8"))
-    the_instance.wfile.write(bytes("</body></html>", "utf-8"))
+    the_instance.wfile.write(get_page_fragments()["footer"])
 
 def write_remark (the_instance, the_remark):
     the_instance.wfile.write(bytes("<br><p style=\"margin-left: 15px; font-size:18px;\">" + the_remark + "</p>", "utf-8"))
@@ -438,6 +1768,718 @@ def write_remark (the_instance, the_remark):
 def write_hint (the_instance, the_summary, the_details):
     the_instance.wfile.write(bytes("<details><summary>"+the_summary+"</summary>" + the_details + "</details>", "utf-8"))
 
+# what the button reports look like: the first type whose key is in the query decides,
+# all fields must be there, unknown actions give an empty trigger unless the type is strict
+# Actions:
+# SINGLE = 1
+# DOUBLE=2
+# LONG=3
+# TOUCH=4
+# WHEEL=5
+# WHEEL_FINAL=11
+# BATTERY=6
+# PIR: RISE=8, FALL=9, NIGHT=14, TWILIGHT=15, DAY=16
+report_device_types = (
+    {"kind": "gen1", "key": "battery", "name": "myStrom_Button_Gen1_", "fields": ("mac", "action", "battery"), "strict": False,
+     "actions": {"1": "single", "2": "double", "3": "long", "4": "touch", "5": "turn", "6": "battery", "11": "turn_ended"}},
+    {"kind": "gen2", "key": "bat", "name": "myStrom_Button_Gen2_", "fields": ("mac", "action", "index", "bat", "temp", "rh"), "strict": False,
+     "actions": {"1": "single", "2": "double", "3": "long", "6": "battery"}},
+    {"kind": "pir", "key": "value", "name": "myStrom_PIR_", "fields": ("mac", "action", "value"), "strict": True,
+     "actions": {"8": "rise", "9": "fall", "14": "night", "15": "twilight", "16": "day"}},
+)
+
+class button_event:
+    # a decoded /button_report, the same object for all device types
+    __slots__ = ("kind", "mac", "name", "action", "trigger", "index", "battery", "wheel", "temp", "rh", "light")
+
+    def __init__(self, the_kind, the_mac, the_name, the_action, the_trigger):
+        self.kind = the_kind
+        self.mac = the_mac
+        self.name = the_name
+        self.action = the_action
+        self.trigger = the_trigger
+        self.index = ""
+        self.battery = ""
+        self.wheel = 0
+        self.temp = ""
+        self.rh = ""
+        self.light = ""
+
+    def copy(self):
+        the_event = button_event(self.kind, self.mac, self.name, self.action, self.trigger)
+        for the_slot in button_event.__slots__:
+            setattr(the_event, the_slot, getattr(self, the_slot))
+        return the_event
+
+    def to_dict(self):
+        return {the_slot: getattr(self, the_slot) for the_slot in button_event.__slots__}
+
+def button_event_from_dict(the_dict):
+    the_event = button_event(the_dict["kind"], the_dict["mac"], the_dict["name"], the_dict["action"], the_dict["trigger"])
+    for the_slot in button_event.__slots__:
+        if the_slot in the_dict:
+            setattr(the_event, the_slot, the_dict[the_slot])
+    return the_event
+
+def parse_query(the_query):
+    # key=value pairs split on the first "=", empty segments and keys are skipped
+    the_components = {}
+    for the_segment in the_query.split("&"):
+        the_key, the_separator, the_value = the_segment.partition("=")
+        if the_key:
+            the_components[the_key] = the_value
+    return the_components
+
+def get_battery_percent(the_voltage):
+    # Gen2 reports the voltage, 3.0 V is empty, 4.0 V is full
+    if the_voltage > 4.0:
+        return "100"
+    elif the_voltage < 3.0:
+        return "0"
+    return str(round((the_voltage - 3.0) * 100 / (4.0 - 3.0)))
+
+def decode_button_report(the_query):
+    # returns a button_event, or None if the report does not fit any device type
+    for the_type in report_device_types:
+        if the_type["key"] in the_query:
+            break
+    else:
+        return None
+    for the_field in the_type["fields"]:
+        if the_field not in the_query:
+            return None
+    if not the_query["mac"] or not the_query["action"]:
+        return None
+    the_action = the_query["action"]
+    the_trigger = the_type["actions"].get(the_action)
+    if the_trigger is None:
+        if the_type["strict"]:
+            return None
+        the_trigger = ""
+    the_mac = the_query["mac"]
+    the_event = button_event(the_type["kind"], the_mac, the_type["name"] + the_mac, the_action, the_trigger)
+    try:
+        if the_event.kind == "gen1":
+            the_event.battery = the_query["battery"]
+            if the_action == "5":
+                the_event.wheel = int(the_query.get("wheel", ""))
+                the_event.trigger = "turn_left" if the_event.wheel < 0 else "turn_right"
+        elif the_event.kind == "gen2":
+            the_voltage = float(the_query["bat"])
+            if the_voltage != the_voltage:
+                return None
+            the_event.battery = get_battery_percent(the_voltage)
+            the_event.index = the_query["index"]
+            the_event.temp = the_query["temp"]
+            the_event.rh = the_query["rh"]
+        else:
+            the_event.light = the_query["value"]
+    except ValueError:
+        return None
+    return the_event
+
+def register_button_event(the_event, the_ip):
+    if the_event.kind == "gen1":
+        registry.update(the_event.mac, name=the_event.name, ip=the_ip, battery=the_event.battery, last_seen=time.time())
+    elif the_event.kind == "gen2":
+        registry.update(the_event.mac, type="118", name=the_event.name, ip=the_ip, battery=the_event.battery, last_seen=time.time())
+    else:
+        registry.update(the_event.mac, type="110", name=the_event.name, ip=the_ip, last_seen=time.time())
+
+def check_mqtt_publish(the_info):
+    # paho does not raise without connection, qos 0 messages are just not sent
+    if the_info.rc != mqtt_client.MQTT_ERR_SUCCESS:
+        raise ConnectionError("mqtt publish failed, rc " + str(the_info.rc))
+
+def publish_button_report(the_event, the_ip):
+    # returns False only if the action could not be published, the caller keeps it in the journal.
+    # Once the action is out the rest is best effort, a replay would fire the press twice.
+    global my_config
+    done_trigger="done"
+    the_mac = the_event.mac
+    the_name = the_event.name
+    the_topic = my_config["mqtt_base_topic"] + "/button/"
+
+    if the_event.kind == "gen1":
+        # Now MQTT to trigger HA
+        try:
+            the_mqtt_client = get_mqtt_publisher()
+            check_mqtt_publish(the_mqtt_client.publish(the_topic+the_mac+"/action",the_event.trigger))
+        except Exception as ex:
+            logging.error("error button_report Gen1 - "+str(ex))
+            metrics_count("mystrom2ha_mqtt_errors_total", "type=\"gen1\"")
+            return False
+        try:
+            check_mqtt_publish(the_mqtt_client.publish(the_topic+the_mac+"/action",done_trigger))
+            if the_event.action == "5":
+                the_mqtt_client.publish(the_topic+the_mac+"/action/turn",str(the_event.wheel))
+            publish_telemetry(the_mqtt_client, the_topic, the_mac, "battery", the_event.battery)
+            the_mqtt_client.publish(the_topic+the_mac+"/json","{\"action\":\"" + the_event.trigger + "\",\"name\":\""+the_name+"\",\"mac\":\""+the_mac+"\"}")
+            the_mqtt_client.publish(the_topic+the_mac+"/json","{\"action\":\"" + done_trigger + "\",\"name\":\""+the_name+"\",\"mac\":\""+the_mac+"\"}")
+            the_homeassistant_topic = get_ha_topic()
+            publish_discovery(the_mqtt_client, the_mac, "Gen1", the_name, [
+                (the_homeassistant_topic+"/sensor/"+the_mac+"/battery/config", "{\"device\": {\"identifiers\":[\""+the_mac+"\"], \"name\":\""+the_name+"(mystrom)\",\"model\":\"button"+"\",\"manufacturer\":\"myStrom\"},\"device_class\": \"battery\", \"entity_category\":\"diagnostic\", \"enabled_by_default\": true, \"name\": \"mystrom_"+the_name+"_battery\",  \"state_class\":  \"measurement\", \"unique_id\":\""+the_mac+"_battery\", \"state_topic\": \""+the_topic+the_mac+"/battery"+"\", \"unit_of_measurement\": \"%\" }"),
+                (the_homeassistant_topic+"/sensor/"+the_mac+"/action/config", "{\"device\": {\"identifiers\":[\""+the_mac+"\"], \"name\":\""+the_name+"(mystrom)\",\"model\":\"button"+"\",\"manufacturer\":\"myStrom\"}, \"enabled_by_default\": true, \"state_topic\": \""+the_topic+the_mac+"/json\", \"name\": \"mystrom_"+the_name+"_action\", \"unique_id\":\""+the_mac+"_action\", \"value_template\": \"{{ value_json.action}}\" }"),
+            ])
+
+        except Exception as ex:
+            logging.error("error button_report Gen1 details - "+str(ex))
+            metrics_count("mystrom2ha_mqtt_errors_total", "type=\"gen1\"")
+
+    elif the_event.kind == "gen2":
+        the_index = the_event.index
+
+        # Now HA Mqtt
+        try:
+            the_mqtt_client = get_mqtt_publisher()
+            check_mqtt_publish(the_mqtt_client.publish(the_topic+the_mac+"/action",the_index + "-" + the_event.trigger))
+        except Exception as ex:
+            logging.error("error button_report Gen2 - "+str(ex))
+            metrics_count("mystrom2ha_mqtt_errors_total", "type=\"gen2\"")
+            return False
+        try:
+            check_mqtt_publish(the_mqtt_client.publish(the_topic+the_mac+"/action",the_index + "-" + done_trigger))
+            publish_telemetry(the_mqtt_client, the_topic, the_mac, "temp", the_event.temp)
+            publish_telemetry(the_mqtt_client, the_topic, the_mac, "rh", the_event.rh)
+            publish_telemetry(the_mqtt_client, the_topic, the_mac, "battery", the_event.battery)
+            publish_telemetry(the_mqtt_client, the_topic, the_mac, "name", the_name)
+            the_mqtt_client.publish(the_topic+the_mac+"/json","{\"action\":\"" + the_index + "-" + the_event.trigger + "\",\"name\":\""+the_name+"\",\"mac\":\""+the_mac+"\", \"temp\":\""+the_event.temp+"\", \"rh\":\""+the_event.rh+"\"}")
+            the_mqtt_client.publish(the_topic+the_mac+"/json","{\"action\":\"" + the_index + "-" + done_trigger + "\",\"name\":\""+the_name+"\",\"mac\":\""+the_mac+"\", \"temp\":\""+the_event.temp+"\", \"rh\":\""+the_event.rh+"\"}")
+            the_homeassistant_topic = get_ha_topic()
+            publish_discovery(the_mqtt_client, the_mac, "Gen2", the_name, [
+                (the_homeassistant_topic+"/sensor/"+the_mac+"/battery/config", "{\"device\": {\"identifiers\":[\""+the_mac+"\"], \"name\":\""+the_name+"(mystrom)\",\"model\":\"Button plus Gen2\",\"manufacturer\":\"myStrom\"},\"device_class\": \"battery\", \"entity_category\":\"diagnostic\", \"enabled_by_default\": true, \"name\": \"mystrom_"+the_name+"_battery\",  \"state_class\":  \"measurement\", \"unique_id\":\""+the_mac+"_battery\", \"state_topic\": \""+the_topic+the_mac+"/battery"+"\", \"unit_of_measurement\": \"%\" }"),
+                (the_homeassistant_topic+"/sensor/"+the_mac+"/action/config", "{\"device\": {\"identifiers\":[\""+the_mac+"\"], \"name\":\""+the_name+"(mystrom)\",\"model\":\"Button plus Gen2\",\"manufacturer\":\"myStrom\"}, \"enabled_by_default\": true, \"state_topic\": \""+the_topic+the_mac+"/json\", \"name\": \"mystrom_"+the_name+"_action\", \"unique_id\":\""+the_mac+"_action\", \"value_template\": \"{{ value_json.action}}\" }"),
+                (the_homeassistant_topic+"/sensor/"+the_mac+"/temp/config", "{\"device\": {\"identifiers\":[\""+the_mac+"\"], \"name\":\""+the_name+"(mystrom)\",\"model\":\"Button plus Gen2\",\"manufacturer\":\"myStrom\"}, \"enabled_by_default\": true, \"state_topic\": \""+the_topic+the_mac+"/json\", \"name\": \"mystrom_"+the_name+"_temp\", \"unique_id\":\""+the_mac+"_temp\", \"value_template\": \"{{ value_json.temp}}\" }"),
+            ])
+
+        except Exception as ex:
+            logging.error("error button_report Gen2 details - "+str(ex))
+            metrics_count("mystrom2ha_mqtt_errors_total", "type=\"gen2\"")
+
+    else:
+        # Now MQTT
+        try:
+            the_mqtt_client = get_mqtt_publisher()
+            check_mqtt_publish(the_mqtt_client.publish(the_topic+the_mac+"/action",the_event.trigger))
+        except Exception as ex:
+            logging.error("error button_report PIR - "+str(ex))
+            metrics_count("mystrom2ha_mqtt_errors_total", "type=\"pir\"")
+            return False
+        try:
+            check_mqtt_publish(the_mqtt_client.publish(the_topic+the_mac+"/action",done_trigger))
+            publish_telemetry(the_mqtt_client, the_topic, the_mac, "name", the_name)
+            publish_telemetry(the_mqtt_client, the_topic, the_mac, "light", the_event.light)
+            the_mqtt_client.publish(the_topic+the_mac+"/json","{\"action\":\"" + the_event.trigger + "\",\"name\":\""+the_name+"\",\"mac\":\""+the_mac+"\", \"light\":\""+the_event.light+"\" }")
+            the_mqtt_client.publish(the_topic+the_mac+"/json","{\"action\":\"" + done_trigger + "\",\"name\":\""+the_name+"\",\"mac\":\""+the_mac+"\", \"light\":\""+the_event.light+"\" }")
+            the_homeassistant_topic = get_ha_topic()
+            publish_discovery(the_mqtt_client, the_mac, "PIR", the_name, [
+                (the_homeassistant_topic+"/sensor/"+the_mac+"/motion/config", "{\"device\": {\"identifiers\":[\""+the_mac+"\"], \"name\":\""+the_name+"(mystrom)\",\"model\":\"PIR\",\"manufacturer\":\"myStrom\"}, \"enabled_by_default\": true, \"state_topic\": \""+the_topic+the_mac+"/json\", \"name\": \"mystrom_"+the_name+"_motion\", \"unique_id\":\""+the_mac+"_motion\", \"value_template\": \"{{ value_json.action}}\" }"),
+                (the_homeassistant_topic+"/sensor/"+the_mac+"/light/config", "{\"device\": {\"identifiers\":[\""+the_mac+"\"], \"name\":\""+the_name+"(mystrom)\",\"model\":\"PIR\",\"manufacturer\":\"myStrom\"}, \"enabled_by_default\": true, \"state_topic\": \""+the_topic+the_mac+"/json\", \"name\": \"mystrom_"+the_name+"_light\", \"unique_id\":\""+the_mac+"_light\", \"value_template\": \"{{ value_json.light}}\" }"),
+            ])
+
+        except Exception as ex:
+            logging.error("error button_report PIR details - "+str(ex))
+            metrics_count("mystrom2ha_mqtt_errors_total", "type=\"pir\"")
+    return True
+
+def queue_button_report(the_query, the_ip):
+    the_event = decode_button_report(the_query)
+    if the_event is None:
+        with report_stats_lock:
+            report_stats["invalid"] += 1
+        logging.error("invalid button_report - "+str(the_query))
+        return False
+    the_action = the_event.action if the_event.action.isdigit() and len(the_event.action) <= 2 else "other"
+    metrics_count("mystrom2ha_button_reports_total", "type=\"" + the_event.kind + "\",action=\"" + the_action + "\"")
+    if is_duplicate_report(the_event):
+        with report_stats_lock:
+            report_stats["duplicates"] += 1
+        return True
+    if the_event.kind == "gen1" and the_event.action in ("5", "11"):
+        if coalesce_wheel_report(the_event, the_ip):
+            return True
+    return enqueue_button_report(the_event, the_ip)
+
+def get_report_owner(the_mac):
+    # with --workers every mac belongs to one worker, only that one queues, dedups, coalesces and publishes its reports
+    return zlib.crc32(the_mac.encode("utf-8")) % worker_count
+
+def get_report_route_address(the_index):
+    # abstract unix socket (linux), gone with the worker, nothing left on disk
+    return "\0mystrom2ha_" + str(button_request_port) + "_" + str(the_index)
+
+def route_button_report(the_query, the_ip):
+    # the device gets its answer only after the owner queued the report, so its next report can not overtake this one
+    if worker_count == 1:
+        return queue_button_report(the_query, the_ip)
+    the_owner = get_report_owner(the_query["mac"])
+    if the_owner == worker_index:
+        return queue_button_report(the_query, the_ip)
+    the_line = (json.dumps([the_ip, the_query]) + "\n").encode("utf-8")
+    the_connections = getattr(report_route_local, "connections", None)
+    if the_connections is None:
+        the_connections = report_route_local.connections = {}
+    the_error = None
+    for the_attempt in range(2):
+        # a connection of a restarted owner is closed, the second attempt opens a new one
+        the_connection = the_connections.get(the_owner)
+        try:
+            if the_connection is None:
+                the_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                the_socket.settimeout(report_route_timeout)
+                the_connection = (the_socket, the_socket.makefile('rwb'))
+                the_connections[the_owner] = the_connection
+                the_socket.connect(get_report_route_address(the_owner))
+            the_connection[1].write(the_line)
+            the_connection[1].flush()
+            the_answer = the_connection[1].readline()
+            if the_answer:
+                return the_answer == b"1\n"
+            raise ConnectionError("connection closed")
+        except OSError as ex:
+            the_error = ex
+            the_connections.pop(the_owner, None)
+            if the_connection is not None:
+                the_connection[1].close()
+                the_connection[0].close()
+    # the owner is just restarting, out of order is better than lost
+    logging.error("error route_button_report to worker " + str(the_owner) + " - " + str(the_error))
+    metrics_count("mystrom2ha_report_route_errors_total", "")
+    return queue_button_report(the_query, the_ip)
+
+class report_route_thread(threading.Thread):
+    # with --workers: takes the reports of our macs from the other workers, one thread listens, one serves each connection
+    def __init__(self, the_socket, the_listening):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.socket = the_socket
+        self.listening = the_listening
+        self.start()
+    def run(self):
+        if self.listening:
+            while not end_ha2mqtt:
+                try:
+                    the_connection, the_address = self.socket.accept()
+                except OSError as ex:
+                    logging.error("error report route accept - "+str(ex))
+                    time.sleep(1)
+                    continue
+                report_route_thread(the_connection, False)
+            return
+        try:
+            with self.socket.makefile('rwb') as the_file:
+                for the_line in the_file:
+                    the_ip, the_query = json.loads(the_line)
+                    the_file.write(b"1\n" if queue_button_report(the_query, the_ip) else b"0\n")
+                    the_file.flush()
+        except (OSError, ValueError) as ex:
+            logging.error("error report route - "+str(ex))
+        finally:
+            self.socket.close()
+
+def start_report_route():
+    # bound before the http server runs, the other workers may hand over reports as soon as they serve
+    the_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    the_socket.bind(get_report_route_address(worker_index))
+    the_socket.listen(64)
+    report_route_thread(the_socket, True)
+
+def is_duplicate_report(the_event):
+    # a device that got no answer in time sends the same report again, the retry has the same mac, action, index and values.
+    # Off by default: a real second press with the same values looks the same, switch it on for devices that are known to retry.
+    # Wheel steps and turn ended are left alone, they repeat on purpose and the wheel coalescing needs every one of them.
+    if the_event.kind == "gen1" and the_event.action in ("5", "11"):
+        return False
+    try:
+        the_window = float(my_config["dedup_window"])
+    except (KeyError, ValueError):
+        the_window = 0
+    if the_window <= 0:
+        return False
+    the_key = (the_event.mac, the_event.action, the_event.index, the_event.battery, the_event.temp, the_event.rh, the_event.light)
+    the_now = time.monotonic()
+    with dedup_lock:
+        the_seen = dedup_entries.get(the_key)
+        if the_seen is not None and the_now - the_seen < the_window:
+            the_duplicate = True
+        else:
+            the_duplicate = False
+            dedup_entries[the_key] = the_now
+            dedup_entries.move_to_end(the_key)
+            while len(dedup_entries) > dedup_max_entries:
+                dedup_entries.popitem(last=False)
+    metrics_count("mystrom2ha_dedup_total", "result=\"hit\"" if the_duplicate else "result=\"miss\"")
+    return the_duplicate
+
+def get_wheel_interval():
+    try:
+        the_rate = float(my_config["wheel_rate"])
+    except (KeyError, ValueError):
+        the_rate = 0
+    if the_rate <= 0:
+        return 0
+    return 1.0 / the_rate
+
+def take_wheel_pending(the_state):
+    # the last report of the window, carrying the summed wheel steps
+    if the_state["sum"] == 0:
+        return None
+    the_event = the_state["event"].copy()
+    the_event.wheel = the_state["sum"]
+    the_event.trigger = "turn_left" if the_event.wheel < 0 else "turn_right"
+    the_state["sum"] = 0
+    the_state["last_emit"] = time.monotonic()
+    return the_event
+
+def coalesce_wheel_report(the_event, the_ip):
+    # Gen1 wheel: sums the steps of one mac and sends at most wheel_rate turn updates per second,
+    # the rest of a turn is flushed before turn_ended. Returns True if the report was taken care of.
+    the_interval = get_wheel_interval()
+    the_mac = the_event.mac
+    with wheel_pending_lock:
+        if the_event.action == "11":
+            the_state = wheel_pending.pop(the_mac, None)
+            if the_state is None:
+                return False
+            if the_state["timer"] is not None:
+                the_state["timer"].cancel()
+            the_pending_event = take_wheel_pending(the_state)
+            if the_pending_event is not None:
+                enqueue_button_report(the_pending_event, the_ip)
+            enqueue_button_report(the_event, the_ip)
+            return True
+        if the_interval == 0:
+            return False
+        the_state = wheel_pending.setdefault(the_mac, {"sum": 0, "event": None, "ip": the_ip, "last_emit": 0.0, "timer": None})
+        the_state["sum"] += the_event.wheel
+        the_state["event"] = the_event
+        the_state["ip"] = the_ip
+        the_wait = the_state["last_emit"] + the_interval - time.monotonic()
+        if the_wait <= 0 and the_state["timer"] is None:
+            the_pending_event = take_wheel_pending(the_state)
+            if the_pending_event is not None:
+                enqueue_button_report(the_pending_event, the_ip)
+        elif the_state["timer"] is None:
+            the_state["timer"] = threading.Timer(max(the_wait, 0), flush_wheel_report, [the_mac])
+            the_state["timer"].daemon = True
+            the_state["timer"].start()
+    return True
+
+def flush_wheel_report(the_mac):
+    with wheel_pending_lock:
+        the_state = wheel_pending.get(the_mac)
+        if the_state is None:
+            return
+        the_state["timer"] = None
+        the_pending_event = take_wheel_pending(the_state)
+        if the_pending_event is not None:
+            enqueue_button_report(the_pending_event, the_state["ip"])
+
+def enqueue_button_report(the_event, the_ip):
+    # all reports of one mac go through the same queue, so they are published in order
+    the_queue = report_queues[hash(the_event.mac) % len(report_queues)]
+    try:
+        the_queue.put_nowait((time.monotonic(), the_event, the_ip))
+    except queue.Full:
+        with report_stats_lock:
+            report_stats["dropped"] += 1
+        logging.error("button_report queue full, report dropped - "+the_event.mac+" "+the_event.action)
+        return False
+    the_depth = sum(the_report_queue.qsize() for the_report_queue in report_queues)
+    with report_stats_lock:
+        report_stats["queued"] += 1
+        report_stats["max_depth"] = max(report_stats["max_depth"], the_depth)
+    return True
+
+def get_report_queue_state():
+    the_depth = sum(the_report_queue.qsize() for the_report_queue in report_queues)
+    with report_stats_lock:
+        if report_stats["published"] > 0:
+            the_lag_avg = report_stats["lag_sum"] / report_stats["published"]
+        else:
+            the_lag_avg = 0.0
+        the_state = "depth=%d max_depth=%d queued=%d published=%d dropped=%d invalid=%d duplicates=%d lag_avg_ms=%.1f lag_max_ms=%.1f" % (
+            the_depth, report_stats["max_depth"], report_stats["queued"], report_stats["published"], report_stats["dropped"],
+            report_stats["invalid"], report_stats["duplicates"], the_lag_avg * 1000, report_stats["lag_max"] * 1000)
+    if journal is not None:
+        the_state += " " + journal.get_state()
+    return the_state
+
+class report_publisher_thread(threading.Thread):
+    def __init__(self, the_queue):
+        threading.Thread.__init__(self)
+        self.queue = the_queue
+        self.daemon = True
+        self.start()
+    def run(self):
+        while not end_ha2mqtt:
+            the_received, the_event, the_ip = self.queue.get()
+            the_start = time.perf_counter()
+            register_button_event(the_event, the_ip)
+            # older reports of the same mac in the journal go first, without broker straight into the journal
+            if not mqtt_publisher_connected.is_set() or journal.has_pending(the_event.mac) or not publish_button_report(the_event, the_ip):
+                journal.append(time.time() - (time.monotonic() - the_received), the_event, the_ip)
+            metrics_observe("mystrom2ha_publish_seconds", "", time.perf_counter() - the_start)
+            the_lag = time.monotonic() - the_received
+            metrics_observe("mystrom2ha_report_lag_seconds", "", the_lag)
+            with report_stats_lock:
+                report_stats["published"] += 1
+                report_stats["lag_sum"] += the_lag
+                report_stats["lag_max"] = max(report_stats["lag_max"], the_lag)
+
+def start_report_publishers():
+    global report_queues
+    report_queues = [queue.Queue(maxsize=report_queue_size // report_publisher_count) for i in range(report_publisher_count)]
+    [report_publisher_thread(the_queue) for the_queue in report_queues]
+
+class report_journal:
+    # button reports that could not be published, appended to journal.jsonl and replayed in order once MQTT is back
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = collections.deque()
+        self.pending_by_mac = {}
+        self.path = None
+        self.file = None
+        self.size = 0
+        self.removed = 0
+        self.wakeup = threading.Event()
+        self.stats = {"journaled": 0, "replayed": 0, "expired": 0, "dropped": 0, "replay_rate": 0.0}
+
+    def load(self, the_path):
+        self.path = the_path
+        with self.lock:
+            if os.path.isfile(the_path):
+                with open(the_path, 'r') as f:
+                    for the_line in f:
+                        try:
+                            the_entry = json.loads(the_line)
+                            self.add_entry(the_entry["t"], button_event_from_dict(the_entry["event"]), the_entry["ip"], len(the_line.encode("utf-8")))
+                        except Exception as ex:
+                            logging.error("error journal line - "+str(ex))
+            self.compact()
+        if self.entries:
+            self.wakeup.set()
+
+    def add_entry(self, the_time, the_event, the_ip, the_length):
+        self.entries.append((the_time, the_event, the_ip, the_length))
+        self.pending_by_mac[the_event.mac] = self.pending_by_mac.get(the_event.mac, 0) + 1
+
+    def remove_entry(self):
+        the_time, the_event, the_ip, the_length = self.entries.popleft()
+        self.pending_by_mac[the_event.mac] -= 1
+        if self.pending_by_mac[the_event.mac] == 0:
+            del self.pending_by_mac[the_event.mac]
+        self.removed += 1
+
+    def compact(self):
+        # the file only ever gets appended to, replayed entries are dropped by rewriting it
+        try:
+            if self.file is not None:
+                self.file.close()
+            with open(self.path + ".tmp", 'w') as f:
+                for the_time, the_event, the_ip, the_length in self.entries:
+                    f.write(json.dumps({"t": the_time, "ip": the_ip, "event": the_event.to_dict()}) + "\n")
+            os.replace(self.path + ".tmp", self.path)
+            self.size = sum(the_entry[3] for the_entry in self.entries)
+            self.removed = 0
+            self.file = open(self.path, 'a')
+        except Exception as ex:
+            self.file = None
+            logging.error("error journal compact - "+str(ex))
+
+    def append(self, the_time, the_event, the_ip):
+        the_line = json.dumps({"t": the_time, "ip": the_ip, "event": the_event.to_dict()}) + "\n"
+        the_length = len(the_line.encode("utf-8"))
+        with self.lock:
+            if self.size + the_length > journal_max_bytes:
+                # full: the oldest reports are the least useful ones
+                while self.entries and self.size + the_length > journal_max_bytes:
+                    self.size -= self.entries[0][3]
+                    self.remove_entry()
+                    self.stats["dropped"] += 1
+                    metrics_count("mystrom2ha_journal_events_total", "result=\"dropped\"")
+                self.compact()
+            self.add_entry(the_time, the_event, the_ip, the_length)
+            self.size += the_length
+            self.stats["journaled"] += 1
+            try:
+                self.file.write(the_line)
+                self.file.flush()
+            except Exception as ex:
+                logging.error("error journal append - "+str(ex))
+        metrics_count("mystrom2ha_journal_events_total", "result=\"journaled\"")
+        self.wakeup.set()
+
+    def has_pending(self, the_mac):
+        with self.lock:
+            return the_mac in self.pending_by_mac
+
+    def pending(self):
+        with self.lock:
+            return len(self.entries)
+
+    def peek(self):
+        with self.lock:
+            if not self.entries:
+                return None
+            return self.entries[0]
+
+    def done(self, the_result):
+        with self.lock:
+            self.size -= self.entries[0][3]
+            self.remove_entry()
+            self.stats[the_result] += 1
+            if not self.entries or self.removed >= journal_compact_every:
+                self.compact()
+        metrics_count("mystrom2ha_journal_events_total", "result=\"" + the_result + "\"")
+
+    def get_state(self):
+        with self.lock:
+            return "journal=%d journaled=%d replayed=%d expired=%d journal_dropped=%d replay_rate=%.1f" % (
+                len(self.entries), self.stats["journaled"], self.stats["replayed"], self.stats["expired"], self.stats["dropped"], self.stats["replay_rate"])
+
+def replay_report_journal():
+    # publishes the journal in order at journal_replay_rate, reports older than journal_max_age are dropped
+    the_max_age = get_config_float("journal_max_age", 60)
+    the_rate = get_config_float("journal_replay_rate", 20)
+    the_start = time.perf_counter()
+    the_count = 0
+    while mqtt_publisher_connected.is_set() and not end_ha2mqtt:
+        the_entry = journal.peek()
+        if the_entry is None:
+            break
+        the_time, the_event, the_ip, the_length = the_entry
+        if time.time() - the_time > the_max_age:
+            journal.done("expired")
+            continue
+        if not publish_button_report(the_event, the_ip):
+            # lost the broker again, the next connect starts over
+            break
+        journal.done("replayed")
+        the_count += 1
+        if the_rate > 0:
+            the_wait = the_start + the_count / the_rate - time.perf_counter()
+            if the_wait > 0:
+                time.sleep(the_wait)
+    if the_count > 0:
+        the_duration = time.perf_counter() - the_start
+        with journal.lock:
+            journal.stats["replay_rate"] = the_count / the_duration
+        logging.info("journal replayed %d reports in %.2f s" % (the_count, the_duration))
+
+class journal_replay_thread(threading.Thread):
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.start()
+    def run(self):
+        while not end_ha2mqtt:
+            journal.wakeup.wait(5)
+            journal.wakeup.clear()
+            if mqtt_publisher_connected.is_set() and journal.pending() > 0:
+                try:
+                    replay_report_journal()
+                except Exception as ex:
+                    logging.error("error journal replay - "+str(ex))
+
+def get_battery_poll_interval(the_record, the_failures):
+    # shorter with a low battery, doubled for every poll the device did not answer (buttons sleep between presses)
+    the_interval = get_config_float("battery_poll_interval", 3600)
+    try:
+        if the_record.battery != "" and float(the_record.battery) < get_config_float("battery_poll_low", 20):
+            the_interval = the_interval / 4
+    except ValueError:
+        pass
+    return min(the_interval * 2 ** the_failures, battery_poll_max_interval)
+
+def poll_device_battery(the_record):
+    # returns the telemetry values of one device, raises if it does not answer
+    import urllib.request
+    the_type = the_record.type
+    if the_type == "" and the_record.battery != "":
+        # Gen1 reports do not carry the type
+        the_type = "104"
+    the_endpoint = battery_poll_endpoints.get(the_type)
+    if the_endpoint is None:
+        return {}
+    response = urllib.request.urlopen("http://" + the_record.ip + the_endpoint, timeout=battery_poll_timeout)
+    the_response = json.loads(response.read().decode("utf8"))
+    if the_type == "118":
+        return {"battery": get_battery_percent(float(the_response['battery']['voltage'])), "temp": str(the_response['temperature']), "rh": str(the_response['humidity'])}
+    elif the_type == "110":
+        return {}
+    the_device = the_response.get(the_record.mac)
+    if the_device is None and len(the_response) == 1:
+        the_device = list(the_response.values())[0]
+    return {"battery": get_battery_percent(float(the_device['voltage']))}
+
+def publish_battery_poll(the_record, the_values):
+    registry.update(the_record.mac, last_seen=time.time(), **({"battery": the_values["battery"]} if "battery" in the_values else {}))
+    if not mqtt_publisher_connected.is_set():
+        return
+    try:
+        the_mqtt_client = get_mqtt_publisher()
+        for the_name, the_value in the_values.items():
+            publish_telemetry(the_mqtt_client, my_config["mqtt_base_topic"] + "/button/", the_record.mac, the_name, the_value)
+    except Exception as ex:
+        logging.error("error battery poll publish - "+str(ex))
+
+def get_due_battery_polls(the_now):
+    # devices with an ip whose last report or poll is older than their interval
+    # with --workers every worker polls the macs it owns, their telemetry cache and deadband are there
+    the_due = []
+    for the_record in registry.devices():
+        if the_record.ip == "":
+            continue
+        if worker_count > 1 and get_report_owner(the_record.mac) != worker_index:
+            continue
+        the_schedule = battery_poll_schedule.setdefault(the_record.mac, {"failures": 0, "attempt": 0.0, "running": False})
+        if the_schedule["running"]:
+            continue
+        if the_record.last_seen > the_schedule["attempt"]:
+            # the device reported since the last poll, it is awake
+            the_schedule["failures"] = 0
+        the_last = max(the_record.last_seen, the_schedule["attempt"])
+        if the_now - the_last >= get_battery_poll_interval(the_record, the_schedule["failures"]):
+            the_due.append(the_record)
+    return the_due
+
+def run_battery_poll(the_record):
+    the_schedule = battery_poll_schedule[the_record.mac]
+    try:
+        the_values = poll_device_battery(the_record)
+    except Exception as ex:
+        logging.debug("battery poll %s %s - %s", the_record.mac, the_record.ip, ex)
+        the_schedule["failures"] += 1
+        metrics_count("mystrom2ha_battery_poll_total", "result=\"unreachable\"")
+    else:
+        the_schedule["failures"] = 0
+        publish_battery_poll(the_record, the_values)
+        metrics_count("mystrom2ha_battery_poll_total", "result=\"ok\"")
+    the_schedule["attempt"] = time.time()
+    the_schedule["running"] = False
+
+class battery_poll_thread(threading.Thread):
+    # polls the known devices with its own few threads, so it never takes a http worker from /button_report
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.start()
+    def run(self):
+        the_executor = concurrent.futures.ThreadPoolExecutor(max_workers=battery_poll_workers, thread_name_prefix="mystrom2ha_poll")
+        battery_poll_wakeup.wait(battery_poll_start_delay)
+        while not end_ha2mqtt:
+            battery_poll_wakeup.clear()
+            if get_config_float("battery_poll_interval", 3600) > 0:
+                try:
+                    for the_record in get_due_battery_polls(time.time()):
+                        battery_poll_schedule[the_record.mac]["running"] = True
+                        the_executor.submit(run_battery_poll, the_record)
+                except Exception as ex:
+                    logging.error("error battery poll - "+str(ex))
+            battery_poll_wakeup.wait(60)
+        the_executor.shutdown(wait=False, cancel_futures=True)
+
 class button_thread(threading.Thread):
     def __init__(self, i):
         threading.Thread.__init__(self)
@@ -459,53 +2501,144 @@ class button_thread(threading.Thread):
         logging.info("server stopped.")  
 
 class button_server_handler(BaseHTTPRequestHandler):
-    def log_message(self, format, *args):
+    # persistent connections, every response has a Content-Length or ends with Connection: close
+    protocol_version = "HTTP/1.1"
+    timeout = keepalive_idle_timeout
+    # headers and body of static files are separate writes, on a kept open connection Nagle would hold the body back for the delayed ACK
+    disable_nagle_algorithm = True
+    requests_left = 1
+
+    def handle(self):
+        # each kept open connection holds one of the 20 button_threads, so only keepalive_max_connections of them may wait for a next request
+        global keepalive_connections
+        with keepalive_lock:
+            keepalive_connections += 1
+            self.requests_left = keepalive_max_requests if keepalive_connections <= keepalive_max_connections else 1
         try:
-            logging.info("%s - - %s\n" % (self.address_string(),format%args))
-        except:
-            logging.info("%s - - %s\n" % (self.address_string(),format%args))
+            BaseHTTPRequestHandler.handle(self)
+        finally:
+            with keepalive_lock:
+                keepalive_connections -= 1
+
+    def end_headers(self):
+        self.requests_left -= 1
+        if self.requests_left <= 0 and not self.close_connection:
+            self.send_header("Connection", "close")
+        BaseHTTPRequestHandler.end_headers(self)
+
+    def log_message(self, format, *args):
+        # formatted by the log listener thread, not in the request
+        logging.info("%s - - " + format, self.address_string(), *args)
 
     def do_HEAD(self):
         for the_header in self.headers:
-            logging.info("header:"+str(the_header))
+            logging.debug("header: %s", the_header)
         self.send_response(200)
         self.send_header('Content-type', 'text/html')
+        self.send_header("Content-Length", "0")
         self.end_headers()
 
 
     def do_GET(self):
+        # the only cost without a running capture is this check
+        the_capture = profile_capture
+        if the_capture is None or not the_capture.is_running() or "action=profile" in self.path:
+            self.serve_get()
+            return
+        the_capture.enter()
+        try:
+            self.serve_get()
+        finally:
+            the_capture.leave()
+
+    def serve_get(self):
+        if self.path == '/metrics':
+            the_body = bytes(render_metrics(), "utf-8")
+            self.send_response(200)
+            self.send_header("Content-type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(the_body)))
+            self.end_headers()
+            self.wfile.write(the_body)
+            return
+        # a query string like ?v=2 only busts caches, the file is the same
+        the_static_path = urllib.parse.urlsplit(self.path).path
+        if the_static_path.endswith(tuple(static_types)):
+            the_start = time.perf_counter()
+            self.send_static_asset(get_static_asset(the_static_path))
+            metrics_observe("mystrom2ha_request_seconds", "route=\"static\"", time.perf_counter() - the_start)
+            return
+        the_start = time.perf_counter()
+        metrics_gauge("mystrom2ha_active_workers", 1)
+        the_page = page_buffer(self)
+        self.wfile = the_page
+        try:
+            self.handle_get()
+        finally:
+            the_page.finish()
+            self.wfile = the_page.wfile
+            metrics_gauge("mystrom2ha_active_workers", -1)
+            metrics_observe("mystrom2ha_request_seconds", "route=\"" + get_metrics_route(self.path) + "\"", time.perf_counter() - the_start)
+
+    def send_static_asset(self, the_asset):
+        if the_asset is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        the_data = the_asset.data
+        the_etag = the_asset.etag
+        the_gzip = the_asset.gzip_data is not None and accepts_gzip(self.headers.get("Accept-Encoding"))
+        if the_gzip:
+            the_data = the_asset.gzip_data
+            the_etag = the_asset.gzip_etag
+        if etag_matches(self.headers.get("If-None-Match"), the_etag):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", the_etag)
+            self.send_header("Cache-Control", "max-age=" + str(static_max_age))
+            if the_asset.gzip_data is not None:
+                self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-type", the_asset.content_type)
+        self.send_header("ETag", the_etag)
+        self.send_header("Cache-Control", "max-age=" + str(static_max_age))
+        if the_asset.gzip_data is not None:
+            self.send_header("Vary", "Accept-Encoding")
+        if the_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(the_data) if the_data is not None else the_asset.size))
+        self.end_headers()
+        if the_data is not None:
+            self.wfile.write(the_data)
+            return
+        with open(the_asset.path, 'rb') as f:
+            if self.connection is not None:
+                self.wfile.flush()
+                self.connection.sendfile(f)
+            else:
+                # no socket of our own in asyncio mode
+                self.wfile.write(f.read())
+
+    def handle_get(self):
         global my_lang
         global end_ha2mqtt
         global access_password
         global button_search_running
         global button_ips 
-        global the_found_button_type
-        global the_found_button_mac
         global given_password
         global timeout_start
         global my_config
         global search_given_password
+        global profile_capture
         is_mobile = 'false'
         the_message = ""
         query_components = dict()
         wrong_password = False
-        # Send apropriate header
-        if self.path.endswith('.jpg') or self.path.endswith('.jpeg') :
-            self.send_response(200)
-            self.send_header("Content-type", "image/jpeg")
-            self.end_headers()
-        elif self.path.endswith('.png'):
-            self.send_response(200)
-            self.send_header("Content-type", "image/png")
-            self.end_headers()
-        else:
-            self.send_response(200)
-            self.send_header("Content-type", "text/html")
-            self.end_headers()
         # request content
+        the_parse_start = time.perf_counter()
         if ("=" in self.path):
-            query = urlparse(self.path).query
-            query_components = dict(qc.split("=") for qc in query.split("&"))
+            query_components = parse_query(self.path.partition("?")[2])
+        if self.path.startswith('/button_report'):
+            metrics_observe("mystrom2ha_report_parse_seconds", "", time.perf_counter() - the_parse_start)
         if "lang" in query_components.keys():
             my_lang = query_components["lang"]
         if "password" in query_components.keys():
@@ -517,20 +2650,13 @@ class button_server_handler(BaseHTTPRequestHandler):
             wrong_password = True
         if self.path == '/logout' or self.path == '/' or self.path == '' :
             given_password = ""
-        if my_lang == "DE":
-            declare_text_snippets_de()
-        else:
-            declare_text_snippets_en()
-        if self.path.endswith('.css') or self.path.endswith('.htm') or self.path.endswith('.html') :
-            if os.path.isfile(get_script_directory() + self.path):
-                with open(get_script_directory() + self.path, 'r') as f:
-                    self.wfile.write(bytes(f.read(), "utf-8"))
-        elif self.path.endswith('.jpg') or self.path.endswith('.jpeg') :
-            if os.path.isfile(get_script_directory() + self.path):
-                with open(get_script_directory() + self.path, 'rb') as f:
-                    the_image_in_bytes = f.read()
-                    self.wfile.write(the_image_in_bytes)
-
+        select_text_snippets(my_lang)
+        # static files are answered by send_static_asset
+        if self.path.startswith( '/webif' ) and given_password == access_password and query_components.get("action") == "profile_download":
+            self.wfile.content_type = "application/octet-stream"
+            self.wfile.extra_headers.append(("Content-Disposition", "attachment; filename=\"mystrom2ha.prof\""))
+            if profile_capture is not None:
+                self.wfile.write(profile_capture.get_dump())
         elif self.path.startswith( '/webif' ) and given_password == access_password:
             write_web_top_page (self, "/webif?password="+urllib.parse.quote(given_password) )
             if "action" in query_components.keys() :
@@ -550,14 +2676,39 @@ class button_server_handler(BaseHTTPRequestHandler):
                         write_sub_head_line (self,"ERROR")
                     
                     self.wfile.write(bytes("<center><a href='/webif?password=" + urllib.parse.quote(given_password) +"' class='btn btn-primary'>" + lang['close'] + "</a></center>", "utf-8"))
-                    
+
+                elif query_components["action"] == "program_button_bulk":
+                    if "button_ip_list" in query_components.keys():
+                        the_ips = parse_ip_list(urllib.parse.unquote_plus(query_components["button_ip_list"]))
+                    else:
+                        the_ips = get_button_ips()
+                    write_sub_head_line (self, lang["program_all_buttons"]+" ("+str(len(the_ips))+")")
+                    self.wfile.flush()
+                    the_ok_count = 0
+                    # every result is sent as soon as its button is done
+                    for the_ip, the_programming_status, the_attempts in programm_mystrom_buttons(the_ips):
+                        if the_programming_status == "ok":
+                            the_ok_count += 1
+                            write_remark (self, the_ip + " - OK (" + str(the_attempts) + " " + lang["attempts"] + ")")
+                        else:
+                            write_remark (self, the_ip + " - <font color=\"red\">NOK</font> (" + str(the_attempts) + " " + lang["attempts"] + ")")
+                        self.wfile.flush()
+                    write_sub_head_line (self, lang["bulk_programming_done"] + " " + str(the_ok_count) + "/" + str(len(the_ips)))
+                    if the_ok_count < len(the_ips):
+                        write_hint (self, lang["search_buttons"], lang["programm_button_hint_1"])
+                    self.wfile.write(bytes("<center><a href='/webif?password=" + urllib.parse.quote(given_password) +"' class='btn btn-primary'>" + lang['close'] + "</a></center>", "utf-8"))
+
                 elif query_components["action"] == "program_button_start":
                     write_sub_head_line (self, lang["program_button"])
                     self.wfile.write(bytes("<table width='100%' border='0' >", "utf-8"))
-
-                    for the_number in button_ips:
-                        the_mac_id = the_found_button_mac[the_number]
-                        the_type = the_found_button_type[the_number]
+                    the_button_ips = get_button_ips()
+
+                    for the_number in the_button_ips:
+                        the_record = registry.get_by_ip(the_number)
+                        if the_record is None:
+                            continue
+                        the_mac_id = the_record.mac
+                        the_type = the_record.type
                         the_button_type = ""
                         if the_type == "103":
                             the_button_type = "myStrom Button Plus Gen1"
@@ -584,6 +2735,8 @@ class button_server_handler(BaseHTTPRequestHandler):
                         self.wfile.write(bytes("<td width='20px'></td>", "utf-8"))
                         self.wfile.write(bytes("</form></tr>", "utf-8"))
                     self.wfile.write(bytes("</table>", "utf-8"))
+                    if len(the_button_ips) > 1:
+                        self.wfile.write(bytes("<center><a class='btn btn-primary' href='/webif?action=program_button_bulk&password=" + urllib.parse.quote(given_password) + "'>" + lang['program_all_buttons'] + "</a></center>", "utf-8"))
 
                 elif query_components["action"] == "search_button":
                     search_given_password = given_password
@@ -592,13 +2745,18 @@ class button_server_handler(BaseHTTPRequestHandler):
                     self.wfile.write(bytes("document.getElementById('the_state_div').innerHTML = ''; ", "utf-8"))
                     self.wfile.write(bytes("document.getElementById('the_percentage').innerHTML = '1%'; ", "utf-8"))
                     self.wfile.write(bytes("document.getElementById('the_search_div').innerHTML = ''; ", "utf-8"))
-                    self.wfile.write(bytes("var $link = '/start_button_search' ; ", "utf-8"))
-                    self.wfile.write(bytes("$( '#the_search_div' ).load( $link );}", "utf-8"))
+                    # found devices and progress are pushed by the server, the old polling stays for browsers without EventSource
+                    self.wfile.write(bytes("if (!window.EventSource) { $( '#the_search_div' ).load( '/start_button_search' ); return; } ", "utf-8"))
+                    self.wfile.write(bytes("var the_search_id = ''; var the_events = new EventSource('/button_search_events'); ", "utf-8"))
+                    self.wfile.write(bytes("the_events.addEventListener('job', function(e) { the_search_id = e.data; }); ", "utf-8"))
+                    self.wfile.write(bytes("the_events.addEventListener('progress', function(e) { $( '#the_percentage' ).html( e.data + '%' ); }); ", "utf-8"))
+                    self.wfile.write(bytes("the_events.addEventListener('found', function(e) { $( '#the_state_div' ).append( $( '<p style=\"margin-left: 15px; font-size:22px;\"></p>' ).text( JSON.parse(e.data).text ) ); }); ", "utf-8"))
+                    self.wfile.write(bytes("the_events.addEventListener('done', function(e) { the_events.close(); $( '#the_search_div' ).load( '/start_button_search?id=' + the_search_id ); }); }", "utf-8"))
                     self.wfile.write(bytes("function set_state() { ", "utf-8"))
                     self.wfile.write(bytes("var $link2 = '/button_search_state' ; ", "utf-8"))
                     self.wfile.write(bytes("$( '#the_percentage' ).load( $link2 );}", "utf-8"))
                     self.wfile.write(bytes("function update_state() { ", "utf-8"))
-                    self.wfile.write(bytes("setInterval(function(){ set_state(); }, 2000); }", "utf-8"))
+                    self.wfile.write(bytes("if (!window.EventSource) { setInterval(function(){ set_state(); }, 2000); } }", "utf-8"))
                     self.wfile.write(bytes("</script>", "utf-8"))
 
                     write_hint (self, lang["search_buttons"], lang["programm_button_hint_1"])
@@ -617,6 +2775,14 @@ class button_server_handler(BaseHTTPRequestHandler):
                     self.wfile.write(bytes("</td><td><center><input type=\"submit\" class='btn btn-primary' value=\"" + lang['program_button'] + "\" /></center>", "utf-8"))
                     self.wfile.write(bytes("</td></tr></table></div></form>", "utf-8"))
 
+                    self.wfile.write(bytes("<p></p><form id=\"program_button_list_form\" action=\"webif\" method=\"get\">", "utf-8"))
+                    self.wfile.write(bytes("<input type=\"hidden\" id= \"action\" name= \"action\" value=\"program_button_bulk\">", "utf-8"))
+                    self.wfile.write(bytes("<input type=\"hidden\" id= \"password\" name= \"password\" value=\""+urllib.parse.quote(given_password)+"\">", "utf-8"))
+                    self.wfile.write(bytes("<div style=\"margin-left:50px; margin-right:50px ; width:100%;\"><table><tr><td>", "utf-8"))
+                    self.wfile.write(bytes("<label for=\"button_ip_list\">" + lang["button_ip_list"] + "</label><br><textarea id=\"button_ip_list\" name=\"button_ip_list\" rows=\"4\" cols=\"40\" required=\"\"></textarea>", "utf-8"))
+                    self.wfile.write(bytes("</td><td><center><input type=\"submit\" class='btn btn-primary' value=\"" + lang['program_all_buttons'] + "\" /></center>", "utf-8"))
+                    self.wfile.write(bytes("</td></tr></table></div></form>", "utf-8"))
+
 
                     self.wfile.write(bytes("</div>", "utf-8"))
 
@@ -635,9 +2801,36 @@ class button_server_handler(BaseHTTPRequestHandler):
                         my_config["mqtt_user"] = urllib.parse.unquote(query_components["mqtt_user"])
                     if "mqtt_password" in query_components.keys():
                         my_config["mqtt_password"] = urllib.parse.unquote(query_components["mqtt_password"])
+                    if "wheel_rate" in query_components.keys():
+                        my_config["wheel_rate"] = urllib.parse.unquote(query_components["wheel_rate"])
+                    if "scan_mode" in query_components.keys() and urllib.parse.unquote(query_components["scan_mode"]) in ("broadcast", "active", "both"):
+                        my_config["scan_mode"] = urllib.parse.unquote(query_components["scan_mode"])
+                    if "scan_subnets" in query_components.keys():
+                        my_config["scan_subnets"] = urllib.parse.unquote_plus(query_components["scan_subnets"])
+                    if "scan_expected" in query_components.keys():
+                        my_config["scan_expected"] = urllib.parse.unquote(query_components["scan_expected"])
+                    if "journal_max_age" in query_components.keys():
+                        my_config["journal_max_age"] = urllib.parse.unquote(query_components["journal_max_age"])
+                    if "journal_replay_rate" in query_components.keys():
+                        my_config["journal_replay_rate"] = urllib.parse.unquote(query_components["journal_replay_rate"])
+                    if "dedup_window" in query_components.keys():
+                        my_config["dedup_window"] = urllib.parse.unquote(query_components["dedup_window"])
+                    if "report_record" in query_components.keys():
+                        my_config["report_record"] = urllib.parse.unquote(query_components["report_record"])
+                    if "passive_discovery" in query_components.keys():
+                        my_config["passive_discovery"] = urllib.parse.unquote(query_components["passive_discovery"])
+                    for the_key in ("telemetry_heartbeat", "telemetry_deadband_battery", "telemetry_deadband_temp", "telemetry_deadband_rh", "telemetry_deadband_light", "battery_poll_interval", "battery_poll_low"):
+                        if the_key in query_components.keys():
+                            my_config[the_key] = urllib.parse.unquote(query_components[the_key])
                             
                     write_config()
                     mqtt_test_working = test_mqtt()
+                    clear_discovery_cache()
+                    clear_telemetry_cache()
+                    update_report_recorder()
+                    update_beacon_listener()
+                    battery_poll_wakeup.set()
+                    start_mqtt_publisher()
                     write_sub_head_line (self, lang["config_mystron2ha"])
                     self.wfile.write(bytes("<center><form id=\"config_form\" action=\"webif\" method=\"get\">", "utf-8"))
                     self.wfile.write(bytes("<input type=\"hidden\" id= \"action\" name= \"action\" value=\"m2h_config\">", "utf-8"))
@@ -650,6 +2843,17 @@ class button_server_handler(BaseHTTPRequestHandler):
                     write_input_text (self, "mqtt_ha_topic", "mqtt_ha_topic", lang["mqtt_ha_topic"], my_config["mqtt_ha_topic"], True)
                     write_input_text (self, "mqtt_user", "mqtt_user", lang["mqtt_user"], my_config["mqtt_user"], False)
                     write_input_text (self, "mqtt_password", "mqtt_password", lang["mqtt_password"], my_config["mqtt_password"], False)
+                    write_input_text (self, "wheel_rate", "wheel_rate", lang["wheel_rate"], my_config["wheel_rate"], False)
+                    write_input_text (self, "scan_mode", "scan_mode", lang["scan_mode"], my_config["scan_mode"], False)
+                    write_input_text (self, "scan_subnets", "scan_subnets", lang["scan_subnets"], my_config["scan_subnets"], False)
+                    write_input_text (self, "scan_expected", "scan_expected", lang["scan_expected"], my_config["scan_expected"], False)
+                    write_input_text (self, "journal_max_age", "journal_max_age", lang["journal_max_age"], my_config["journal_max_age"], False)
+                    write_input_text (self, "journal_replay_rate", "journal_replay_rate", lang["journal_replay_rate"], my_config["journal_replay_rate"], False)
+                    write_input_text (self, "dedup_window", "dedup_window", lang["dedup_window"], my_config["dedup_window"], False)
+                    write_input_text (self, "report_record", "report_record", lang["report_record"], my_config["report_record"], False)
+                    write_input_text (self, "passive_discovery", "passive_discovery", lang["passive_discovery"], my_config["passive_discovery"], False)
+                    for the_key in ("telemetry_heartbeat", "telemetry_deadband_battery", "telemetry_deadband_temp", "telemetry_deadband_rh", "telemetry_deadband_light", "battery_poll_interval", "battery_poll_low"):
+                        write_input_text (self, the_key, the_key, lang[the_key], my_config[the_key], False)
                     self.wfile.write(bytes("</div>", "utf-8"))
                     if mqtt_test_working :
                         write_sub_head_line (self, lang["mqtt_connection_ok"])
@@ -659,21 +2863,122 @@ class button_server_handler(BaseHTTPRequestHandler):
                     self.wfile.write(bytes("&nbsp;<a href='/webif?password=" + urllib.parse.quote(given_password) +"' class='btn btn-primary'>" + lang['back'] + "</a> \n", "utf-8"))
                     self.wfile.write(bytes("</form></center><br><br>", "utf-8"))
 
+                elif query_components["action"] == "profile":
+                    if "start" in query_components.keys():
+                        try:
+                            the_requests = max(1, int(query_components.get("requests", "200")))
+                            the_seconds = max(1, float(query_components.get("seconds", "30")))
+                        except ValueError:
+                            the_requests = 200
+                            the_seconds = 30
+                        profile_capture = profile_capture_run(the_requests, the_seconds)
+                    elif "stop" in query_components.keys() and profile_capture is not None:
+                        profile_capture.stop()
+                    the_sort = query_components.get("sort", "cumulative")
+                    if the_sort not in profile_sort_keys:
+                        the_sort = "cumulative"
+                    the_capture = profile_capture
+                    the_profile_link = "/webif?action=profile&password=" + urllib.parse.quote(given_password)
+                    write_sub_head_line (self, lang["profile"])
+                    if the_capture is None:
+                        write_remark (self, lang["profile_none"])
+                    else:
+                        write_remark (self, (lang["profile_running"] if the_capture.is_running() else lang["profile_done"]) + ": " + str(the_capture.requests) + "/" + str(the_capture.max_requests) + " " + lang["profile_requests"] + ", " + str(the_capture.samples) + " " + lang["profile_samples"] + ", " + str(round(min(time.time(), the_capture.end) - the_capture.started, 1)) + " s" + (" (worker " + str(worker_index) + ")" if worker_count > 1 else ""))
+                    self.wfile.write(bytes("<center><form id=\"profile_form\" action=\"webif\" method=\"get\">", "utf-8"))
+                    self.wfile.write(bytes("<input type=\"hidden\" id= \"action\" name= \"action\" value=\"profile\">", "utf-8"))
+                    self.wfile.write(bytes("<input type=\"hidden\" id= \"password\" name= \"password\" value=\""+urllib.parse.quote(given_password)+"\">", "utf-8"))
+                    self.wfile.write(bytes("<input type=\"hidden\" id= \"start\" name= \"start\" value=\"1\">", "utf-8"))
+                    self.wfile.write(bytes("<div style=\"margin-left:50px; margin-right:50px ; width:80%;\">", "utf-8"))
+                    write_input_text (self, "requests", "requests", lang["profile_requests"], "200", False)
+                    write_input_text (self, "seconds", "seconds", lang["profile_seconds"], "30", False)
+                    self.wfile.write(bytes("</div>", "utf-8"))
+                    self.wfile.write(bytes("<input type=\"submit\" class='btn btn-primary' value=\"" + lang['profile_start'] + "\" />", "utf-8"))
+                    self.wfile.write(bytes("&nbsp;<a href='" + the_profile_link + "&stop=1' class='btn btn-primary'>" + lang['profile_stop'] + "</a>", "utf-8"))
+                    self.wfile.write(bytes("&nbsp;<a href='" + the_profile_link + "' class='btn btn-primary'>" + lang['update'] + "</a>", "utf-8"))
+                    self.wfile.write(bytes("&nbsp;<a href='/webif?action=profile_download&password=" + urllib.parse.quote(given_password) + "' class='btn btn-primary'>" + lang['profile_download'] + "</a>", "utf-8"))
+                    self.wfile.write(bytes("</form></center>", "utf-8"))
+                    if the_capture is not None:
+                        the_links = ""
+                        for the_sort_key in profile_sort_keys:
+                            the_links += "<a href='" + the_profile_link + "&sort=" + the_sort_key + "' class='btn btn-primary'>" + ("<b>" + the_sort_key + "</b>" if the_sort_key == the_sort else the_sort_key) + "</a>&nbsp;"
+                        self.wfile.write(bytes("<center>" + the_links + "</center>", "utf-8"))
+                        self.wfile.write(bytes("<pre style=\"margin-left: 15px; margin-right: 15px; font-size:12px;\">" + html.escape(the_capture.get_top(the_sort, profile_top_count)) + "</pre>", "utf-8"))
+                    self.wfile.write(bytes("<center><a href='/webif?password=" + urllib.parse.quote(given_password) +"' class='btn btn-primary'>" + lang['back'] + "</a></center><br>", "utf-8"))
+
+                elif query_components["action"] == "log":
+                    the_level = query_components.get("level", "INFO")
+                    if the_level not in log_levels:
+                        the_level = "INFO"
+                    the_filter = urllib.parse.unquote_plus(query_components.get("filter", ""))
+                    write_sub_head_line (self, lang["log"])
+                    self.wfile.write(bytes("<center><form id=\"log_form\" action=\"webif\" method=\"get\">", "utf-8"))
+                    self.wfile.write(bytes("<input type=\"hidden\" id= \"action\" name= \"action\" value=\"log\">", "utf-8"))
+                    self.wfile.write(bytes("<input type=\"hidden\" id= \"password\" name= \"password\" value=\""+urllib.parse.quote(given_password)+"\">", "utf-8"))
+                    self.wfile.write(bytes("<input type=\"hidden\" id= \"level\" name= \"level\" value=\""+the_level+"\">", "utf-8"))
+                    self.wfile.write(bytes("<div style=\"margin-left:50px; margin-right:50px ; width:80%;\">", "utf-8"))
+                    write_input_text (self, "filter", "filter", lang["log_filter"], html.escape(the_filter, True), False)
+                    self.wfile.write(bytes("</div>", "utf-8"))
+                    the_links = ""
+                    for the_link_level in log_levels:
+                        the_links += "<a href='/webif?action=log&password=" + urllib.parse.quote(given_password) + "&level=" + the_link_level + "&filter=" + urllib.parse.quote_plus(the_filter) + "' class='btn btn-primary'>" + ("<b>" + the_link_level + "</b>" if the_link_level == the_level else the_link_level) + "</a>&nbsp;"
+                    self.wfile.write(bytes(lang["log_level"] + ": " + the_links + "<input type=\"submit\" class='btn btn-primary' value=\"" + lang['log_filter'] + "\" />", "utf-8"))
+                    self.wfile.write(bytes("</form></center>", "utf-8"))
+                    the_lines = []
+                    if log_ring is not None:
+                        for the_created, the_level_name, the_message in log_ring.get_records(the_level, the_filter, 500):
+                            the_lines.append(time.strftime("%H:%M:%S", time.localtime(the_created)) + " " + the_level_name.ljust(7) + " " + html.escape(the_message))
+                    self.wfile.write(bytes("<pre style=\"margin-left: 15px; margin-right: 15px; font-size:12px; white-space: pre-wrap;\">" + "\n".join(the_lines) + "</pre>", "utf-8"))
+                    self.wfile.write(bytes("<center><a href='/webif?password=" + urllib.parse.quote(given_password) +"' class='btn btn-primary'>" + lang['back'] + "</a></center><br>", "utf-8"))
+
                 else:
                     self.wfile.write(bytes("else action", "utf-8"))
             else:
                 self.wfile.write(bytes("<center><a class='btn btn-primary' href='/webif?action=m2h_config&password=" + urllib.parse.quote(given_password) +"'>1. "+lang['config_mystron2ha']+"</a></center>", "utf-8"))
                 self.wfile.write(bytes("<p></p>", "utf-8"))
                 self.wfile.write(bytes("<center><a class='btn btn-primary' href='/webif?action=search_button&password=" + urllib.parse.quote(given_password) +"'>2. "+lang['add_button']+"</a></center>", "utf-8"))
+                self.wfile.write(bytes("<p></p>", "utf-8"))
+                self.wfile.write(bytes("<center><a class='btn btn-primary' href='/webif?action=log&password=" + urllib.parse.quote(given_password) +"'>"+lang['log']+"</a></center>", "utf-8"))
+                self.wfile.write(bytes("<p></p>", "utf-8"))
+                self.wfile.write(bytes("<center><a class='btn btn-primary' href='/webif?action=profile&password=" + urllib.parse.quote(given_password) +"'>"+lang['profile']+"</a></center>", "utf-8"))
 
 
             write_web_footer_page (self)
 
-        elif self.path == '/start_button_search' :
-            button_search_running = True
-            set_button_ips(self)
-            button_search_running = False
-            if (len(button_ips) < 1 ):
+        elif self.path.startswith('/button_search_events') :
+            # server-sent events of a running search: job id, progress, every found device and done
+            the_job = start_button_search(query_components.get("id"))
+            self.wfile.content_type = "text/event-stream"
+            self.wfile.extra_headers.append(("Cache-Control", "no-cache"))
+            try:
+                self.wfile.write(bytes("event: job\ndata: " + the_job.id + "\n\n", "utf-8"))
+                self.wfile.flush()
+                the_count = 0
+                the_progress = -1
+                the_done = False
+                while not the_done:
+                    the_new_progress, the_new_found, the_done = the_job.wait_change(the_count, the_progress, 15)
+                    the_events = ""
+                    for the_ip, the_type, the_mac in the_new_found:
+                        the_events += "event: found\ndata: " + json.dumps({"ip": the_ip, "type": the_type, "mac": the_mac, "text": get_button_found_text(the_ip, the_type, the_mac)}) + "\n\n"
+                    the_count += len(the_new_found)
+                    if the_new_progress != the_progress:
+                        the_progress = the_new_progress
+                        the_events += "event: progress\ndata: " + str(the_progress) + "\n\n"
+                    if the_done:
+                        the_events += "event: done\ndata: " + str(the_count) + "\n\n"
+                    self.wfile.write(bytes(the_events or ": keepalive\n\n", "utf-8"))
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionError):
+                pass
+
+        elif self.path.startswith('/start_button_search') :
+            the_job = start_button_search(query_components.get("id"))
+            the_job.wait_done(120)
+            if "id" not in query_components.keys():
+                # without id the page did not get the devices as events
+                for the_ip, the_type, the_mac in list(the_job.found):
+                    self.wfile.write(bytes("</p><p style=\"margin-left: 15px; font-size:22px;\">"+get_button_found_text(the_ip, the_type, the_mac)+"</p><p style=\"margin-left: 15px; font-size:22px;\">", "utf-8"))
+            if (len(the_job.found) < 1 ):
                 write_sub_head_line (self, lang["no_button_found"])
                 self.wfile.write(bytes("<center><button class='btn btn-primary' onclick=\"start_search(); update_state(); \">"+lang['button_search']+"</button>", "utf-8"))
                 self.wfile.write(bytes("&nbsp;<button class='btn btn-primary' onclick=\"history.back(); \">"+lang['back']+"</button></center>\n", "utf-8"))
@@ -694,9 +2999,16 @@ class button_server_handler(BaseHTTPRequestHandler):
                 self.wfile.write(bytes("&nbsp;<button class='btn btn-primary' onclick=\"history.back(); \">"+lang['back']+"</button></center>\n", "utf-8"))
 
         elif self.path == '/button_search_state' :
-            global the_percentage
-            self.wfile.write(bytes(the_percentage, "utf-8"))
+            the_job = button_search
+            if worker_count > 1:
+                the_job = read_shared_state("search")
+                self.wfile.write(bytes(str(the_job["progress"]) + "%" if the_job is not None else "", "utf-8"))
+            else:
+                self.wfile.write(bytes(str(the_job.progress) + "%" if the_job is not None else "", "utf-8"))
         
+        elif self.path == '/report_queue_state' :
+            self.wfile.write(bytes(get_report_queue_state(), "utf-8"))
+
         elif self.path == '/exit' :
             end_ha2mqtt = True
             write_web_top_page (self, "/?x=")
@@ -710,182 +3022,13 @@ class button_server_handler(BaseHTTPRequestHandler):
             logging.info("test request content connection")
 
         elif self.path.startswith( '/button_report' ):
-            print("hier button_report, path:" + self.path)
-            done_trigger="done"
-
+            logging.debug("button_report %s", self.path)
+            the_recorder = recorder
+            if the_recorder is not None:
+                the_recorder.record(self.path.partition("?")[2])
             if "mac" in query_components.keys() and "action" in query_components.keys():
-                #request from myStrom button
-                if "battery" in query_components.keys():
-                    #is Gen1
-                    the_mac = query_components["mac"]                    
-                    the_button_name = "myStrom_Button_Gen1_"+the_mac
-                    the_battery = query_components["battery"]                    
-                    the_action = query_components["action"]
-                    the_wheel = "0"
-                    the_trigger = ""              
-                    if the_action == "1":
-                        the_trigger="single"
-                    elif the_action == "2":
-                        the_trigger="double"
-                    elif the_action == "3":
-                        the_trigger="long"
-                    elif the_action == "4":
-                        the_trigger="touch"
-                    elif the_action == "5":
-                        the_wheel = int(query_components["wheel"])
-                        if the_wheel < 0 :
-                            the_trigger="turn_left"
-                        else:
-                            the_trigger="turn_right"
-                    elif the_action == "6":
-                        the_trigger="battery"
-                    elif the_action == "11":
-                        the_trigger="turn_ended"
-
-                    # Actions:
-                    # SINGLE = 1
-                    # DOUBLE=2
-                    # LONG=3
-                    # TOUCH=4
-                    # WHEEL=5
-                    # WHEEL_FINAL=11
-                    # BATTERY=6              
-
-                    # Now MQTT to trigger HA
-                    # print("hier: button request:"+the_response_json)
-                    try:
-                        the_toplevel_topic = my_config["mqtt_base_topic"]
-                        the_topic = the_toplevel_topic +"/button/"
-                        try:
-                            the_mqtt_client = mqtt_client.Client(mqtt_client.CallbackAPIVersion.VERSION2,"mystrom2ha_client_"+the_mac)
-                        except:
-                            the_mqtt_client = mqtt_client.Client("mystrom2ha_client_"+the_mac)
-                        if my_config["mqtt_user"] != "":
-                            the_mqtt_client.username_pw_set(my_config["mqtt_user"], my_config["mqtt_password"])
-                        the_mqtt_client.connect(my_config["mqtt_ip"], port=int(my_config["mqtt_port"]), keepalive=60, bind_address="")
-                        the_mqtt_client.publish(the_topic+the_mac+"/action",the_trigger)
-                        the_mqtt_client.publish(the_topic+the_mac+"/action",done_trigger)
-                        if the_action == "5":
-                            the_mqtt_client.publish(the_topic+the_mac+"/action/turn",str(the_wheel))
-                        the_mqtt_client.publish(the_topic+the_mac+"/battery",the_battery)
-                        the_mqtt_client.publish(the_topic+the_mac+"/json","{\"action\":\"" + the_trigger + "\",\"name\":\""+the_button_name+"\",\"mac\":\""+the_mac+"\"}")
-                        the_mqtt_client.publish(the_topic+the_mac+"/json","{\"action\":\"" + done_trigger + "\",\"name\":\""+the_button_name+"\",\"mac\":\""+the_mac+"\"}")
-                        the_homeassistant_topic = my_config["mqtt_ha_topic"]
-                        if (the_homeassistant_topic.endswith("/")):
-                            the_homeassistant_topic = the_homeassistant_topic[:-1]
-                        the_mqtt_client.publish(the_homeassistant_topic+"/sensor/"+the_mac+"/battery/config","{\"device\": {\"identifiers\":[\""+the_mac+"\"], \"name\":\""+the_button_name+"(mystrom)\",\"model\":\"button"+"\",\"manufacturer\":\"myStrom\"},\"device_class\": \"battery\", \"entity_category\":\"diagnostic\", \"enabled_by_default\": true, \"name\": \"mystrom_"+the_button_name+"_battery\",  \"state_class\":  \"measurement\", \"unique_id\":\""+the_mac+"_battery\", \"state_topic\": \""+the_topic+the_mac+"/battery"+"\", \"unit_of_measurement\": \"%\" }")
-                        the_mqtt_client.publish(the_homeassistant_topic+"/sensor/"+the_mac+"/action/config","{\"device\": {\"identifiers\":[\""+the_mac+"\"], \"name\":\""+the_button_name+"(mystrom)\",\"model\":\"button"+"\",\"manufacturer\":\"myStrom\"}, \"enabled_by_default\": true, \"state_topic\": \""+the_topic+the_mac+"/json\", \"name\": \"mystrom_"+the_button_name+"_action\", \"unique_id\":\""+the_mac+"_action\", \"value_template\": \"{{ value_json.action}}\" }")
-
-                    except Exception as ex:
-                        logging.error("error button_report Gen1 - "+str(ex))
-
-                elif "bat" in query_components.keys():
-                    #Gen2
-                    the_mac = query_components["mac"]                    
-                    the_name = "myStrom_Button_Gen2_"+the_mac
-                    the_voltage = float(query_components["bat"])
-                    if the_voltage > 4.0:
-                        the_battery = "100"
-                    elif the_voltage < 3.0:
-                        the_battery = "0"
-                    else:
-                        the_battery = str (  round(  (the_voltage - 3.0) * 100 / ( 4.0 - 3.0)  )  )
-                    the_action = query_components["action"]
-                    the_sub_button = query_components["index"]
-                    the_index_string = query_components["index"]+"/"
-                    the_index = query_components["index"]
-                    the_temp = query_components["temp"]
-                    the_rh = query_components["rh"]
-                    the_trigger = ""              
-                    if the_action == "1":
-                        the_trigger="single"
-                    elif the_action == "2":
-                        the_trigger="double"
-                    elif the_action == "3":
-                        the_trigger="long"
-                    elif the_action == "6":
-                        the_trigger="battery"
-                    
-                    # Actions:
-                    # SINGLE = 1
-                    # DOUBLE=2
-                    # LONG=3
-                    # TOUCH=4
-                    # WHEEL=5
-                    # WHEEL_FINAL=11
-                    # BATTERY=6              
-
-                    # Now HA Mqtt
-                    try:
-                        the_toplevel_topic = my_config["mqtt_base_topic"]
-                        the_topic = the_toplevel_topic +"/button/"
-                        try:
-                            the_mqtt_client = mqtt_client.Client(mqtt_client.CallbackAPIVersion.VERSION2,"mystrom2ha_client_"+the_mac)
-                        except:
-                            the_mqtt_client = mqtt_client.Client("mystrom2ha_client_"+the_mac)
-                        if my_config["mqtt_user"] != "":
-                            the_mqtt_client.username_pw_set(my_config["mqtt_user"], my_config["mqtt_password"])
-                        the_mqtt_client.connect(my_config["mqtt_ip"], port=int(my_config["mqtt_port"]), keepalive=60, bind_address="")
-                        the_mqtt_client.publish(the_topic+the_mac+"/action",the_index + "-" + the_trigger)
-                        the_mqtt_client.publish(the_topic+the_mac+"/action",the_index + "-" + done_trigger)
-                        the_mqtt_client.publish(the_topic+the_mac+"/temp",the_temp)
-                        the_mqtt_client.publish(the_topic+the_mac+"/rh",the_rh)
-                        the_mqtt_client.publish(the_topic+the_mac+"/battery",the_battery)
-                        the_mqtt_client.publish(the_topic+the_mac+"/name",the_name)
-                        the_mqtt_client.publish(the_topic+the_mac+"/json","{\"action\":\"" + the_index + "-" + the_trigger + "\",\"name\":\""+the_name+"\",\"mac\":\""+the_mac+"\", \"temp\":\""+the_temp+"\", \"rh\":\""+the_rh+"\"}")
-                        the_mqtt_client.publish(the_topic+the_mac+"/json","{\"action\":\"" + the_index + "-" + done_trigger + "\",\"name\":\""+the_name+"\",\"mac\":\""+the_mac+"\", \"temp\":\""+the_temp+"\", \"rh\":\""+the_rh+"\"}")
-                        the_homeassistant_topic = my_config["mqtt_ha_topic"]
-                        if (the_homeassistant_topic.endswith("/")):
-                            the_homeassistant_topic = the_homeassistant_topic[:-1]
-                        the_mqtt_client.publish(the_homeassistant_topic+"/sensor/"+the_mac+"/battery/config","{\"device\": {\"identifiers\":[\""+the_mac+"\"], \"name\":\""+the_name+"(mystrom)\",\"model\":\"Button plus Gen2\",\"manufacturer\":\"myStrom\"},\"device_class\": \"battery\", \"entity_category\":\"diagnostic\", \"enabled_by_default\": true, \"name\": \"mystrom_"+the_name+"_battery\",  \"state_class\":  \"measurement\", \"unique_id\":\""+the_mac+"_battery\", \"state_topic\": \""+the_topic+the_mac+"/battery"+"\", \"unit_of_measurement\": \"%\" }")
-                        the_mqtt_client.publish(the_homeassistant_topic+"/sensor/"+the_mac+"/action/config","{\"device\": {\"identifiers\":[\""+the_mac+"\"], \"name\":\""+the_name+"(mystrom)\",\"model\":\"Button plus Gen2\",\"manufacturer\":\"myStrom\"}, \"enabled_by_default\": true, \"state_topic\": \""+the_topic+the_mac+"/json\", \"name\": \"mystrom_"+the_name+"_action\", \"unique_id\":\""+the_mac+"_action\", \"value_template\": \"{{ value_json.action}}\" }")
-                        the_mqtt_client.publish(the_homeassistant_topic+"/sensor/"+the_mac+"/temp/config","{\"device\": {\"identifiers\":[\""+the_mac+"\"], \"name\":\""+the_name+"(mystrom)\",\"model\":\"Button plus Gen2\",\"manufacturer\":\"myStrom\"}, \"enabled_by_default\": true, \"state_topic\": \""+the_topic+the_mac+"/json\", \"name\": \"mystrom_"+the_name+"_temp\", \"unique_id\":\""+the_mac+"_temp\", \"value_template\": \"{{ value_json.temp}}\" }")
-
-                    except Exception as ex:
-                        logging.error("error button_report Gen2 - "+str(ex))
-
-                elif "value" in query_components.keys():
-                    #is PIR
-                    the_mac = query_components["mac"]
-                    the_name = "myStrom_PIR_"+the_mac                    
-                    the_light_intensity = query_components["value"]                    
-                    the_action = query_components["action"]
-                    if the_action == "8":
-                        the_trigger="rise"
-                    elif the_action == "9":
-                        the_trigger="fall"
-                    elif the_action == "14":
-                        the_trigger="night"
-                    elif the_action == "15":
-                        the_trigger="twilight"
-                    elif the_action == "16":
-                        the_trigger="day"
-
-                    # Now MQTT
-                    try:
-                        the_toplevel_topic = my_config["mqtt_base_topic"]
-                        the_topic = the_toplevel_topic +"/button/"
-                        try:
-                            the_mqtt_client = mqtt_client.Client(mqtt_client.CallbackAPIVersion.VERSION2,"mystrom2ha_client_"+the_mac)
-                        except:
-                            the_mqtt_client = mqtt_client.Client("mystrom2ha_client_"+the_mac)
-                        if my_config["mqtt_user"] != "":
-                            the_mqtt_client.username_pw_set(my_config["mqtt_user"], my_config["mqtt_password"])
-                        the_mqtt_client.connect(my_config["mqtt_ip"], port=int(my_config["mqtt_port"]), keepalive=60, bind_address="")
-                        the_mqtt_client.publish(the_topic+the_mac+"/action",the_trigger)
-                        the_mqtt_client.publish(the_topic+the_mac+"/action",done_trigger)
-                        the_mqtt_client.publish(the_topic+the_mac+"/name",the_name)
-                        the_mqtt_client.publish(the_topic+the_mac+"/light",the_light_intensity)
-                        the_mqtt_client.publish(the_topic+the_mac+"/json","{\"action\":\"" + the_trigger + "\",\"name\":\""+the_name+"\",\"mac\":\""+the_mac+"\", \"light\":\""+the_light_intensity+"\" }")
-                        the_mqtt_client.publish(the_topic+the_mac+"/json","{\"action\":\"" + done_trigger + "\",\"name\":\""+the_name+"\",\"mac\":\""+the_mac+"\", \"light\":\""+the_light_intensity+"\" }")
-                        the_homeassistant_topic = my_config["mqtt_ha_topic"]
-                        if (the_homeassistant_topic.endswith("/")):
-                            the_homeassistant_topic = the_homeassistant_topic[:-1]
-                        the_mqtt_client.publish(the_homeassistant_topic+"/sensor/"+the_mac+"/motion/config","{\"device\": {\"identifiers\":[\""+the_mac+"\"], \"name\":\""+the_name+"(mystrom)\",\"model\":\"PIR\",\"manufacturer\":\"myStrom\"}, \"enabled_by_default\": true, \"state_topic\": \""+the_topic+the_mac+"/json\", \"name\": \"mystrom_"+the_name+"_motion\", \"unique_id\":\""+the_mac+"_motion\", \"value_template\": \"{{ value_json.action}}\" }")
-                        the_mqtt_client.publish(the_homeassistant_topic+"/sensor/"+the_mac+"/light/config","{\"device\": {\"identifiers\":[\""+the_mac+"\"], \"name\":\""+the_name+"(mystrom)\",\"model\":\"PIR\",\"manufacturer\":\"myStrom\"}, \"enabled_by_default\": true, \"state_topic\": \""+the_topic+the_mac+"/json\", \"name\": \"mystrom_"+the_name+"_light\", \"unique_id\":\""+the_mac+"_light\", \"value_template\": \"{{ value_json.light}}\" }")
-                                
-                    except Exception as ex:
-                        logging.error("error button_report PIR - "+str(ex))
+                #request from myStrom button, answered right away and published by a report_publisher_thread (of the owner worker)
+                route_button_report(query_components, self.client_address[0])
             ### End button_report
 
 
@@ -907,9 +3050,159 @@ class button_server_handler(BaseHTTPRequestHandler):
             logging.info("login request")
 
 
+class asyncio_response_writer:
+    # file-like wfile for button_server_handler; hands every write over to the event loop
+    def __init__(self, the_loop, the_writer):
+        self.loop = the_loop
+        self.writer = the_writer
+        self.loop_thread = threading.current_thread()
+
+    def write(self, the_data):
+        if threading.current_thread() is self.loop_thread:
+            self.writer.write(the_data)
+        else:
+            self.loop.call_soon_threadsafe(self.writer.write, bytes(the_data))
+        return len(the_data)
+
+    def flush(self):
+        pass
+
+class asyncio_request_handler(button_server_handler):
+    # runs the normal do_GET / do_HEAD on a request that was read by the event loop
+    def __init__(self, the_client_address, the_request, the_wfile, the_requests_left):
+        self.client_address = the_client_address
+        self.server = None
+        self.connection = None
+        self.rfile = io.BytesIO(the_request)
+        self.wfile = the_wfile
+        self.close_connection = True
+        self.requests_left = the_requests_left
+        self.command = None
+        self.raw_requestline = self.rfile.readline(65537)
+
+    def parse(self):
+        return self.parse_request()
+
+    def runs_inline(self):
+        # only cheap routes stay on the event loop, everything that can block goes to the executor
+        if urllib.parse.urlsplit(self.path).path.endswith(tuple(static_types)):
+            return True
+        if self.path in ('/button_search_state', '/report_queue_state', '/metrics', '/test'):
+            return True
+        if self.path.startswith('/button_report'):
+            # with --workers a report may wait for its owner worker on the unix socket
+            return worker_count == 1
+        return False
+
+    def run(self):
+        the_method = getattr(self, 'do_' + self.command, None)
+        if the_method is None:
+            self.send_error(HTTPStatus.NOT_IMPLEMENTED, "Unsupported method (%r)" % self.command)
+        else:
+            the_method()
+
+async def asyncio_handle_connection(the_reader, the_writer):
+    the_loop = asyncio.get_running_loop()
+    try:
+        the_wfile = asyncio_response_writer(the_loop, the_writer)
+        # asyncio leaves Nagle on for sockets created with proto 0, see disable_nagle_algorithm
+        the_writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # an idle connection costs no thread here, so no keepalive_max_connections
+        for the_requests_left in range(keepalive_max_requests, 0, -1):
+            the_timeout = 30 if the_requests_left == keepalive_max_requests else keepalive_idle_timeout
+            the_request = await asyncio.wait_for(the_reader.readuntil(b"\r\n\r\n"), timeout=the_timeout)
+            the_handler = asyncio_request_handler(the_writer.get_extra_info("peername"), the_request, the_wfile, the_requests_left)
+            if not the_handler.parse():
+                break
+            if the_handler.runs_inline():
+                the_handler.run()
+            else:
+                await the_loop.run_in_executor(None, the_handler.run)
+            await the_writer.drain()
+            if the_handler.close_connection:
+                break
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+        pass
+    except Exception as ex:
+        logging.error("error asyncio request - "+str(ex))
+    finally:
+        the_writer.close()
+        try:
+            await the_writer.wait_closed()
+        except Exception:
+            pass
+
+async def asyncio_server_main():
+    global end_ha2mqtt
+    the_loop = asyncio.get_running_loop()
+    # the same amount of workers as the threaded mode, but only for the blocking routes
+    the_loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=20, thread_name_prefix="mystrom2ha_worker"))
+    the_server = await asyncio.start_server(asyncio_handle_connection, sock=sock, backlog=1024)
+    logging.info("asyncio server started ... ")
+    async with the_server:
+        while not end_ha2mqtt:
+            await asyncio.sleep(1)
+    logging.info("asyncio server stopped.")
+
+def run_workers(the_count):
+    # parent of --workers: forks the workers before any thread runs and returns in each of them,
+    # restarts a worker that dies and stops all when one ends on purpose (/exit) or on SIGTERM
+    global worker_index
+    import signal
+    the_workers = {}
+
+    def stop_workers(the_signal=None, the_frame=None):
+        for the_pid in list(the_workers.keys()):
+            try:
+                os.kill(the_pid, signal.SIGTERM)
+            except OSError:
+                pass
+        sys.exit(0)
+
+    def start_worker(the_index):
+        the_pid = os.fork()
+        if the_pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            # logging of the parent (stderr) is not for the worker, setup_logging follows
+            logging.root.handlers = []
+            return True
+        the_workers[the_pid] = the_index
+        return False
+
+    for the_index in range(the_count):
+        if start_worker(the_index):
+            worker_index = the_index
+            return
+    signal.signal(signal.SIGTERM, stop_workers)
+    signal.signal(signal.SIGINT, stop_workers)
+    while True:
+        the_pid, the_status = os.wait()
+        the_index = the_workers.pop(the_pid, None)
+        if the_index is None:
+            continue
+        if os.WIFEXITED(the_status) and os.WEXITSTATUS(the_status) == 0:
+            stop_workers()
+        print("worker " + str(the_index) + " ended with status " + str(the_status) + ", restarting", file=sys.stderr)
+        time.sleep(worker_restart_delay)
+        if start_worker(the_index):
+            worker_index = the_index
+            return
 
 
 if __name__ == "__main__":
+    the_parser = argparse.ArgumentParser(description="MyStrom2HA - forwards myStrom button and PIR events to Homeassistant via MQTT")
+    the_parser.add_argument("--port", type=int, default=button_request_port, help="http port for the web interface and the button reports")
+    the_parser.add_argument("--asyncio", action="store_true", help="serve all connections from one asyncio event loop instead of 20 listening threads")
+    the_parser.add_argument("--startup-profile", action="store_true", help="print the time of every startup phase")
+    the_parser.add_argument("--log-level", default="INFO", choices=log_levels, help="lowest level kept in the log page of the web interface (the log file keeps ERROR)")
+    the_parser.add_argument("--workers", type=int, default=int(os.environ.get('MYSTROM2HA_WORKERS', 1)), help="processes sharing the port with SO_REUSEPORT, each with its own MQTT client, the reports of a device always go to the same one")
+    the_args = the_parser.parse_args()
+    button_request_port = the_args.port
+    startup_profile = the_args.startup_profile
+    worker_count = max(1, the_args.workers)
+    startup_phase("start")
+
 
     my_local_ip = get_local_ip()
     try:
@@ -921,41 +3214,79 @@ if __name__ == "__main__":
     except Exception:
         access_password = 'mystrom2ha'
 
-    format = "%(asctime)s - MyStrom2HA: %(message)s"
-    logging.basicConfig(format=format, level=logging.ERROR,
-                        datefmt="%H:%M:%S", filename=get_script_directory() + '/mystrom2ha.log', filemode='w')
+    if worker_count > 1:
+        # compacted once here, the workers only append to it
+        device_registry().load(get_script_directory() + '/devices.jsonl')
+        run_workers(worker_count)
+
+    setup_logging(the_args.log_level)
+    startup_phase("local ip and logging")
     read_config()
+    update_report_recorder()
+    startup_phase("config")
+    read_discovery_cache()
+    startup_phase("discovery cache")
+    load_static_assets()
+    startup_phase("static assets")
+    start_report_publishers()
 
     button_ips = []
-    the_found_button_type = {}
-    the_found_button_mac = {}
-
-    print("")
-    print("##############################################")
-    the_title = "MyStrom2HA"
-    print("#" + the_title.center(44) +"#")
-    print("#                 access via                 #")
+    registry = device_registry()
+    registry.load(get_script_directory() + '/devices.jsonl', worker_count == 1)
+    startup_phase("device registry")
+    journal = report_journal()
+    # every worker replays its own journal
+    journal.load(get_script_directory() + ('/journal.jsonl' if worker_index == 0 else '/journal_' + str(worker_index) + '.jsonl'))
+    journal_replay_thread()
+    startup_phase("journal")
+    battery_poll_thread()
+    update_beacon_listener()
+    if worker_count > 1:
+        config_watch_thread()
+        start_report_route()
+    threading.Thread(target=start_mqtt_publisher_background, daemon=True).start()
+
     the_url = "http://" + my_local_ip + ":" + str(button_request_port)
-    print("#"+ the_url.center(44)  + "#")
-    print("##############################################")
-    logging.error("Starting mystrom2ha on "+the_url)
+    if worker_index == 0:
+        print("")
+        print("##############################################")
+        the_title = "MyStrom2HA"
+        print("#" + the_title.center(44) +"#")
+        print("#                 access via                 #")
+        print("#"+ the_url.center(44)  + "#")
+        print("##############################################")
+    logging.error("Starting mystrom2ha on "+the_url+(" (worker " + str(worker_index) + ")" if worker_count > 1 else ""))
 
     # start content server
     # Create the content server socket.
     addr = ('', button_request_port)
     sock = socket.socket (socket.AF_INET, socket.SOCK_STREAM)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if worker_count > 1:
+        # every worker binds the port, the kernel spreads the connections
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     sock.bind(addr)
-    sock.listen(5)
 
-    #start 20 listening threads for the socket
-    [button_thread(i) for i in range(20)]
+    if the_args.asyncio:
+        import asyncio
+        startup_phase("asyncio import")
+        if startup_profile:
+            print_startup_profile()
+        asyncio.run(asyncio_server_main())
+    else:
+        sock.listen(5)
+
+        #start 20 listening threads for the socket
+        [button_thread(i) for i in range(20)]
 
-    logging.info("request answer threads started ... ")
+        logging.info("request answer threads started ... ")
+        startup_phase("http server")
+        if startup_profile:
+            print_startup_profile()
 
-    while end_ha2mqtt != True:
-        sleep_time = 5
-        time.sleep(sleep_time)
+        while end_ha2mqtt != True:
+            sleep_time = 5
+            time.sleep(sleep_time)
 
     logging.info("server done.")
 
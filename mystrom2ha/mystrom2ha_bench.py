@@ -0,0 +1,707 @@
+#!/usr/local/bin/python3
+#   File : mystrom2ha_bench.py
+#   Author: ingo.keutgen@computeq.co
+#   Date: 18.10.2026
+#   Description : Load generator to benchmark the MyStrom2HA http server
+#   Code ownership : This code is owned by ComputeQ UG, Pelm Germany
+#                    If you want to use or reuse the code or part of it
+#                    please contact dev@computeq.co
+#
+# examples
+# benchmark a running instance:
+#   python3 mystrom2ha_bench.py load --port 32570 --requests 2000 --concurrency 100
+# start the threaded and the asyncio server side by side and compare them:
+#   python3 mystrom2ha_bench.py compare --requests 2000 --concurrency 200 --idle-connections 25
+# replay a realistic mix of Gen1, Gen2 and PIR reports against a private instance and count the MQTT messages:
+#   python3 mystrom2ha_bench.py reports --spawn --mix gen1=50,gen2=30,pir=20 --devices 20 --requests 5000 --rate 200
+# the same against a running instance whose MQTT server is set to this machine, port 18830:
+#   python3 mystrom2ha_bench.py reports --port 32570 --broker-port 18830 --requests 5000
+# time the /button_report decoder and fuzz it with mutations of button_report_corpus.txt:
+#   python3 mystrom2ha_bench.py decode --iterations 200000 --mutations 2000
+# connections opened for the web interface and for repeated reports, one per request against keep-alive:
+#   python3 mystrom2ha_bench.py churn --requests 2000 --concurrency 10
+# throughput with --workers 1 to 4, loaded from 4 client processes, then checks that every device was published in order:
+#   python3 mystrom2ha_bench.py scaling --max-workers 4 --clients 4 --requests 4000
+# replay reports.rec (recorded with report_record = 1) at 10x speed, save it as baseline, later compare a change against it:
+#   python3 mystrom2ha_bench.py replay --capture reports.rec --speed 10 --save-baseline baseline.json
+#   python3 mystrom2ha_bench.py replay --capture reports.rec --speed 10 --baseline baseline.json
+
+import os
+import sys
+import random
+import json
+import time
+import shutil
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+import concurrent.futures
+
+default_report_path = "/button_report?mac=A1B2C3D4E5F6&action=1&battery=87"
+# what a browser fetches for the search page while the search runs
+webui_paths = ["/webif?action=search_button&password=mystrom2ha", "/mystrom2ha.css", "/login_icon.jpg"] + ["/button_search_state"] * 7
+
+
+class mqtt_stand_in(threading.Thread):
+    # just enough of a MQTT 3.1.1 broker to accept connections and count the publishes
+    def __init__(self, the_port=0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.lock = threading.Lock()
+        self.published = 0
+        self.by_kind = {}
+        # payloads of the <mac>/json topics in arrival order, for the order check
+        self.json_payloads = {}
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", the_port))
+        self.sock.listen(64)
+        self.port = self.sock.getsockname()[1]
+        self.start()
+
+    def run(self):
+        while True:
+            the_connection, the_address = self.sock.accept()
+            threading.Thread(target=self.serve, args=(the_connection,), daemon=True).start()
+
+    def read_exactly(self, the_connection, the_length):
+        the_data = b""
+        while len(the_data) < the_length:
+            the_chunk = the_connection.recv(the_length - len(the_data))
+            if not the_chunk:
+                raise EOFError()
+            the_data += the_chunk
+        return the_data
+
+    def serve(self, the_connection):
+        try:
+            while True:
+                the_header = self.read_exactly(the_connection, 1)[0]
+                the_type = the_header >> 4
+                the_length = 0
+                the_multiplier = 1
+                while True:
+                    the_byte = self.read_exactly(the_connection, 1)[0]
+                    the_length += (the_byte & 127) * the_multiplier
+                    the_multiplier *= 128
+                    if not the_byte & 128:
+                        break
+                the_body = self.read_exactly(the_connection, the_length)
+                if the_type == 1:
+                    # CONNECT -> CONNACK
+                    the_connection.sendall(b"\x20\x02\x00\x00")
+                elif the_type == 3:
+                    the_qos = (the_header >> 1) & 3
+                    the_packet_id = self.on_publish(the_body, the_qos)
+                    if the_qos == 1:
+                        the_connection.sendall(b"\x40\x02" + the_packet_id)
+                elif the_type == 8:
+                    # SUBSCRIBE -> SUBACK with qos 0
+                    the_connection.sendall(b"\x90\x03" + the_body[:2] + b"\x00")
+                elif the_type == 12:
+                    # PINGREQ -> PINGRESP
+                    the_connection.sendall(b"\xd0\x00")
+                elif the_type == 14:
+                    break
+        except (EOFError, OSError):
+            pass
+        finally:
+            the_connection.close()
+
+    def on_publish(self, the_body, the_qos):
+        the_topic_length = int.from_bytes(the_body[:2], "big")
+        the_topic = the_body[2:2 + the_topic_length].decode("utf-8", "replace")
+        the_kind = "config" if the_topic.endswith("/config") else the_topic.rsplit("/", 1)[-1]
+        with self.lock:
+            self.published += 1
+            self.by_kind[the_kind] = self.by_kind.get(the_kind, 0) + 1
+            if the_kind == "json":
+                self.json_payloads.setdefault(the_topic, []).append(the_body[2 + the_topic_length + (2 if the_qos else 0):])
+        return the_body[2 + the_topic_length:4 + the_topic_length] if the_qos else b""
+
+    def snapshot(self):
+        with self.lock:
+            return self.published, dict(self.by_kind)
+
+    def wait_quiet(self, the_quiet_time=1.0, the_timeout=30):
+        # the instance publishes from its queues after answering, wait until nothing arrives any more
+        the_last = -1
+        t_end = time.time() + the_timeout
+        while time.time() < t_end:
+            the_count = self.snapshot()[0]
+            if the_count == the_last:
+                return
+            the_last = the_count
+            time.sleep(the_quiet_time)
+
+
+class report_generator:
+    # realistic /button_report query strings of a set of devices
+    def __init__(self, the_mix, the_devices, the_seed):
+        self.random = random.Random(the_seed)
+        self.devices = []
+        the_total = sum(the_mix.values())
+        for the_kind, the_share in sorted(the_mix.items()):
+            for i in range(max(1, round(the_devices * the_share / the_total)) if the_share > 0 else 0):
+                the_mac = "%s%06X" % ({"gen1": "A1B2C3", "gen2": "B1C2D3", "pir": "C1D2E3"}[the_kind], len(self.devices))
+                self.devices.append({"kind": the_kind, "mac": the_mac, "battery": self.random.randint(20, 100), "bat": self.random.uniform(3.2, 4.1),
+                                     "temp": self.random.uniform(18, 24), "rh": self.random.uniform(30, 60), "light": self.random.randint(0, 500), "wheel": 0})
+
+    def next_path(self):
+        the_device = self.random.choice(self.devices)
+        the_mac = the_device["mac"]
+        if the_device["kind"] == "gen1":
+            if the_device["wheel"] > 0:
+                # a knob turn is a burst of action 5 steps followed by action 11
+                the_device["wheel"] -= 1
+                if the_device["wheel"] == 0:
+                    return "/button_report?mac=%s&action=11&battery=%d" % (the_mac, the_device["battery"])
+                return "/button_report?mac=%s&action=5&wheel=%d&battery=%d" % (the_mac, self.random.choice((-3, -2, -1, 1, 2, 3)), the_device["battery"])
+            the_action = self.random.choices(("1", "2", "3", "4", "5"), (50, 15, 10, 5, 20))[0]
+            if the_action == "5":
+                the_device["wheel"] = self.random.randint(5, 30)
+                return "/button_report?mac=%s&action=5&wheel=%d&battery=%d" % (the_mac, self.random.choice((-1, 1)), the_device["battery"])
+            return "/button_report?mac=%s&action=%s&battery=%d" % (the_mac, the_action, the_device["battery"])
+        if the_device["kind"] == "gen2":
+            the_device["temp"] += self.random.uniform(-0.1, 0.1)
+            the_device["rh"] += self.random.uniform(-0.5, 0.5)
+            return "/button_report?mac=%s&action=%s&index=%d&bat=%.2f&temp=%.1f&rh=%.1f" % (
+                the_mac, self.random.choices(("1", "2", "3"), (70, 20, 10))[0], self.random.randint(1, 4), the_device["bat"], the_device["temp"], the_device["rh"])
+        the_device["light"] = max(0, the_device["light"] + self.random.randint(-20, 20))
+        return "/button_report?mac=%s&action=%s&value=%d" % (the_mac, self.random.choices(("8", "9", "14", "15", "16"), (45, 45, 4, 3, 3))[0], the_device["light"])
+
+
+def spawn_instance(the_port, the_mqtt_port, the_extra_args):
+    # run a private copy of mystrom2ha.py in a temporary directory, so config.json and logs stay apart
+    the_directory = tempfile.mkdtemp(prefix="mystrom2ha_bench_")
+    the_source = os.path.join(os.path.dirname(os.path.realpath(__file__)), "mystrom2ha.py")
+    shutil.copy(the_source, the_directory)
+    for the_name in ("mystrom2ha.css", "login_icon.jpg"):
+        shutil.copy(os.path.join(os.path.dirname(the_source), the_name), the_directory)
+    the_config = {"lang": "EN", "mystrom2ha_ip": "127.0.0.1", "mqtt_ip": "127.0.0.1", "mqtt_port": str(the_mqtt_port),
+                  "mqtt_ha_topic": "homeassistant", "mqtt_base_topic": "mystrom2ha", "mqtt_user": "", "mqtt_password": ""}
+    with open(os.path.join(the_directory, "config.json"), "w") as f:
+        json.dump(the_config, f)
+    the_process = subprocess.Popen([sys.executable, os.path.join(the_directory, "mystrom2ha.py"), "--port", str(the_port)] + the_extra_args,
+                                   cwd=the_directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    t_end = time.time() + 15
+    while time.time() < t_end:
+        try:
+            socket.create_connection(("127.0.0.1", the_port), timeout=0.2).close()
+            # give the mqtt publisher a moment to connect to the stand-in
+            time.sleep(1)
+            return the_process, the_directory
+        except OSError:
+            time.sleep(0.1)
+    the_process.kill()
+    raise RuntimeError("instance on port " + str(the_port) + " did not start")
+
+def stop_instance(the_process, the_directory):
+    the_process.terminate()
+    try:
+        the_process.wait(5)
+    except subprocess.TimeoutExpired:
+        the_process.kill()
+    shutil.rmtree(the_directory, ignore_errors=True)
+
+
+async def timed_request(the_host, the_port, the_path, the_timeout):
+    the_start = time.perf_counter()
+    the_writer = None
+    try:
+        the_reader, the_writer = await asyncio.wait_for(asyncio.open_connection(the_host, the_port), the_timeout)
+        the_writer.write(("GET " + the_path + " HTTP/1.0\r\nHost: " + the_host + "\r\n\r\n").encode("ascii"))
+        the_response = await asyncio.wait_for(the_reader.read(), the_timeout)
+        the_ok = the_response.startswith(b"HTTP/1.") and the_response[9:12] == b"200"
+    except (OSError, asyncio.TimeoutError):
+        the_ok = False
+    finally:
+        if the_writer is not None:
+            the_writer.close()
+    return the_ok, time.perf_counter() - the_start
+
+class keepalive_connection:
+    # one HTTP/1.1 connection of a load worker, opened again when the server closes it
+    def __init__(self, the_host, the_port):
+        self.host = the_host
+        self.port = the_port
+        self.reader = None
+        self.writer = None
+        self.opened = 0
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+
+    async def read_response(self):
+        the_head = await self.reader.readuntil(b"\r\n\r\n")
+        the_length = None
+        the_close = False
+        for the_line in the_head.split(b"\r\n")[1:]:
+            the_name, the_separator, the_value = the_line.partition(b":")
+            if the_name.lower() == b"content-length":
+                the_length = int(the_value)
+            elif the_name.lower() == b"connection" and the_value.strip().lower() == b"close":
+                the_close = True
+        if the_length is None:
+            await self.reader.read()
+            the_close = True
+        else:
+            await self.reader.readexactly(the_length)
+        if the_close:
+            self.close()
+        return the_head
+
+    async def request(self, the_path, the_timeout):
+        # a connection the server closed while idle gets one retry on a new connection
+        for the_attempt in (1, 2):
+            the_fresh = self.writer is None
+            if the_fresh:
+                self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), the_timeout)
+                self.opened += 1
+            try:
+                self.writer.write(("GET " + the_path + " HTTP/1.1\r\nHost: " + self.host + "\r\n\r\n").encode("ascii"))
+                return await asyncio.wait_for(self.read_response(), the_timeout)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                self.close()
+                if the_fresh:
+                    raise
+        raise ConnectionError("no response")
+
+async def hold_idle_connections(the_host, the_port, the_count):
+    # half sent requests, the way a slow or stuck button looks to the server
+    the_writers = []
+    for i in range(the_count):
+        try:
+            the_reader, the_writer = await asyncio.open_connection(the_host, the_port)
+            the_writer.write(b"GET " + default_report_path.encode("ascii") + b" HTTP/1.0\r\n")
+            the_writers.append(the_writer)
+        except OSError:
+            break
+    return the_writers
+
+async def run_load(the_host, the_port, the_paths, the_requests, the_concurrency, the_timeout, the_idle_connections=0, the_rate=0, the_keepalive=False):
+    # the_paths: list of paths used round robin, or a function returning the next path
+    # the_rate: requests per second, 0 sends as fast as the_concurrency allows
+    # the_keepalive: every worker keeps one HTTP/1.1 connection instead of a HTTP/1.0 connection per request
+    the_latencies = []
+    the_errors = 0
+    the_connections = []
+    the_counter = iter(range(the_requests))
+    the_idle_writers = await hold_idle_connections(the_host, the_port, the_idle_connections)
+    the_loop_start = time.perf_counter()
+
+    async def worker():
+        nonlocal the_errors
+        the_connection = keepalive_connection(the_host, the_port)
+        the_connections.append(the_connection)
+        for i in the_counter:
+            if the_rate > 0:
+                the_delay = the_loop_start + i / the_rate - time.perf_counter()
+                if the_delay > 0:
+                    await asyncio.sleep(the_delay)
+            the_path = the_paths() if callable(the_paths) else the_paths[i % len(the_paths)]
+            if the_keepalive:
+                the_start = time.perf_counter()
+                try:
+                    the_head = await the_connection.request(the_path, the_timeout)
+                    the_ok = the_head[9:12] in (b"200", b"304")
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    the_connection.close()
+                    the_ok = False
+                the_latency = time.perf_counter() - the_start
+            else:
+                the_connection.opened += 1
+                the_ok, the_latency = await timed_request(the_host, the_port, the_path, the_timeout)
+            if the_ok:
+                the_latencies.append(the_latency)
+            else:
+                the_errors += 1
+        the_connection.close()
+
+    the_start = time.perf_counter()
+    await asyncio.gather(*[worker() for i in range(the_concurrency)])
+    the_duration = time.perf_counter() - the_start
+    for the_writer in the_idle_writers:
+        the_writer.close()
+    the_summary = summarize(the_latencies, the_errors, the_duration)
+    the_summary["connections"] = sum(the_connection.opened for the_connection in the_connections)
+    return the_summary
+
+def percentile(the_sorted_values, the_percent):
+    if not the_sorted_values:
+        return 0.0
+    the_index = min(len(the_sorted_values) - 1, int(round(the_percent / 100.0 * (len(the_sorted_values) - 1))))
+    return the_sorted_values[the_index]
+
+def summarize(the_latencies, the_errors, the_duration):
+    the_latencies.sort()
+    return {"requests": len(the_latencies) + the_errors, "errors": the_errors, "duration_s": round(the_duration, 3),
+            "throughput_rps": round(len(the_latencies) / the_duration, 1) if the_duration > 0 else 0.0,
+            "p50_ms": round(percentile(the_latencies, 50) * 1000, 2), "p95_ms": round(percentile(the_latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(the_latencies, 99) * 1000, 2)}
+
+def print_summary(the_title, the_summary):
+    print(the_title.ljust(12) + "  ".join(k + "=" + str(v) for k, v in the_summary.items()))
+
+
+def command_load(the_args):
+    the_paths = the_args.path or [default_report_path]
+    the_summary = asyncio.run(run_load(the_args.host, the_args.port, the_paths, the_args.requests, the_args.concurrency, the_args.timeout, the_args.idle_connections,
+                                       0, the_args.keepalive))
+    print_summary("load", the_summary)
+
+def run_load_process(the_arguments):
+    # one client process of the scaling command, a single asyncio client would saturate before the server
+    return asyncio.run(run_load(*the_arguments))
+
+async def send_ordered(the_host, the_port, the_macs, the_count, the_timeout):
+    # every mac sends the_count Gen2 reports one after the other like a real device, temp carries the sequence number
+    async def device(the_mac):
+        for i in range(the_count):
+            await timed_request(the_host, the_port, "/button_report?mac=%s&action=1&index=1&bat=3.90&temp=%d&rh=50.0" % (the_mac, i), the_timeout)
+    await asyncio.gather(*[device(the_mac) for the_mac in the_macs])
+
+def check_order(the_broker, the_macs, the_count):
+    # reports of a mac published out of order or missing, from the json topic of the MQTT stand-in
+    the_out_of_order = 0
+    the_missing = 0
+    with the_broker.lock:
+        the_payloads = {the_topic: list(the_list) for the_topic, the_list in the_broker.json_payloads.items()}
+    for the_mac in the_macs:
+        the_sequence = []
+        for the_payload in the_payloads.get("mystrom2ha/button/" + the_mac + "/json", []):
+            the_message = json.loads(the_payload)
+            # the "done" message repeats the sequence number of its press
+            if not the_message["action"].endswith("-done"):
+                the_sequence.append(int(the_message["temp"]))
+        the_out_of_order += sum(1 for i in range(1, len(the_sequence)) if the_sequence[i] < the_sequence[i - 1])
+        the_missing += the_count - len(set(the_sequence))
+    return the_out_of_order, the_missing
+
+def command_scaling(the_args):
+    the_paths = the_args.path or [default_report_path]
+    the_broker = mqtt_stand_in()
+    print("cores".ljust(12) + str(os.cpu_count()))
+    for the_workers in range(1, the_args.max_workers + 1):
+        the_process, the_directory = spawn_instance(the_args.port, the_broker.port, ["--workers", str(the_workers)] + (the_args.instance_arg or []))
+        the_macs = ["D1E2F3%02d%04X" % (the_workers, i) for i in range(the_args.order_devices)]
+        try:
+            the_arguments = ("127.0.0.1", the_args.port, the_paths, the_args.requests // the_args.clients, max(1, the_args.concurrency // the_args.clients), the_args.timeout, 0, 0, the_args.keepalive)
+            with concurrent.futures.ProcessPoolExecutor(max_workers=the_args.clients) as the_executor:
+                the_summaries = list(the_executor.map(run_load_process, [the_arguments] * the_args.clients))
+            asyncio.run(send_ordered("127.0.0.1", the_args.port, the_macs, the_args.order_reports, the_args.timeout))
+            the_broker.wait_quiet()
+        finally:
+            stop_instance(the_process, the_directory)
+        # the clients run side by side, their throughputs add up, the percentiles are the worst client's
+        the_summary = {"requests": sum(the_entry["requests"] for the_entry in the_summaries), "errors": sum(the_entry["errors"] for the_entry in the_summaries),
+                       "throughput_rps": round(sum(the_entry["throughput_rps"] for the_entry in the_summaries), 1)}
+        for the_key in ("p50_ms", "p95_ms", "p99_ms"):
+            the_summary[the_key] = max(the_entry[the_key] for the_entry in the_summaries)
+        the_summary["out_of_order"], the_summary["missing"] = check_order(the_broker, the_macs, the_args.order_reports)
+        print_summary("workers=" + str(the_workers), the_summary)
+
+def read_capture(the_path, the_max_gap):
+    # (seconds since the first report, path) of a reports.rec, quiet times longer than the_max_gap are shortened
+    the_entries = []
+    with open(the_path, 'r', encoding="utf-8", errors="replace") as f:
+        for the_line in f:
+            the_time, the_separator, the_query = the_line.rstrip("\n").partition(" ")
+            try:
+                the_entries.append((float(the_time), "/button_report?" + the_query))
+            except ValueError:
+                continue
+    the_entries.sort(key=lambda the_entry: the_entry[0])
+    the_capture = []
+    the_offset = 0.0
+    for i, (the_time, the_path) in enumerate(the_entries):
+        if i > 0:
+            the_offset += min(the_time - the_entries[i - 1][0], the_max_gap)
+        the_capture.append((the_offset, the_path))
+    return the_capture
+
+async def replay_load(the_host, the_port, the_capture, the_speed, the_concurrency, the_timeout):
+    # sends every report at its recorded time divided by the_speed, the_speed 0 sends as fast as the_concurrency allows
+    the_latencies = []
+    the_errors = 0
+    the_late = 0
+    the_slots = asyncio.Semaphore(the_concurrency)
+
+    async def send(the_path):
+        nonlocal the_errors
+        try:
+            the_ok, the_latency = await timed_request(the_host, the_port, the_path, the_timeout)
+        finally:
+            the_slots.release()
+        if the_ok:
+            the_latencies.append(the_latency)
+        else:
+            the_errors += 1
+
+    the_tasks = []
+    the_start = time.perf_counter()
+    for the_offset, the_path in the_capture:
+        if the_speed > 0:
+            the_delay = the_start + the_offset / the_speed - time.perf_counter()
+            if the_delay > 0:
+                await asyncio.sleep(the_delay)
+        await the_slots.acquire()
+        if the_speed > 0 and time.perf_counter() - (the_start + the_offset / the_speed) > 0.05:
+            # more than 50 ms behind the recording: the instance or this client did not keep up
+            the_late += 1
+        the_tasks.append(asyncio.ensure_future(send(the_path)))
+    await asyncio.gather(*the_tasks)
+    the_summary = summarize(the_latencies, the_errors, time.perf_counter() - the_start)
+    the_summary["late"] = the_late
+    return the_summary
+
+def compare_baseline(the_baseline, the_result, the_tolerance):
+    # returns the differences that count as a regression
+    the_regressions = []
+    if the_baseline["speed"] != the_result["speed"] or the_baseline["reports"] != the_result["reports"]:
+        print("warning".ljust(12) + "baseline was taken with speed=%s and %d reports" % (the_baseline["speed"], the_baseline["reports"]))
+    for the_key in ("broker_messages", "errors", "p50_ms", "p95_ms", "p99_ms", "throughput_rps"):
+        the_old = the_baseline["summary"][the_key]
+        the_new = the_result["summary"][the_key]
+        the_change = (the_new - the_old) * 100.0 / the_old if the_old else 0.0
+        print(the_key.ljust(16) + str(the_old).rjust(10) + " -> " + str(the_new).ljust(10) + ("%+.1f%%" % the_change))
+        if the_key in ("broker_messages", "errors") and the_new != the_old:
+            the_regressions.append(the_key)
+        elif the_key == "p95_ms" and the_new > the_old * (1 + the_tolerance / 100.0):
+            the_regressions.append(the_key)
+    for the_kind in sorted(set(the_baseline["by_topic"]) | set(the_result["by_topic"])):
+        the_old = the_baseline["by_topic"].get(the_kind, 0)
+        the_new = the_result["by_topic"].get(the_kind, 0)
+        if the_old != the_new:
+            print(("  " + the_kind).ljust(16) + str(the_old).rjust(10) + " -> " + str(the_new))
+            the_regressions.append("topic " + the_kind)
+    return the_regressions
+
+def command_replay(the_args):
+    the_capture = read_capture(the_args.capture, the_args.max_gap)
+    if not the_capture:
+        print("no reports in " + the_args.capture)
+        sys.exit(1)
+    the_speed = 0.0 if the_args.speed == "max" else float(the_args.speed)
+    the_broker = mqtt_stand_in()
+    the_process, the_directory = spawn_instance(the_args.port, the_broker.port, the_args.instance_arg or [])
+    try:
+        the_published_before = the_broker.snapshot()
+        the_summary = asyncio.run(replay_load("127.0.0.1", the_args.port, the_capture, the_speed, the_args.concurrency, the_args.timeout))
+        the_broker.wait_quiet()
+        the_published_after = the_broker.snapshot()
+    finally:
+        stop_instance(the_process, the_directory)
+    the_summary["broker_messages"] = the_published_after[0] - the_published_before[0]
+    the_summary["messages_per_event"] = round(the_summary["broker_messages"] / max(1, the_summary["requests"] - the_summary["errors"]), 2)
+    the_kinds = {k: v - the_published_before[1].get(k, 0) for k, v in the_published_after[1].items() if v - the_published_before[1].get(k, 0) > 0}
+    print("capture".ljust(12) + "reports=%d  recorded_s=%.1f  replay_s=%.1f" % (len(the_capture), the_capture[-1][0], the_capture[-1][0] / the_speed if the_speed > 0 else 0))
+    print_summary("replay", the_summary)
+    print("by topic".ljust(12) + "  ".join(k + "=" + str(v) for k, v in sorted(the_kinds.items())))
+    the_result = {"capture": the_args.capture, "speed": the_args.speed, "reports": len(the_capture), "summary": the_summary, "by_topic": the_kinds}
+    if the_args.save_baseline:
+        with open(the_args.save_baseline, "w") as f:
+            json.dump(the_result, f, indent=1)
+    if the_args.baseline:
+        with open(the_args.baseline, "r") as f:
+            the_baseline = json.load(f)
+        the_regressions = compare_baseline(the_baseline, the_result, the_args.tolerance)
+        if the_regressions:
+            print("regression".ljust(12) + ", ".join(the_regressions))
+            sys.exit(1)
+        print("baseline".ljust(12) + "ok")
+
+def command_churn(the_args):
+    # the same requests with a connection each and over kept open connections, for the web interface and for reports
+    the_broker = mqtt_stand_in()
+    the_process, the_directory = spawn_instance(the_args.port, the_broker.port, the_args.instance_arg or [])
+    try:
+        for the_title, the_paths in (("webui", webui_paths), ("reports", the_args.path or [default_report_path])):
+            for the_keepalive in (False, True):
+                the_summary = asyncio.run(run_load("127.0.0.1", the_args.port, the_paths, the_args.requests, the_args.concurrency, the_args.timeout, 0, 0, the_keepalive))
+                the_summary["connections_per_request"] = round(the_summary["connections"] / max(1, the_summary["requests"]), 3)
+                print_summary(the_title + ("/1.1" if the_keepalive else "/1.0"), the_summary)
+    finally:
+        stop_instance(the_process, the_directory)
+
+def parse_mix(the_text):
+    the_mix = {}
+    for the_entry in the_text.split(","):
+        the_kind, the_share = the_entry.split("=")
+        if the_kind not in ("gen1", "gen2", "pir"):
+            raise ValueError("unknown device kind " + the_kind)
+        the_mix[the_kind] = float(the_share)
+    return the_mix
+
+def command_reports(the_args):
+    the_generator = report_generator(parse_mix(the_args.mix), the_args.devices, the_args.seed)
+    the_broker = mqtt_stand_in(the_args.broker_port)
+    the_process = None
+    if the_args.spawn:
+        the_process, the_directory = spawn_instance(the_args.port, the_broker.port, the_args.instance_arg or [])
+    try:
+        # warm up, so the discovery configs of all devices are not part of the figures
+        for the_device in the_generator.devices:
+            asyncio.run(timed_request(the_args.host, the_args.port, the_generator.next_path(), the_args.timeout))
+        the_broker.wait_quiet()
+        the_published_before = the_broker.snapshot()
+        the_summary = asyncio.run(run_load(the_args.host, the_args.port, the_generator.next_path, the_args.requests, the_args.concurrency,
+                                           the_args.timeout, 0, the_args.rate))
+        the_broker.wait_quiet()
+        the_published_after = the_broker.snapshot()
+    finally:
+        if the_process is not None:
+            stop_instance(the_process, the_directory)
+    the_messages = the_published_after[0] - the_published_before[0]
+    the_summary["broker_messages"] = the_messages
+    the_summary["messages_per_event"] = round(the_messages / max(1, the_summary["requests"] - the_summary["errors"]), 2)
+    print_summary("reports", the_summary)
+    the_kinds = {k: v - the_published_before[1].get(k, 0) for k, v in the_published_after[1].items()}
+    print("by topic".ljust(12) + "  ".join(k + "=" + str(v) for k, v in sorted(the_kinds.items()) if v > 0))
+
+def read_corpus(the_path):
+    with open(the_path, 'r') as f:
+        return [the_line.rstrip("\n") for the_line in f if the_line.strip() and not the_line.startswith("#")]
+
+def legacy_parse_query(the_query):
+    # the parser /button_report used before parse_query, as reference for the timings
+    return dict(qc.split("=") for qc in the_query.split("&"))
+
+def mutate_query(the_random, the_query):
+    the_characters = "&=%-.0123456789AZaz_ \x00\u00e4"
+    the_choice = the_random.randrange(6)
+    the_position = the_random.randint(0, len(the_query))
+    if the_choice == 0:
+        return the_query[:the_position] + the_random.choice(the_characters) + the_query[the_position:]
+    if the_choice == 1:
+        return the_query[:the_position] + the_query[the_position + 1:]
+    if the_choice == 2:
+        return the_query[:the_position]
+    if the_choice == 3:
+        the_segments = the_query.split("&")
+        the_random.shuffle(the_segments)
+        return "&".join(the_segments)
+    if the_choice == 4:
+        return the_query + "&" + the_random.choice(("wheel", "bat", "value", "battery", "index", "action", "mac")) + "=" + the_random.choice(("", "x", "-0", "1e999", "nan", "9" * 50))
+    return the_query.replace("=", the_random.choice(("==", "", "=&")), 1)
+
+def command_decode(the_args):
+    # imported here, so the other commands do not need paho-mqtt
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import mystrom2ha
+    the_corpus = read_corpus(the_args.corpus)
+    # the timings use the reports both parsers understand
+    the_valid = []
+    for the_query in the_corpus:
+        try:
+            legacy_parse_query(the_query)
+        except ValueError:
+            continue
+        if mystrom2ha.decode_button_report(mystrom2ha.parse_query(the_query)) is not None:
+            the_valid.append(the_query)
+    for the_title, the_function in (("legacy", lambda the_query: legacy_parse_query(the_query)),
+                                    ("parse", lambda the_query: mystrom2ha.parse_query(the_query)),
+                                    ("decode", lambda the_query: mystrom2ha.decode_button_report(mystrom2ha.parse_query(the_query)))):
+        the_start = time.perf_counter()
+        for i in range(the_args.iterations):
+            the_function(the_valid[i % len(the_valid)])
+        the_duration = time.perf_counter() - the_start
+        print_summary(the_title, {"iterations": the_args.iterations, "ns_per_report": round(the_duration * 1e9 / the_args.iterations),
+                                  "reports_per_s": round(the_args.iterations / the_duration)})
+    the_random = random.Random(the_args.seed)
+    the_counts = {"decoded": 0, "rejected": 0, "crashed": 0}
+    for the_query in the_corpus:
+        for i in range(the_args.mutations + 1):
+            the_mutated = the_query if i == 0 else mutate_query(the_random, the_query)
+            for j in range(the_random.randint(0, 2) if i else 0):
+                the_mutated = mutate_query(the_random, the_mutated)
+            try:
+                the_event = mystrom2ha.decode_button_report(mystrom2ha.parse_query(the_mutated))
+                if the_event is not None and (not isinstance(the_event.wheel, int) or the_event.trigger is None):
+                    raise ValueError("inconsistent event")
+                the_counts["decoded" if the_event is not None else "rejected"] += 1
+            except Exception as ex:
+                the_counts["crashed"] += 1
+                print("crash: " + repr(the_mutated) + " - " + str(ex))
+    print_summary("fuzz", the_counts)
+    if the_counts["crashed"]:
+        sys.exit(1)
+
+def command_compare(the_args):
+    the_paths = the_args.path or [default_report_path]
+    the_broker = mqtt_stand_in()
+    for the_mode, the_extra_args in (("threaded", []), ("asyncio", ["--asyncio"])):
+        the_process, the_directory = spawn_instance(the_args.port, the_broker.port, the_extra_args)
+        try:
+            the_summary = asyncio.run(run_load("127.0.0.1", the_args.port, the_paths, the_args.requests, the_args.concurrency, the_args.timeout, the_args.idle_connections))
+        finally:
+            stop_instance(the_process, the_directory)
+        print_summary(the_mode, the_summary)
+
+
+if __name__ == "__main__":
+    the_parser = argparse.ArgumentParser(description="MyStrom2HA benchmark")
+    the_commands = the_parser.add_subparsers(dest="command", required=True)
+    the_load = the_commands.add_parser("load", help="load a running instance")
+    the_load.add_argument("--host", default="127.0.0.1")
+    the_compare = the_commands.add_parser("compare", help="spawn the threaded and the asyncio server and load both")
+    the_reports = the_commands.add_parser("reports", help="realistic button reports, counts the MQTT messages per report")
+    the_reports.add_argument("--host", default="127.0.0.1")
+    the_reports.add_argument("--spawn", action="store_true", help="start a private instance connected to the MQTT stand-in")
+    the_reports.add_argument("--instance-arg", action="append", help="extra argument for the spawned instance, e.g. --instance-arg=--asyncio")
+    the_reports.add_argument("--broker-port", type=int, default=0, help="port of the MQTT stand-in (default: any free port)")
+    the_reports.add_argument("--mix", default="gen1=50,gen2=30,pir=20", help="share of the device kinds")
+    the_reports.add_argument("--devices", type=int, default=20)
+    the_reports.add_argument("--rate", type=float, default=0, help="reports per second, 0 = as fast as possible")
+    the_reports.add_argument("--seed", type=int, default=1)
+    the_churn = the_commands.add_parser("churn", help="spawn an instance and compare a connection per request with keep-alive")
+    the_churn.add_argument("--instance-arg", action="append", help="extra argument for the spawned instance, e.g. --instance-arg=--asyncio")
+    the_scaling = the_commands.add_parser("scaling", help="spawn an instance with --workers 1 to --max-workers and load each")
+    the_scaling.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    the_scaling.add_argument("--clients", type=int, default=4, help="load generating processes")
+    the_scaling.add_argument("--keepalive", action="store_true", help="one HTTP/1.1 connection per client worker instead of one per request")
+    the_scaling.add_argument("--instance-arg", action="append", help="extra argument for the spawned instance, e.g. --instance-arg=--asyncio")
+    the_scaling.add_argument("--order-devices", type=int, default=8, help="devices of the per-mac order check after the load")
+    the_scaling.add_argument("--order-reports", type=int, default=50, help="reports each of these devices sends one after the other")
+    the_replay = the_commands.add_parser("replay", help="spawn an instance, replay a reports.rec capture and compare with a saved baseline")
+    the_replay.add_argument("--capture", required=True, help="reports.rec of an instance with report_record = 1")
+    the_replay.add_argument("--speed", default="1", help="1 = as recorded, N = N times faster, max = as fast as --concurrency allows")
+    the_replay.add_argument("--max-gap", type=float, default=10.0, help="longer quiet times of the capture are shortened to this many seconds")
+    the_replay.add_argument("--save-baseline", help="write the result as baseline json")
+    the_replay.add_argument("--baseline", help="compare with this baseline, exit 1 on a regression")
+    the_replay.add_argument("--tolerance", type=float, default=20.0, help="allowed p95 latency increase against the baseline in percent")
+    the_replay.add_argument("--instance-arg", action="append", help="extra argument for the spawned instance, e.g. --instance-arg=--asyncio")
+    the_decode = the_commands.add_parser("decode", help="microbenchmark and fuzz the /button_report decoder")
+    the_decode.add_argument("--corpus", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "button_report_corpus.txt"))
+    the_decode.add_argument("--iterations", type=int, default=200000)
+    the_decode.add_argument("--mutations", type=int, default=1000, help="mutations per corpus entry")
+    the_decode.add_argument("--seed", type=int, default=1)
+    the_load.add_argument("--keepalive", action="store_true", help="one HTTP/1.1 connection per worker instead of one per request")
+    for the_command in (the_load, the_compare, the_reports, the_churn, the_scaling, the_replay):
+        the_command.add_argument("--port", type=int, default=32570 if the_command is the_load else 32571)
+        the_command.add_argument("--path", action="append", help="request path, can be repeated (default: a Gen1 single click)")
+        the_command.add_argument("--requests", type=int, default=2000)
+        the_command.add_argument("--concurrency", type=int, default=100)
+        the_command.add_argument("--timeout", type=float, default=5.0)
+        the_command.add_argument("--idle-connections", type=int, default=0, help="connections that send half a request and then stall")
+    the_args = the_parser.parse_args()
+    if the_args.command == "load":
+        command_load(the_args)
+    elif the_args.command == "reports":
+        command_reports(the_args)
+    elif the_args.command == "decode":
+        command_decode(the_args)
+    elif the_args.command == "churn":
+        command_churn(the_args)
+    elif the_args.command == "scaling":
+        command_scaling(the_args)
+    elif the_args.command == "replay":
+        command_replay(the_args)
+    else:
+        command_compare(the_args)
@@ -1,13 +1,20 @@
 #!/bin/bash
+# paho-mqtt comes with the image, only an image built without it installs it here (once, not on every restart)
+/usr/local/bin/python -c "import paho.mqtt.client" 2>/dev/null || /usr/local/bin/pip install paho-mqtt
+cp /mystrom2ha/mystrom2ha.py /data/mystrom2ha.py
+ln -sf /mystrom2ha/login_icon.jpg /data/login_icon.jpg
+ln -sf /mystrom2ha/mystrom2ha.css /data/mystrom2ha.css
+cd /data
+restart_delay=0.5
 while [ 1 ]
 do 
-	#Installing required package
-	/usr/local/bin/pip install paho-mqtt
 	echo "Starting MyStrom2HA"
-    cp /mystrom2ha/mystrom2ha.py /data/mystrom2ha.py
-    ln -s /mystrom2ha/login_icon.jpg /data/login_icon.jpg
-    ln -s /mystrom2ha/mystrom2ha.css /data/mystrom2ha.css
-	cd /data
+	started=$(date +%s)
 	python mystrom2ha.py
-	sleep 30
+	# restart at once after a crash, back off up to 30 s while it keeps crashing within a minute
+	if [ $(( $(date +%s) - started )) -ge 60 ]; then
+		restart_delay=0.5
+	fi
+	sleep $restart_delay
+	restart_delay=$(awk "BEGIN { d = $restart_delay * 2; print (d > 30 ? 30 : d) }")
 done